@@ -0,0 +1,437 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.preprocessing import LabelEncoder
+
+ML_MODELS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FRAUD_DIR = os.path.join(ML_MODELS_DIR, 'fraud_detection')
+sys.path.insert(0, FRAUD_DIR)
+
+from sklearn.metrics import roc_auc_score
+from load_generator import batching_sweep, prefork_scaling, stage_timing_overhead
+from xgboost_model import FraudDetectionXGBoost, load_fraud_artifact
+
+CATEGORIES = ['online_retail', 'electronics', 'luxury_goods', 'travel', 'subscription', 'gambling']
+LOCATIONS = ['San Francisco, CA', 'New York, NY', 'unknown', 'tor_network', 'vpn']
+DEVICES = ['Chrome/Mac', 'Firefox/Windows', 'Safari/iOS', 'AndroidApp', 'emulator']
+
+
+def synthetic_transactions(n, seed=0, n_users=1000, fraud_rate=0.02, signal=0.0, drift=0.0,
+                           start='2024-01-01'):
+    """Transactions shaped like the augmented credit-card training set
+
+    Labels are random unless `signal` is set, which ties fraud odds to the
+    device, location and decline history. `drift` additionally makes
+    gambling merchants riskier, to simulate a shift after training.
+    """
+    rng = np.random.default_rng(seed)
+    offsets = np.sort(rng.integers(0, 48 * 3600, size=n))
+    df = pd.DataFrame({
+        'amount': np.round(rng.lognormal(mean=3.5, sigma=1.2, size=n), 2),
+        'timestamp': pd.Timestamp(start) + pd.to_timedelta(offsets, unit='s'),
+        'userId': 'user_' + pd.Series(rng.integers(0, n_users, size=n)).astype(str),
+        'merchantCategory': rng.choice(CATEGORIES, size=n),
+        'location': rng.choice(LOCATIONS, size=n),
+        'deviceInfo': rng.choice(DEVICES, size=n),
+        'previousDeclines': rng.poisson(lam=0.1, size=n),
+        'velocityLastHour': rng.poisson(lam=0.5, size=n),
+    })
+    logit = np.full(n, np.log(fraud_rate / (1 - fraud_rate)))
+    logit += signal * (
+        2.0 * (df['deviceInfo'] == 'emulator')
+        + 1.5 * df['location'].isin(['tor_network', 'vpn'])
+        + 1.0 * df['previousDeclines']
+        - 1.0
+    ).to_numpy(dtype=float)
+    logit += drift * 2.5 * (df['merchantCategory'] == 'gambling').to_numpy(dtype=float)
+    df['isFraud'] = (rng.random(n) < 1 / (1 + np.exp(-logit))).astype(int)
+    return df
+
+
+def synthetic_instances(n, seed=0):
+    """Request payloads for the invocations endpoint"""
+    df = synthetic_transactions(n, seed=seed)
+    df['timestamp'] = df['timestamp'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+    return df.to_dict('records')
+
+
+def load_or_train_model(path=None, train_rows=20000):
+    """Load the committed model, or train a small one on synthetic data"""
+    path = path or os.path.join(FRAUD_DIR, 'fraud_model.joblib')
+    model = FraudDetectionXGBoost()
+    if os.path.exists(path):
+        model.load_model(path)
+    else:
+        model.train(synthetic_transactions(train_rows, seed=1))
+    return model
+
+
+def time_call(fn, repeats):
+    """Best-of-N wall clock time in seconds"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def bench_batch(model, sizes=(1, 10, 100, 1000), repeats=3):
+    """Per-row cost of looped `predict` against `predict_batch`"""
+    print(f"{'batch':>6} {'loop us/row':>12} {'batch us/row':>13} {'speedup':>8}")
+    results = []
+    for size in sizes:
+        instances = synthetic_instances(size, seed=size)
+        loop = time_call(lambda: [model.predict(dict(inst)) for inst in instances], repeats)
+        batch = time_call(lambda: model.predict_batch(instances), repeats)
+        results.append({'batch_size': size, 'loop_us_per_row': loop / size * 1e6,
+                        'batch_us_per_row': batch / size * 1e6})
+        print(f"{size:>6} {loop / size * 1e6:>12.1f} {batch / size * 1e6:>13.1f} {loop / batch:>7.1f}x")
+    return results
+
+
+def latency_percentiles(fn, inputs):
+    """p50/p99 latency in microseconds of calling `fn` once per input"""
+    samples = np.empty(len(inputs))
+    for i, item in enumerate(inputs):
+        start = time.perf_counter()
+        fn(item)
+        samples[i] = time.perf_counter() - start
+    return np.percentile(samples, 50) * 1e6, np.percentile(samples, 99) * 1e6
+
+
+def bench_fast(model, requests=2000):
+    """Single-transaction latency of `predict` against `predict_fast`"""
+    instances = synthetic_instances(requests, seed=7)
+    reference = np.array([model.predict(dict(inst)) for inst in instances[:200]])
+    fast = np.array([model.predict_fast(inst) for inst in instances[:200]])
+    max_diff = float(np.abs(reference - fast).max())
+
+    slow_p50, slow_p99 = latency_percentiles(lambda inst: model.predict(dict(inst)), instances[:max(requests // 10, 1)])
+    fast_p50, fast_p99 = latency_percentiles(model.predict_fast, instances)
+    print(f"{'path':>8} {'p50 us':>10} {'p99 us':>10}")
+    print(f"{'pandas':>8} {slow_p50:>10.1f} {slow_p99:>10.1f}")
+    print(f"{'native':>8} {fast_p50:>10.1f} {fast_p99:>10.1f}")
+    print(f"max |predict - predict_fast| over 200 requests: {max_diff:.2e}")
+    return {'pandas_p50_us': slow_p50, 'pandas_p99_us': slow_p99,
+            'native_p50_us': fast_p50, 'native_p99_us': fast_p99, 'max_abs_diff': max_diff}
+
+
+def legacy_encode(label_encoders, df):
+    """Per-row `LabelEncoder.transform` lookup used before the lookup-table encoder"""
+    for col, le in label_encoders.items():
+        df[f'{col}_encoded'] = df[col].astype(str).map(
+            lambda x: le.transform([x])[0] if x in le.classes_ else -1
+        )
+    return df
+
+
+def bench_encode(model, sizes=(1000, 10000, 100000), repeats=3):
+    """Categorical encoding cost of the legacy per-row path against the lookup table"""
+    encoder = model.categorical_encoder
+    label_encoders = {}
+    for col, classes in encoder.classes_.items():
+        label_encoders[col] = LabelEncoder()
+        label_encoders[col].classes_ = classes
+
+    print(f"{'rows':>8} {'legacy ms':>10} {'lookup ms':>10} {'speedup':>8}")
+    results = []
+    for size in sizes:
+        df = synthetic_transactions(size, seed=size)
+        df.loc[df.index[::50], 'deviceInfo'] = 'unseen_device'
+        legacy_df = legacy_encode(label_encoders, df.copy())
+        lookup_df = encoder.transform(df.copy())
+        encoded = [f'{col}_encoded' for col in encoder.classes_]
+        assert (legacy_df[encoded].to_numpy() == lookup_df[encoded].to_numpy()).all()
+
+        legacy = time_call(lambda: legacy_encode(label_encoders, df.copy()), repeats)
+        lookup = time_call(lambda: encoder.transform(df.copy()), repeats)
+        results.append({'rows': size, 'legacy_ms': legacy * 1e3, 'lookup_ms': lookup * 1e3})
+        print(f"{size:>8} {legacy * 1e3:>10.1f} {lookup * 1e3:>10.1f} {legacy / lookup:>7.1f}x")
+    return results
+
+
+def legacy_prepare_features(df):
+    """`prepare_features` before vectorization: row-count velocity and Python callbacks"""
+    df['hour'] = pd.to_datetime(df['timestamp']).dt.hour
+    df['day_of_week'] = pd.to_datetime(df['timestamp']).dt.dayofweek
+    df['is_weekend'] = df['day_of_week'].isin([5, 6]).astype(int)
+    df['is_night'] = ((df['hour'] < 6) | (df['hour'] > 22)).astype(int)
+    df['amount_log'] = np.log1p(df['amount'])
+    df['amount_zscore'] = (df['amount'] - df['amount'].mean()) / df['amount'].std()
+    df['velocity_1h'] = df.groupby('userId')['amount'].transform(
+        lambda x: x.rolling(window=10, min_periods=1).count()
+    )
+    df['velocity_amount_1h'] = df.groupby('userId')['amount'].transform(
+        lambda x: x.rolling(window=10, min_periods=1).sum()
+    )
+    user_stats = df.groupby('userId').agg({
+        'amount': ['mean', 'std', 'count'],
+        'merchantCategory': lambda x: x.nunique()
+    }).round(2)
+    user_stats.columns = ['user_avg_amount', 'user_std_amount', 'user_tx_count', 'user_merchant_diversity']
+    df = df.merge(user_stats, left_on='userId', right_index=True, how='left')
+    merchant_stats = df.groupby('merchantCategory').agg({
+        'amount': ['mean', 'count'],
+        'isFraud': 'mean'
+    }).round(4)
+    merchant_stats.columns = ['merchant_avg_amount', 'merchant_tx_count', 'merchant_fraud_rate']
+    return df.merge(merchant_stats, left_on='merchantCategory', right_index=True, how='left')
+
+
+def bench_features(sizes=(100000, 1000000, 10000000), legacy=True):
+    """Feature preparation throughput of the legacy and vectorized pipelines"""
+    model = FraudDetectionXGBoost()
+    print(f"{'rows':>10} {'legacy s':>10} {'vectorized s':>13} {'rows/s':>12}")
+    results = []
+    for size in sizes:
+        df = synthetic_transactions(size, seed=size)
+        df['timestamp'] = df['timestamp'].astype(str)
+        start = time.perf_counter()
+        features = model.prepare_features(df.copy())
+        vectorized = time.perf_counter() - start
+
+        legacy_s = float('nan')
+        if legacy:
+            start = time.perf_counter()
+            reference = legacy_prepare_features(df.copy())
+            legacy_s = time.perf_counter() - start
+            same = [c for c in reference.columns if not c.startswith('velocity')]
+            pd.testing.assert_frame_equal(reference[same], features[same], check_dtype=False)
+
+        results.append({'rows': size, 'legacy_s': legacy_s, 'vectorized_s': vectorized})
+        print(f"{size:>10} {legacy_s:>10.2f} {vectorized:>13.2f} {size / vectorized:>12.0f}")
+        del df, features
+    return results
+
+
+def bench_load(model, repeats=5):
+    """Load time of the joblib pickle against the versioned artifact directory"""
+    with tempfile.TemporaryDirectory() as root:
+        joblib_path = os.path.join(root, 'fraud_model.joblib')
+        model.save_model(joblib_path)
+        artifact_path = model.save_artifact(os.path.join(root, 'artifacts'))
+
+        instances = synthetic_instances(100, seed=11)
+        from_joblib, from_artifact = FraudDetectionXGBoost(), FraudDetectionXGBoost()
+        from_joblib.load_model(joblib_path)
+        from_artifact.load_artifact(artifact_path)
+        max_diff = float(np.abs(from_joblib.predict_batch(instances) - from_artifact.predict_batch(instances)).max())
+
+        joblib_s = time_call(lambda: FraudDetectionXGBoost().load_model(joblib_path), repeats)
+        artifact_s = time_call(lambda: FraudDetectionXGBoost().load_artifact(artifact_path), repeats)
+
+    print(f"{'format':>10} {'load ms':>10}")
+    print(f"{'joblib':>10} {joblib_s * 1e3:>10.1f}")
+    print(f"{'artifact':>10} {artifact_s * 1e3:>10.1f}")
+    print(f"max |joblib - artifact| score over 100 requests: {max_diff:.2e}")
+    return {'joblib_ms': joblib_s * 1e3, 'artifact_ms': artifact_s * 1e3, 'max_abs_diff': max_diff}
+
+
+def bench_update(base_rows=20000, batches=3, batch_rows=2000, holdout_rows=5000, rounds=10):
+    """Cost and holdout AUC of incremental updates against a full retrain
+
+    The base model is trained on one period; labeled batches from a later,
+    drifted period then arrive one at a time. Every strategy starts from the
+    same base artifact and is scored on a held-out slice of the drifted data.
+    """
+    base = synthetic_transactions(base_rows, seed=1, signal=1.0)
+    later = synthetic_transactions(batches * batch_rows + holdout_rows, seed=2, signal=1.0,
+                                   drift=1.0, start='2024-01-03')
+    new_batches = [later.iloc[i * batch_rows:(i + 1) * batch_rows].reset_index(drop=True)
+                   for i in range(batches)]
+    holdout = later.iloc[batches * batch_rows:].reset_index(drop=True)
+    holdout_instances = holdout.drop(columns=['isFraud']).to_dict('records')
+
+    def holdout_auc(model):
+        return roc_auc_score(holdout['isFraud'], model.predict_batch([dict(inst) for inst in holdout_instances]))
+
+    results = []
+    with tempfile.TemporaryDirectory() as root:
+        base_model = FraudDetectionXGBoost()
+        base_model.train(base.copy())
+        artifact_path = base_model.save_artifact(root, publish=False)
+        results.append({'strategy': 'base', 'seconds_per_update': 0.0,
+                        'auc': holdout_auc(load_fraud_artifact(artifact_path)),
+                        'trees': base_model.model.get_booster().num_boosted_rounds()})
+
+        for mode in ('append', 'refresh'):
+            model = load_fraud_artifact(artifact_path)
+            seconds = []
+            for batch in new_batches:
+                start = time.perf_counter()
+                model = model.update(batch.copy(), mode=mode, num_boost_round=rounds)
+                seconds.append(time.perf_counter() - start)
+            results.append({'strategy': mode, 'seconds_per_update': float(np.mean(seconds)),
+                            'auc': holdout_auc(model),
+                            'trees': model.model.get_booster().num_boosted_rounds()})
+
+        retrained = FraudDetectionXGBoost()
+        start = time.perf_counter()
+        retrained.train(pd.concat([base] + new_batches, ignore_index=True))
+        results.append({'strategy': 'retrain', 'seconds_per_update': time.perf_counter() - start,
+                        'auc': holdout_auc(retrained),
+                        'trees': retrained.model.get_booster().num_boosted_rounds()})
+
+    print(f"{'strategy':>10} {'s/update':>10} {'holdout AUC':>12} {'trees':>6}")
+    for row in results:
+        print(f"{row['strategy']:>10} {row['seconds_per_update']:>10.3f} {row['auc']:>12.4f} {row['trees']:>6}")
+    return results
+
+
+def bench_prescreen(train_rows=20000, calibration_rows=20000, requests=5000, max_miss_rate=0.001):
+    """Short-circuit rate, agreement and latency of the prescreen cascade
+
+    The model is trained on labeled synthetic data with signal, so the
+    prescreen has genuinely safe traffic to find; it is calibrated and then
+    scored on separate request sets.
+    """
+    model = FraudDetectionXGBoost()
+    model.train(synthetic_transactions(train_rows, seed=1, signal=1.0))
+    model.fit_prescreen(synthetic_transactions(calibration_rows, seed=5, signal=1.0), max_miss_rate=max_miss_rate)
+
+    instances = synthetic_transactions(requests, seed=6, signal=1.0).drop(columns=['isFraud'])
+    instances['timestamp'] = instances['timestamp'].dt.strftime('%Y-%m-%dT%H:%M:%S')
+    instances = instances.to_dict('records')
+
+    full = np.array([model.predict_fast(inst) for inst in instances])
+    model.prescreen.reset_stats()
+    cascade = np.array([model.predict_cascade(inst) for inst in instances])
+    stats = model.prescreen.stats()
+    short = np.array([model.prescreen.score(inst) is not None for inst in instances])
+    missed = int(((full >= 0.4) & short).sum())
+
+    full_p50, full_p99 = latency_percentiles(model.predict_fast, instances)
+    cascade_p50, cascade_p99 = latency_percentiles(model.predict_cascade, instances)
+    batch_full = time_call(lambda: model.predict_batch(instances), 3)
+    batch_cascade = time_call(lambda: model.predict_batch_cascade(instances), 3)
+
+    print(f"{'path':>8} {'p50 us':>10} {'p99 us':>10} {'batch ms':>10}")
+    print(f"{'full':>8} {full_p50:>10.1f} {full_p99:>10.1f} {batch_full * 1e3:>10.1f}")
+    print(f"{'cascade':>8} {cascade_p50:>10.1f} {cascade_p99:>10.1f} {batch_cascade * 1e3:>10.1f}")
+    print(f"short-circuit rate: {stats['short_circuit_rate']:.1%} "
+          f"(calibration {model.prescreen.calibration['short_circuit_rate']:.1%})")
+    print(f"latency saved over {requests} requests: {stats['latency_saved_seconds'] * 1e3:.1f} ms")
+    print(f"alerts missed: {missed} of {int((full >= 0.4).sum())}; "
+          f"max |cascade - full| on short-circuited: {float(np.abs(cascade - full)[short].max(initial=0)):.4f}")
+    return dict(stats, full_p50_us=full_p50, full_p99_us=full_p99,
+                cascade_p50_us=cascade_p50, cascade_p99_us=cascade_p99,
+                batch_full_ms=batch_full * 1e3, batch_cascade_ms=batch_cascade * 1e3, alerts_missed=missed)
+
+
+def bench_batching(model, requests=20000, clients=16, configs=((8, 200), (32, 500), (64, 1000))):
+    """Micro-batched `predict_fast_batch` against one `predict_fast` per request"""
+    instances = synthetic_instances(requests, seed=8)
+    return batching_sweep(model.predict_fast, model.predict_fast_batch, instances, clients, configs)
+
+
+def bench_prefork(model, worker_counts, requests=5000, clients=16, asgi=False):
+    """Requests per second through gunicorn with 1..N prefork workers"""
+    bodies = [json.dumps(instance).encode() for instance in synthetic_instances(requests, seed=9)]
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'fraud_model.joblib')
+        model.save_model(path)
+        return prefork_scaling(FRAUD_DIR, 'FRAUD', '/fraud-xgboost-endpoint-local', bodies, worker_counts, clients,
+                               env={'ml_models/fraud_detection': path}, mode='asgi' if asgi else 'gunicorn')
+
+
+def bench_stages(model, requests=5000):
+    """Stage timing overhead on the native path and through the Flask endpoint"""
+    import xgboost_model
+    xgboost_model.model_holder.swap(model, 'bench')
+    instances = synthetic_instances(requests, seed=11)
+    client = xgboost_model.app.test_client()
+
+    def invoke(instance):
+        client.post('/fraud-xgboost-endpoint-local/invocations', json=instance)
+
+    return stage_timing_overhead(xgboost_model, 'fraud', {
+        'predict_fast': (model.predict_fast, instances),
+        'endpoint': (invoke, instances[:requests // 5]),
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Fraud model micro-benchmarks')
+    parser.add_argument('--model', default=None, help='path to a saved fraud model')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    batch = sub.add_parser('batch', help='per-row cost of batch scoring')
+    batch.add_argument('--sizes', type=int, nargs='+', default=[1, 10, 100, 1000])
+    batch.add_argument('--repeats', type=int, default=3)
+
+    encode = sub.add_parser('encode', help='categorical encoding cost')
+    encode.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    encode.add_argument('--repeats', type=int, default=3)
+
+    fast = sub.add_parser('fast', help='single-request latency of the native Booster path')
+    fast.add_argument('--requests', type=int, default=2000)
+
+    features = sub.add_parser('features', help='prepare_features scaling on large frames')
+    features.add_argument('--sizes', type=int, nargs='+', default=[100000, 1000000, 10000000])
+    features.add_argument('--no-legacy', dest='legacy', action='store_false',
+                          help='skip timing the pre-vectorization pipeline')
+
+    load = sub.add_parser('load', help='model load time, joblib against artifact directory')
+    load.add_argument('--repeats', type=int, default=5)
+
+    update = sub.add_parser('update', help='incremental update cost and AUC drift against a full retrain')
+    update.add_argument('--base-rows', type=int, default=20000)
+    update.add_argument('--batches', type=int, default=3)
+    update.add_argument('--batch-rows', type=int, default=2000)
+    update.add_argument('--rounds', type=int, default=10)
+
+    prescreen = sub.add_parser('prescreen', help='short-circuit rate and latency of the prescreen cascade')
+    prescreen.add_argument('--requests', type=int, default=5000)
+    prescreen.add_argument('--max-miss-rate', type=float, default=0.001)
+
+    batching = sub.add_parser('batching', help='micro-batched scoring under concurrent clients')
+    batching.add_argument('--requests', type=int, default=20000)
+    batching.add_argument('--clients', type=int, default=16)
+
+    stages = sub.add_parser('stages', help='per-stage latency breakdown and the overhead of timing it')
+    stages.add_argument('--requests', type=int, default=5000)
+
+    prefork = sub.add_parser('prefork', help='HTTP throughput scaling with prefork workers under gunicorn')
+    prefork.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    prefork.add_argument('--requests', type=int, default=5000)
+    prefork.add_argument('--clients', type=int, default=16)
+    prefork.add_argument('--asgi', action='store_true', help='serve through the ASGI front end')
+
+    args = parser.parse_args()
+    if args.bench == 'features':
+        bench_features(args.sizes, args.legacy)
+        return
+    if args.bench == 'update':
+        bench_update(args.base_rows, args.batches, args.batch_rows, rounds=args.rounds)
+        return
+    if args.bench == 'prescreen':
+        bench_prescreen(requests=args.requests, max_miss_rate=args.max_miss_rate)
+        return
+
+    model = load_or_train_model(args.model)
+
+    if args.bench == 'batch':
+        bench_batch(model, args.sizes, args.repeats)
+    elif args.bench == 'encode':
+        bench_encode(model, args.sizes, args.repeats)
+    elif args.bench == 'fast':
+        bench_fast(model, args.requests)
+    elif args.bench == 'load':
+        bench_load(model, args.repeats)
+    elif args.bench == 'batching':
+        bench_batching(model, args.requests, args.clients)
+    elif args.bench == 'stages':
+        bench_stages(model, args.requests)
+    elif args.bench == 'prefork':
+        bench_prefork(model, args.workers, args.requests, args.clients, args.asgi)
+
+
+if __name__ == '__main__':
+    main()
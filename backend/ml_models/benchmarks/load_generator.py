@@ -0,0 +1,296 @@
+import http.client
+import os
+from contextlib import contextmanager
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+import numpy as np
+
+ML_MODELS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ML_MODELS_DIR, 'serving'))
+
+from micro_batcher import MicroBatcher
+from stage_metrics import StageMetrics
+
+
+def closed_loop(fn, items, clients):
+    """Run `fn(item)` for every item from `clients` threads, each waiting on its own call
+
+    Returns throughput in calls per second and the per-call latencies in
+    microseconds.
+    """
+    latencies = np.empty(len(items))
+    next_index = iter(range(len(items)))
+    index_lock = threading.Lock()
+    errors = []
+
+    def client():
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                fn(items[i])
+            except Exception as e:
+                errors.append(e)
+            latencies[i] = time.perf_counter() - start
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    if errors:
+        raise errors[0]
+    return len(items) / elapsed, latencies * 1e6
+
+
+def summarize(throughput, latencies_us):
+    """Throughput and latency percentiles; the percentiles are NaN when no call succeeded"""
+    percentiles = np.percentile(latencies_us, [50, 95, 99]) if len(latencies_us) else [np.nan] * 3
+    return {
+        'throughput_per_s': throughput,
+        'p50_us': float(percentiles[0]),
+        'p95_us': float(percentiles[1]),
+        'p99_us': float(percentiles[2]),
+    }
+
+
+def batching_sweep(direct_fn, batch_fn, items, clients, configs):
+    """Throughput and tail latency of direct calls against micro-batching settings
+
+    `configs` is a list of (max_batch, max_wait_us) pairs; each runs the same
+    items through a fresh `MicroBatcher(batch_fn, ...)`.
+    """
+    rows = [dict(summarize(*closed_loop(direct_fn, items, clients)), mode='direct')]
+    for max_batch, max_wait_us in configs:
+        batcher = MicroBatcher(batch_fn, max_batch=max_batch, max_wait_us=max_wait_us)
+        batcher.start()
+        try:
+            row = summarize(*closed_loop(batcher.submit, items, clients))
+        finally:
+            batcher.stop()
+        rows.append(dict(row, mode=f'batch {max_batch}/{max_wait_us}us',
+                         mean_batch_size=batcher.stats()['mean_batch_size']))
+
+    print(f"{clients} concurrent clients, {len(items)} requests")
+    print(f"{'mode':>18} {'req/s':>9} {'p50 us':>9} {'p99 us':>9} {'mean batch':>11}")
+    for row in rows:
+        mean_batch = row.get('mean_batch_size')
+        print(f"{row['mode']:>18} {row['throughput_per_s']:>9.0f} {row['p50_us']:>9.1f} {row['p99_us']:>9.1f} "
+              f"{mean_batch if mean_batch is not None else 1.0:>11.1f}")
+    return rows
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def http_poster(port, path):
+    """`post(body)` sending a JSON body to a local server over one keep-alive connection per thread"""
+    local = threading.local()
+
+    def post(body):
+        conn = getattr(local, 'conn', None)
+        if conn is None:
+            conn = local.conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        conn.request('POST', path, body, {'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        payload = response.read()
+        if response.status >= 400:
+            raise RuntimeError(f"HTTP {response.status}: {payload[:200]!r}")
+        return payload
+
+    return post
+
+
+def wait_for_server(port, path, process, timeout=120):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"server exited with code {process.returncode}")
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', path)
+            if conn.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise TimeoutError(f"server on port {port} not ready after {timeout}s")
+
+
+def open_loop(fn, items, rate, clients):
+    """Start `fn(item)` for every item at a fixed `rate` per second, however fast calls return
+
+    Call i is due `i / rate` seconds after the start and its latency is
+    measured from when it was due, not from when a client got to it, so a
+    server falling behind shows as queueing delay rather than as a lower
+    offered rate. `clients` threads bound the calls in flight; with too few
+    of them the generator, not the server, is what falls behind.
+
+    Returns successful calls per second, the latencies of the successful
+    calls in microseconds and the number of calls that raised. Failed calls
+    are left out of both, so a server answering errors quickly does not
+    look faster.
+    """
+    latencies = np.full(len(items), np.nan)
+    next_index = iter(range(len(items)))
+    index_lock = threading.Lock()
+    errors = [0]
+
+    def client():
+        while True:
+            with index_lock:
+                i = next(next_index, None)
+            if i is None:
+                return
+            due = start + i / rate
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            try:
+                fn(items[i])
+            except Exception:
+                errors[0] += 1
+                continue
+            latencies[i] = time.perf_counter() - due
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+    latencies = latencies[~np.isnan(latencies)]
+    return len(latencies) / elapsed, latencies * 1e6, errors[0]
+
+
+# `python -c` entry point serving a model module the way its __main__ does, on a given port
+FLASK_SERVER = (
+    "import importlib, sys; m = importlib.import_module(sys.argv[1]); m.load_models(); m.start_standalone(); "
+    "m.app.run(host='127.0.0.1', port=int(sys.argv[2]), threaded=True)"
+)
+
+
+@contextmanager
+def local_server(app_dir, module, prefix, endpoint, mode='gunicorn', workers=1, threads=4, env=None):
+    """Run a model server on a free local port for the duration of the block, yielding the port
+
+    `mode` is `flask` for the module's app under the Flask development
+    server, as `python <module>.py` runs it, `gunicorn` for the Flask app
+    under `app_dir`/gunicorn.conf.py, or `asgi` for the ASGI front end
+    under the same config. `workers` and `threads` only apply to gunicorn.
+    """
+    port = free_port()
+    server_env = dict(os.environ, **(env or {}))
+    if mode == 'flask':
+        command = [sys.executable, '-c', FLASK_SERVER, module, str(port)]
+    else:
+        command = [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py']
+        server_env.update({
+            f'{prefix}_BIND': f'127.0.0.1:{port}',
+            f'{prefix}_WORKERS': str(workers),
+            f'{prefix}_WORKER_THREADS': str(threads),
+            f'{prefix}_ASGI': '1' if mode == 'asgi' else '0',
+        })
+    server = subprocess.Popen(command, cwd=app_dir, env=server_env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        wait_for_server(port, f'{endpoint}/ping', server)
+        yield port
+    finally:
+        server.terminate()
+        server.wait(60)
+
+
+def prefork_scaling(app_dir, prefix, endpoint, bodies, worker_counts, clients, env=None, threads=1, mode='gunicorn'):
+    """Throughput of a model server under gunicorn as its worker count grows
+
+    Starts `app_dir`/gunicorn.conf.py once per entry in `worker_counts`, with
+    `threads` request threads per worker, and drives `bodies` (encoded JSON)
+    at `endpoint`/invocations from `clients` keep-alive connections.
+    `mode` is `gunicorn` or `asgi`, as for `local_server`. Scaling stops at
+    the number of cores available to the workers and the load generator
+    together.
+    """
+    rows = []
+    for workers in worker_counts:
+        with local_server(app_dir, None, prefix, endpoint, mode, workers, threads, env) as port:
+            post = http_poster(port, f'{endpoint}/invocations')
+            closed_loop(post, bodies[:max(1, len(bodies) // 10)], clients)
+            row = summarize(*closed_loop(post, bodies, clients))
+        rows.append(dict(row, workers=workers))
+
+    print(f"{clients} concurrent clients, {len(bodies)} requests, {threads} thread(s) per worker, "
+          f"{os.cpu_count()} cores")
+    print(f"{'workers':>8} {'req/s':>9} {'speedup':>8} {'p50 us':>9} {'p99 us':>9}")
+    for row in rows:
+        print(f"{row['workers']:>8} {row['throughput_per_s']:>9.0f} "
+              f"{row['throughput_per_s'] / rows[0]['throughput_per_s']:>7.2f}x "
+              f"{row['p50_us']:>9.1f} {row['p99_us']:>9.1f}")
+    return rows
+
+
+def lap_cost_us(name, laps=200000):
+    """Mean cost in microseconds of one `StageMetrics.lap`, clock read included"""
+    metrics = StageMetrics(name)
+    t = time.perf_counter_ns()
+    start = time.perf_counter()
+    for _ in range(laps):
+        t = metrics.lap('stage', t)
+    return (time.perf_counter() - start) / laps * 1e6
+
+
+def stage_timing_overhead(module, name, paths, rounds=8):
+    """Cost of a server module's stage timing hooks, and the stage breakdown they report
+
+    `paths` maps a label to (fn, items). Each path is timed with
+    `module.stage_metrics` unset and set for `rounds` rounds, swapping
+    which goes first each round and keeping each mode's best mean, so
+    drift and warm-up hit both modes alike.
+    On a busy machine that difference is mostly noise, so the overhead is
+    also estimated from the cost of one lap times the laps per call.
+    """
+    lap_us = lap_cost_us(name)
+    rows = []
+    for label, (fn, items) in paths.items():
+        best = {}
+        for i in range(rounds):
+            for mode in (('off', 'on') if i % 2 == 0 else ('on', 'off')):
+                module.stage_metrics = metrics = StageMetrics(name) if mode == 'on' else None
+                if metrics is not None:
+                    timed = metrics
+                start = time.perf_counter()
+                for item in items:
+                    fn(item)
+                mean_us = (time.perf_counter() - start) / len(items) * 1e6
+                best[mode] = min(best.get(mode, mean_us), mean_us)
+        module.stage_metrics = None
+        stages = timed.stats()
+        laps = sum(stats['count'] for stats in stages.values()) / len(items)
+        rows.append({'path': label, 'off_us': best['off'], 'on_us': best['on'],
+                     'measured_overhead_pct': (best['on'] - best['off']) / best['off'] * 100,
+                     'laps_per_call': laps, 'estimated_overhead_pct': laps * lap_us / best['off'] * 100,
+                     'stages': stages})
+
+    print(f"one lap: {lap_us:.3f} us")
+    print(f"{'path':>12} {'off us':>9} {'on us':>9} {'measured':>9} {'laps':>5} {'estimated':>10}")
+    for row in rows:
+        print(f"{row['path']:>12} {row['off_us']:>9.1f} {row['on_us']:>9.1f} {row['measured_overhead_pct']:>8.2f}% "
+              f"{row['laps_per_call']:>5.1f} {row['estimated_overhead_pct']:>9.2f}%")
+    for row in rows:
+        print(f"{row['path']} stages:")
+        for stage, stats in row['stages'].items():
+            print(f"  {stage:>20} {stats['mean_ms'] * 1e3:>9.1f} us  x{stats['count']}")
+    return rows
@@ -0,0 +1,724 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+ML_MODELS_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+ROUTING_DIR = os.path.join(ML_MODELS_DIR, 'routing_bandit')
+sys.path.insert(0, ROUTING_DIR)
+
+from learner import BanditLearner
+from load_generator import batching_sweep, prefork_scaling, stage_timing_overhead, summarize
+from checkpoint import Checkpointer
+from decision_cache import DecisionCache
+from off_policy import LOGGED_COLUMNS, BanditCandidate, FixedPolicy, evaluate, replay, uniform_policy
+from shards import ShardedBandit
+from quick_train_vw import CSV_COLUMNS, chunk_vw_examples
+import vowpal_wabbit_model
+from vowpal_wabbit_model import RoutingContextualBandit
+
+MERCHANT_TYPES = ['retail', 'travel', 'digital_goods', 'subscription', 'marketplace']
+REGIONS = ['US', 'EU', 'Asia Pacific', 'LATAM']
+
+
+def synthetic_context(rng):
+    """Context features shaped like `RoutingService.extractContextFeatures`"""
+    return {
+        'amount_log': float(rng.random() * 5),
+        'risk_score': float(rng.random()),
+        'hour': int(rng.integers(24)),
+        'day_of_week': int(rng.integers(7)),
+        'is_weekend': int(rng.integers(2)),
+        'merchant_type': str(rng.choice(MERCHANT_TYPES)),
+        'region': str(rng.choice(REGIONS)),
+        'currency_code': int(rng.integers(5)),
+    }
+
+
+def synthetic_actions(rng, num_actions=3):
+    """Gateway stats for one decision"""
+    return [{
+        'success_rate': float(90 + rng.random() * 9),
+        'cost': float(rng.random() * 3),
+        'latency': int(rng.integers(100, 500)),
+        'supports_region': 1,
+        'supports_amount': 1,
+        'volume': int(rng.integers(100, 1000)),
+    } for _ in range(num_actions)]
+
+
+def synthetic_decisions(n, seed=0, stats_refreshes=10):
+    """Contexts, action sets and rewards; gateway stats change `stats_refreshes` times"""
+    rng = np.random.default_rng(seed)
+    action_sets = [synthetic_actions(rng) for _ in range(stats_refreshes)]
+    decisions = []
+    for i in range(n):
+        decisions.append({
+            'context': synthetic_context(rng),
+            'actions': action_sets[i * stats_refreshes // n],
+            'chosen_action': int(rng.integers(3)),
+            'reward': float(rng.random()),
+        })
+    return decisions
+
+
+def new_bandit(prehashed_examples, seed=0):
+    bandit = RoutingContextualBandit(prehashed_examples=prehashed_examples, seed=seed)
+    bandit.initialize_model()
+    return bandit
+
+
+def time_per_call(fn, items):
+    """Mean wall clock time of `fn(item)` in microseconds"""
+    start = time.perf_counter()
+    for item in items:
+        fn(item)
+    return (time.perf_counter() - start) / len(items) * 1e6
+
+
+def bench_examples(steps=5000, requests=20000):
+    """Per-decision cost of text examples against the pre-hashed builder
+
+    Parity runs two models side by side through the same interleaved
+    predict/learn sequence and requires every probability to be identical.
+    """
+    text, prehashed = new_bandit(False), new_bandit(True)
+    mismatches = 0
+    for d in synthetic_decisions(steps, seed=1):
+        if text.predict(d['context'], d['actions']) != prehashed.predict(d['context'], d['actions']):
+            mismatches += 1
+        text.train_step(d['context'], d['actions'], d['chosen_action'], d['reward'])
+        prehashed.train_step(d['context'], d['actions'], d['chosen_action'], d['reward'])
+
+    decisions = synthetic_decisions(requests, seed=2)
+    results = {}
+    for name, bandit in [('text', text), ('prehashed', prehashed)]:
+        results[name] = {
+            'predict_us': time_per_call(lambda d: bandit.predict(d['context'], d['actions']), decisions),
+            'train_us': time_per_call(
+                lambda d: bandit.train_step(d['context'], d['actions'], d['chosen_action'], d['reward']),
+                decisions[:requests // 4]
+            ),
+        }
+
+    print(f"{'path':>10} {'predict us':>11} {'train us':>9}")
+    for name, row in results.items():
+        print(f"{name:>10} {row['predict_us']:>11.1f} {row['train_us']:>9.1f}")
+    print(f"predict speedup: {results['text']['predict_us'] / results['prehashed']['predict_us']:.2f}x")
+    print(f"mismatched predictions over {steps} interleaved steps: {mismatches}")
+    print(f"builder: {prehashed.example_builder.stats()}")
+    return dict(results, mismatches=mismatches)
+
+
+def bench_batching(requests=20000, clients=16, configs=((8, 200), (32, 500), (64, 1000))):
+    """Micro-batched prediction against one locked `predict` per request"""
+    bandit = new_bandit(True)
+    for d in synthetic_decisions(2000, seed=1):
+        bandit.train_step(d['context'], d['actions'], d['chosen_action'], d['reward'])
+    decisions = [(d['context'], d['actions']) for d in synthetic_decisions(requests, seed=2)]
+    return batching_sweep(lambda d: bandit.predict(*d), bandit.predict_batch, decisions, clients, configs)
+
+
+def repeated_decisions(n, distinct=500, seed=0, stats_refreshes=10):
+    """Decisions drawn Zipf-like from `distinct` contexts, with amounts jittered inside a bucket"""
+    rng = np.random.default_rng(seed)
+    contexts = [synthetic_context(rng) for _ in range(distinct)]
+    for context in contexts:
+        context['amount_log'] = float(np.floor(context['amount_log'] * 4) / 4)
+    action_sets = [synthetic_actions(rng) for _ in range(stats_refreshes)]
+    weights = 1.0 / np.arange(1, distinct + 1)
+    picks = rng.choice(distinct, size=n, p=weights / weights.sum())
+    jitter = rng.random(n) * 0.2
+    return [
+        (dict(contexts[c], amount_log=contexts[c]['amount_log'] + float(j)), action_sets[i * stats_refreshes // n])
+        for i, (c, j) in enumerate(zip(picks, jitter))
+    ]
+
+
+def bench_cache(requests=50000, distinct=500, samples=20000):
+    """Decision cache hit rate and per-request latency against uncached prediction
+
+    Also checks that hits sample actions at the cached pmf's rates, and that
+    a training step on the served model empties the cache.
+    """
+    bandit = new_bandit(True)
+    for d in synthetic_decisions(2000, seed=1):
+        bandit.train_step(d['context'], d['actions'], d['chosen_action'], d['reward'])
+    decisions = repeated_decisions(requests, distinct, seed=2)
+
+    uncached_us = time_per_call(lambda d: bandit.predict(*d), decisions)
+    cache = DecisionCache()
+    cached_us = time_per_call(lambda d: cache.predict(bandit, d[0], d[1], bandit.predict), decisions)
+    stats = cache.stats()
+
+    context, actions = decisions[0]
+    pmf = np.array(bandit.predict(context, actions)['all_probabilities'])
+    counts = np.zeros(len(pmf))
+    for _ in range(samples):
+        result = cache.predict(bandit, context, actions, bandit.predict)
+        counts[result['chosen_action']] += 1
+        assert result['action_probability'] == pmf[result['chosen_action']]
+    total_variation = 0.5 * np.abs(counts / samples - pmf).sum()
+
+    d = synthetic_decisions(1, seed=3)[0]
+    bandit.train_step(d['context'], d['actions'], d['chosen_action'], d['reward'])
+    cache.predict(bandit, context, actions, bandit.predict)
+    after_update = cache.stats()
+
+    print(f"{requests} requests over {distinct} contexts: hit rate {stats['hit_rate']:.3f}")
+    print(f"uncached predict {uncached_us:.1f} us, cached {cached_us:.1f} us "
+          f"(hit {stats['mean_hit_us']:.1f} us, miss {stats['mean_miss_us']:.1f} us), "
+          f"saved {stats['latency_saved_seconds']:.2f}s")
+    print(f"sampled action rates {np.round(counts / samples, 3).tolist()} against pmf "
+          f"{np.round(pmf, 3).tolist()}: total variation {total_variation:.4f}")
+    print(f"after a training step: {after_update['entries']} entries, "
+          f"{after_update['invalidations']} invalidation(s)")
+    return dict(stats, uncached_us=uncached_us, cached_us=cached_us, total_variation=total_variation)
+
+
+def bench_gateways(requests=5000, outcomes=3000):
+    """Invocation payload size and server time with client-sent actions against server-side stats"""
+    server = vowpal_wabbit_model
+    server.bandit_model.initialize_model()
+    rng = np.random.default_rng(4)
+    for _ in range(outcomes):
+        server.gateway_stats.record(int(rng.integers(3)), rng.random() < 0.95, float(rng.normal(200, 40)))
+
+    client = server.app.test_client()
+    url = '/routing-vw-bandit-endpoint-local/invocations'
+    contexts = [synthetic_context(rng) for _ in range(requests)]
+    bodies = {
+        'client actions': [
+            json.dumps({'context_features': c, 'actions': [
+                {'action_id': i, 'features': a} for i, a in enumerate(synthetic_actions(rng))
+            ]}) for c in contexts
+        ],
+        'server stats': [json.dumps({'context_features': c}) for c in contexts],
+    }
+
+    rows = {}
+    for name, payloads in bodies.items():
+        us = time_per_call(lambda body: client.post(url, data=body, content_type='application/json'), payloads)
+        rows[name] = {'payload_bytes': float(np.mean([len(b) for b in payloads])), 'request_us': us}
+
+    print(f"{'actions from':>15} {'payload bytes':>14} {'request us':>11}")
+    for name, row in rows.items():
+        print(f"{name:>15} {row['payload_bytes']:>14.0f} {row['request_us']:>11.1f}")
+    print(f"gateway table refreshes: {server.gateway_stats.refreshes}")
+    return rows
+
+
+def bench_recovery(wal_lengths=(1000, 10000, 50000), warmup=2000, requests=20000):
+    """Recovery time against WAL length, and prediction latency while checkpoints are written
+
+    Each run checkpoints a trained model, learns `wal_length` more examples
+    through the WAL, then drops the process state without a final
+    checkpoint and recovers into a fresh bandit, whose predictions must
+    match the original exactly.
+    """
+    rows = []
+    probes = synthetic_decisions(200, seed=9)
+    for wal_length in wal_lengths:
+        with tempfile.TemporaryDirectory() as workdir:
+            bandit = new_bandit(True)
+            checkpointer = Checkpointer(workdir, interval=None)
+            for d in synthetic_decisions(warmup, seed=1):
+                checkpointer.log(d['context'], d['actions'], d['chosen_action'], d['reward'], 1)
+                bandit.train_step(d['context'], d['actions'], d['chosen_action'], d['reward'])
+            checkpointer.checkpoint(bandit)
+            for d in synthetic_decisions(wal_length, seed=2):
+                checkpointer.log(d['context'], d['actions'], d['chosen_action'], d['reward'], 0.5)
+                bandit.train_step(d['context'], d['actions'], d['chosen_action'], d['reward'], 0.5)
+            checkpointer.close()
+
+            recovered = new_bandit(True)
+            recovery = Checkpointer(workdir, interval=None).recover(recovered)
+            mismatches = sum(
+                bandit.predict(d['context'], d['actions'])['all_probabilities']
+                != recovered.predict(d['context'], d['actions'])['all_probabilities']
+                for d in probes
+            )
+            rows.append(dict(recovery, wal_length=wal_length, mismatches=mismatches))
+
+    print(f"{'wal length':>10} {'load s':>8} {'recovery s':>11} {'replayed':>9} {'mismatches':>11}")
+    for row in rows:
+        print(f"{row['wal_length']:>10} {row['load_seconds']:>8.3f} {row['recovery_seconds']:>11.3f} "
+              f"{row['replayed']:>9} {row['mismatches']:>11}")
+
+    decisions = synthetic_decisions(requests, seed=3)
+    latency = {}
+    for mode in ['no checkpoints', 'checkpoint every 500']:
+        with tempfile.TemporaryDirectory() as workdir:
+            checkpointer = Checkpointer(workdir, interval=None, every=500) if mode != 'no checkpoints' else None
+            learner = BanditLearner(new_bandit(True), snapshot_interval=0.5, checkpointer=checkpointer)
+            learner.start()
+            predict_us = np.empty(len(decisions))
+            for i, d in enumerate(decisions):
+                learner.submit(d['context'], d['actions'], d['chosen_action'], d['reward'])
+                start = time.perf_counter()
+                learner.predict(d['context'], d['actions'])
+                predict_us[i] = (time.perf_counter() - start) * 1e6
+            learner.stop()
+            row = summarize(len(decisions), predict_us)
+            latency[mode] = dict(row, checkpoints=checkpointer.checkpoints_written if checkpointer else 0,
+                                 checkpoint_seconds=checkpointer.last_checkpoint_seconds if checkpointer else None)
+
+    print(f"{'mode':>22} {'p50 us':>8} {'p99 us':>8} {'checkpoints':>12} {'last save s':>12}")
+    for mode, row in latency.items():
+        save = f"{row['checkpoint_seconds']:.4f}" if row['checkpoint_seconds'] is not None else '-'
+        print(f"{mode:>22} {row['p50_us']:>8.1f} {row['p99_us']:>8.1f} {row['checkpoints']:>12} {save:>12}")
+    return {'recovery': rows, 'predict_latency': latency}
+
+
+SEGMENT_TRAFFIC = {'US': 0.7, 'EU': 0.2, 'Asia Pacific': 0.05, 'LATAM': 0.05}
+SEGMENT_BEST_ACTION = {'US': 0, 'EU': 1, 'Asia Pacific': 2, 'LATAM': 2}
+
+
+def segment_reward_probability(region, action):
+    return 0.8 if SEGMENT_BEST_ACTION[region] == action else 0.3
+
+
+def segment_decisions(n, seed=0):
+    """Uniformly logged decisions where the best gateway depends on the region"""
+    rng = np.random.default_rng(seed)
+    actions = synthetic_actions(rng)
+    regions = rng.choice(list(SEGMENT_TRAFFIC), size=n, p=list(SEGMENT_TRAFFIC.values()))
+    decisions = []
+    for region in regions:
+        context = dict(synthetic_context(rng), region=str(region))
+        chosen = int(rng.integers(3))
+        reward = float(rng.random() < segment_reward_probability(context['region'], chosen))
+        decisions.append({'context': context, 'actions': actions, 'chosen_action': chosen, 'reward': reward})
+    return decisions
+
+
+def new_sharded(directory, shard_key='region', **kwargs):
+    def factory(load_path=None):
+        bandit = RoutingContextualBandit(seed=0)
+        if load_path is not None:
+            bandit.load_model(load_path)
+        else:
+            bandit.initialize_model()
+        return bandit
+    return ShardedBandit(shard_key, directory, factory, **kwargs)
+
+
+def bench_shards(train=20000, holdout=2000):
+    """Per-region policy value of sharded against global models, eviction churn and worker throughput"""
+    decisions = segment_decisions(train, seed=1)
+    tests = segment_decisions(holdout, seed=2)
+    with tempfile.TemporaryDirectory() as workdir:
+        global_bandit = new_bandit(True)
+        sharded = new_sharded(workdir, min_examples=50)
+        for d in decisions:
+            args = (d['context'], d['actions'], d['chosen_action'], d['reward'], 1 / 3)
+            global_bandit.train_step(*args)
+            sharded.learn(sharded.shard_name(d['context']), *args)
+
+        values = {region: {'global': [], 'sharded': []} for region in SEGMENT_TRAFFIC}
+        for d in tests:
+            region = d['context']['region']
+            fallback = global_bandit.predict(d['context'], d['actions'])
+            served = sharded.predict(d['context'], d['actions']) or fallback
+            for name, result in [('global', fallback), ('sharded', served)]:
+                values[region][name].append(sum(
+                    p * segment_reward_probability(region, a) for a, p in enumerate(result['all_probabilities'])
+                ))
+
+    print(f"{'region':>13} {'traffic':>8} {'best':>6} {'global':>8} {'sharded':>8}")
+    for region, row in values.items():
+        print(f"{region:>13} {SEGMENT_TRAFFIC[region]:>8.2f} {0.8:>6.2f} "
+              f"{np.mean(row['global']):>8.3f} {np.mean(row['sharded']):>8.3f}")
+
+    churn = {}
+    for max_loaded in [32, 4]:
+        with tempfile.TemporaryDirectory() as workdir:
+            sharded = new_sharded(workdir, 'region,merchant_type', max_loaded=max_loaded)
+            start = time.perf_counter()
+            for d in decisions:
+                sharded.learn(sharded.shard_name(d['context']), d['context'], d['actions'],
+                              d['chosen_action'], d['reward'])
+            elapsed = time.perf_counter() - start
+            stats = sharded.stats()
+            churn[max_loaded] = dict(stats, learn_us=elapsed / len(decisions) * 1e6)
+    print(f"{'max loaded':>10} {'shards':>7} {'loads':>6} {'evictions':>10} {'learn us':>9}")
+    for max_loaded, row in churn.items():
+        print(f"{max_loaded:>10} {len(row['shards']):>7} {row['loads']:>6} {row['evictions']:>10} {row['learn_us']:>9.1f}")
+
+    throughput = {}
+    for workers in [1, 2, 4]:
+        with tempfile.TemporaryDirectory() as workdir:
+            sharded = new_sharded(workdir, 'region,merchant_type', workers=workers, max_queue=len(decisions))
+            sharded.start()
+            start = time.perf_counter()
+            for d in decisions:
+                sharded.submit(d['context'], d['actions'], d['chosen_action'], d['reward'])
+            sharded.drain()
+            throughput[workers] = len(decisions) / (time.perf_counter() - start)
+            sharded.stop()
+    print('learning throughput: ' + ', '.join(f"{w} worker(s) {t:.0f}/s" for w, t in throughput.items()))
+    return {'values': values, 'churn': churn, 'throughput': throughput}
+
+
+def write_synthetic_csv(path, rows, seed=0, chunk_rows=1_000_000):
+    """Write a `routing_synthetic.csv`-shaped file in chunks; a few values are missing"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - start)
+        df = pd.DataFrame({
+            'amount_log': rng.random(n) * 8,
+            'risk_score': rng.random(n),
+            'hour': rng.integers(0, 24, n),
+            'day_of_week': rng.integers(0, 7, n),
+            'is_weekend': rng.integers(0, 2, n),
+            'merchant_type': rng.choice(MERCHANT_TYPES, n),
+            'region': rng.choice(REGIONS, n),
+            'currency_code': rng.integers(0, 5, n),
+            'chosen_action': rng.integers(0, 3, n),
+            'reward': rng.random(n),
+        })
+        for i in range(3):
+            df[f'action{i}_success_rate'] = 90 + rng.random(n) * 9
+            df[f'action{i}_cost'] = rng.random(n) * 3
+            df[f'action{i}_latency'] = np.where(rng.random(n) < 0.01, np.nan, rng.integers(100, 500, n))
+            df[f'action{i}_supports_region'] = rng.integers(0, 2, n)
+            df[f'action{i}_supports_amount'] = 1
+            df[f'action{i}_volume'] = rng.integers(100, 1000, n)
+        df[CSV_COLUMNS].to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+def safe_float(x, default=0.0):
+    try:
+        v = float(x)
+        return v if np.isfinite(v) else default
+    except:
+        return default
+
+
+def legacy_training_data(df):
+    """Per-row dicts exactly as `quick_train_vw.py` built them before streaming"""
+    df['is_weekend'] = df['is_weekend'].astype(int)
+    training_data = []
+    for idx, row in df.iterrows():
+        context = {
+            'amount_log': safe_float(row['amount_log']),
+            'risk_score': safe_float(row['risk_score']),
+            'hour': safe_float(row['hour']),
+            'day_of_week': safe_float(row['day_of_week']),
+            'is_weekend': int(row['is_weekend']),
+            'merchant_type': str(row['merchant_type']),
+            'region': str(row['region']),
+            'currency_code': safe_float(row['currency_code'])
+        }
+        actions = []
+        for i in range(3):
+            actions.append({
+                'success_rate': safe_float(row[f'action{i}_success_rate'], 0.0),
+                'cost': safe_float(row[f'action{i}_cost'], 0.0),
+                'latency': safe_float(row[f'action{i}_latency'], 0.0),
+                'supports_region': int(row[f'action{i}_supports_region']),
+                'supports_amount': int(row[f'action{i}_supports_amount']),
+                'volume': safe_float(row[f'action{i}_volume'], 0.0)
+            })
+        training_data.append({
+            'context': context,
+            'actions': actions,
+            'chosen_action': int(row['chosen_action']),
+            'reward': safe_float(row['reward'], 0.0)
+        })
+    return training_data
+
+
+def stream_run(mode, csv_path, workdir, passes=1):
+    """One training run in a fresh process so peak RSS is its own"""
+    if mode == 'legacy':
+        import logging
+        logging.disable(logging.INFO)
+        from run_stats import RunStats
+        with RunStats() as stats:
+            df = pd.read_csv(csv_path)
+            bandit = RoutingContextualBandit()
+            bandit.initialize_model(learning_rate=0.1, epsilon=0.1)
+            bandit.batch_train(legacy_training_data(df))
+        rows = len(df)
+        report = dict(stats.as_dict(), rows=rows, passes=1, rows_per_second=round(rows / stats.wall_seconds),
+                      examples_per_second=round(rows / stats.wall_seconds))
+    else:
+        import quick_train_vw
+        cache_file = os.path.join(workdir, 'routing.cache') if mode.startswith('cache') else None
+        report = quick_train_vw.main(csv_path, os.path.join(workdir, f'{mode}.vw'),
+                                     cache_file=cache_file, passes=passes)
+    print('RESULT ' + json.dumps(report))
+
+
+def run_isolated(mode, csv_path, workdir, passes=1):
+    out = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), 'stream-run', mode, csv_path, workdir, '--passes', str(passes)],
+        check=True, capture_output=True, text=True
+    ).stdout
+    return json.loads(out.split('RESULT ', 1)[1])
+
+
+def bench_stream(sizes=(1_000_000, 10_000_000), legacy_rows=100_000, passes=3):
+    """Rows per second and peak RSS of streaming and cache-file training
+
+    The legacy iterrows path only runs at `legacy_rows`; it holds every
+    example as nested dicts and does not finish 1M rows in reasonable time.
+    """
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, 'routing_synthetic.csv')
+        write_synthetic_csv(csv_path, 2000, seed=9)
+        df = pd.read_csv(csv_path)
+        bandit = RoutingContextualBandit(prehashed_examples=False)
+        expected = []
+        for d in legacy_training_data(df.copy()):
+            shared_line, action_lines = bandit.create_vw_example(d['context'], d['actions'], d['chosen_action'], d['reward'])
+            expected.append('\n'.join([shared_line] + action_lines))
+        mismatches = int(sum(a != b for a, b in zip(expected, chunk_vw_examples(df))))
+
+        results = []
+        for rows, modes in [(legacy_rows, ['legacy', 'stream'])] + [(n, ['stream', 'cache', 'cache-reuse']) for n in sizes]:
+            write_synthetic_csv(csv_path, rows, seed=rows)
+            if os.path.exists(os.path.join(workdir, 'routing.cache')):
+                os.remove(os.path.join(workdir, 'routing.cache'))
+            for mode in modes:
+                run_passes = passes if mode == 'cache-reuse' else 1
+                report = run_isolated(mode, csv_path, workdir, run_passes)
+                results.append(dict(report, mode=mode, csv_rows=rows))
+                print(f"{rows:>10} {mode:>12} passes={run_passes} {report['rows_per_second']:>9} rows/s "
+                      f"{report['examples_per_second']:>9} examples/s peak RSS {report['peak_rss_mb']:>7.1f} MB",
+                      flush=True)
+
+    print(f"example text mismatches against create_vw_example over 2000 rows: {mismatches}")
+    return {'mismatches': mismatches, 'runs': results}
+
+
+def true_reward_probabilities(df):
+    """Success probability of every gateway for every row of a synthetic log, (n, 3)
+
+    Gateway quality depends on its stats and on the merchant: crypto
+    settlement suits digital goods, the wallet suits marketplaces.
+    """
+    merchant = df['merchant_type'].to_numpy()
+    logits = []
+    for i in range(3):
+        logit = (
+            -1.0
+            + 0.4 * (df[f'action{i}_success_rate'].to_numpy() - 94.5)
+            - 0.5 * df[f'action{i}_cost'].to_numpy()
+            + 0.8 * df[f'action{i}_supports_region'].to_numpy()
+            - 1.5 * df['risk_score'].to_numpy()
+        )
+        if i == 1:
+            logit = logit + 1.5 * (merchant == 'marketplace')
+        if i == 2:
+            logit = logit + 2.0 * (merchant == 'digital_goods')
+        logits.append(logit)
+    return 1.0 / (1.0 + np.exp(-np.column_stack(logits)))
+
+
+def rule_policy(df):
+    """Greedy on success rate minus cost, the rule the synthetic log explores around"""
+    score = np.column_stack([
+        df[f'action{i}_success_rate'].to_numpy() - df[f'action{i}_cost'].to_numpy() for i in range(3)
+    ])
+    return np.eye(3)[score.argmax(axis=1)]
+
+
+def write_logged_csv(path, rows, seed=0, logging_epsilon=0.2, chunk_rows=1_000_000):
+    """A synthetic decision log: epsilon-greedy around `rule_policy`, Bernoulli rewards"""
+    rng = np.random.default_rng(seed)
+    for start in range(0, rows, chunk_rows):
+        n = min(chunk_rows, rows - start)
+        df = pd.DataFrame({
+            'amount_log': rng.random(n) * 8,
+            'risk_score': rng.random(n),
+            'hour': rng.integers(0, 24, n),
+            'day_of_week': rng.integers(0, 7, n),
+            'is_weekend': rng.integers(0, 2, n),
+            'merchant_type': rng.choice(MERCHANT_TYPES, n),
+            'region': rng.choice(REGIONS, n),
+            'currency_code': rng.integers(0, 5, n),
+        })
+        for i in range(3):
+            df[f'action{i}_success_rate'] = 90 + rng.random(n) * 9
+            df[f'action{i}_cost'] = rng.random(n) * 3
+            df[f'action{i}_latency'] = rng.integers(100, 500, n)
+            df[f'action{i}_supports_region'] = rng.integers(0, 2, n)
+            df[f'action{i}_supports_amount'] = 1
+            df[f'action{i}_volume'] = rng.integers(100, 1000, n)
+        pmf = (1 - logging_epsilon) * rule_policy(df) + logging_epsilon / 3
+        chosen = (pmf.cumsum(axis=1) < rng.random(n)[:, None]).sum(axis=1)
+        df['chosen_action'] = chosen
+        df['probability'] = pmf[np.arange(n), chosen]
+        df['reward'] = (rng.random(n) < true_reward_probabilities(df)[np.arange(n), chosen]).astype(float)
+        df[LOGGED_COLUMNS].to_csv(path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+
+
+class TruthTracking:
+    """Wraps a candidate and accumulates its true value under the synthetic reward model"""
+
+    def __init__(self, candidate):
+        self.candidate = candidate
+        self.name = candidate.name
+        self.needs_examples = candidate.needs_examples
+        self.true_total = 0.0
+        self.rows = 0
+
+    @property
+    def seconds(self):
+        return self.candidate.seconds
+
+    def pmfs(self, df, examples):
+        probs = self.candidate.pmfs(df, examples)
+        self.true_total += float((probs * true_reward_probabilities(df)).sum())
+        self.rows += len(df)
+        return probs
+
+
+def bench_ope(rows=1_000_000, logging_epsilon=0.2, replay_rows=200_000):
+    """Estimator accuracy against the known truth, scoring speed and replay throughput
+
+    Fixed policies have exact values; learning candidates are scored
+    progressively and their truth is the mean true success probability of
+    the pmf they held at each row.
+    """
+    candidates = [TruthTracking(c) for c in [
+        FixedPolicy('uniform', uniform_policy),
+        FixedPolicy('rule', rule_policy),
+        BanditCandidate('mtr_eps0.1', epsilon=0.1, cb_type='mtr'),
+        BanditCandidate('dr_eps0.05', epsilon=0.05, cb_type='dr'),
+    ]]
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, 'logged.csv')
+        write_logged_csv(path, rows, seed=3, logging_epsilon=logging_epsilon)
+        start = time.perf_counter()
+        results = evaluate(path, candidates)
+        elapsed = time.perf_counter() - start
+
+        replay_path = os.path.join(workdir, 'replay.csv')
+        write_logged_csv(replay_path, replay_rows, seed=4, logging_epsilon=logging_epsilon)
+        replayed = replay(replay_path, new_bandit(True))
+
+    print(f"{rows} logged rows evaluated in {elapsed:.1f}s; "
+          f"logged policy mean reward {results['logged_policy_mean_reward']:.4f}")
+    print(f"{'candidate':>12} {'truth':>7} {'IPS':>22} {'SNIPS':>22} {'DR':>22} {'ESS':>9} {'rows/s':>9}")
+    for candidate in candidates:
+        r = results['candidates'][candidate.name]
+        cells = [f"{r[k]['estimate']:.4f} [{r[k]['ci_low']:.3f},{r[k]['ci_high']:.3f}]" for k in ('ips', 'snips', 'dr')]
+        truth = candidate.true_total / candidate.rows
+        speed = f"{r['rows_per_second']:.0f}" if r['rows_per_second'] else '-'
+        print(f"{candidate.name:>12} {truth:>7.4f} {cells[0]:>22} {cells[1]:>22} {cells[2]:>22} "
+              f"{r['effective_sample_size']:>9.0f} {speed:>9}")
+        r['truth'] = truth
+    print(f"train_step replay: {replayed['rows_per_second']:.0f} rows/s over {replayed['rows']} rows")
+    return dict(results, seconds=elapsed, replay=replayed)
+
+
+def bench_stages(requests=5000):
+    """Stage timing overhead on `predict` and through the Flask endpoint"""
+    vowpal_wabbit_model.bandit_model.initialize_model()
+    decisions = synthetic_decisions(requests, seed=11)
+    client = vowpal_wabbit_model.app.test_client()
+    bandit = vowpal_wabbit_model.bandit_model
+
+    def invoke(d):
+        client.post('/routing-vw-bandit-endpoint-local/invocations', json={'context_features': d['context']})
+
+    return stage_timing_overhead(vowpal_wabbit_model, 'routing', {
+        'predict': (lambda d: bandit.predict(d['context'], d['actions']), decisions),
+        'endpoint': (invoke, decisions[:requests // 5]),
+    })
+
+
+def bench_prefork(worker_counts, requests=5000, clients=16, asgi=False):
+    """Invocations per second through gunicorn with 1..N prefork workers, actions from gateway stats"""
+    bodies = [json.dumps({'context_features': d['context']}).encode() for d in synthetic_decisions(requests, seed=10)]
+    with tempfile.TemporaryDirectory() as tmp:
+        return prefork_scaling(ROUTING_DIR, 'ROUTING', '/routing-vw-bandit-endpoint-local', bodies, worker_counts,
+                               clients, env={'VW_SNAPSHOT_DIR': tmp}, mode='asgi' if asgi else 'gunicorn')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Routing bandit micro-benchmarks')
+    sub = parser.add_subparsers(dest='bench', required=True)
+
+    examples = sub.add_parser('examples', help='text against pre-hashed example construction')
+    examples.add_argument('--steps', type=int, default=5000)
+    examples.add_argument('--requests', type=int, default=20000)
+
+    batching = sub.add_parser('batching', help='micro-batched prediction under concurrent clients')
+    batching.add_argument('--requests', type=int, default=20000)
+    batching.add_argument('--clients', type=int, default=16)
+
+    cache = sub.add_parser('cache', help='decision cache hit rate, latency and sampling')
+    cache.add_argument('--requests', type=int, default=50000)
+    cache.add_argument('--distinct', type=int, default=500)
+
+    gateways = sub.add_parser('gateways', help='invocation cost with client-sent actions against server-side stats')
+    gateways.add_argument('--requests', type=int, default=5000)
+
+    recovery = sub.add_parser('recovery', help='checkpoint recovery time against WAL length')
+    recovery.add_argument('--wal-lengths', type=int, nargs='+', default=[1000, 10000, 50000])
+
+    shards = sub.add_parser('shards', help='per-segment policies against one global model')
+    shards.add_argument('--train', type=int, default=20000)
+
+    stages = sub.add_parser('stages', help='per-stage latency breakdown and the overhead of timing it')
+    stages.add_argument('--requests', type=int, default=5000)
+
+    prefork = sub.add_parser('prefork', help='HTTP throughput scaling with prefork workers under gunicorn')
+    prefork.add_argument('--workers', type=int, nargs='+', default=sorted({1, 2, 4, os.cpu_count() or 1}))
+    prefork.add_argument('--requests', type=int, default=5000)
+    prefork.add_argument('--clients', type=int, default=16)
+    prefork.add_argument('--asgi', action='store_true', help='serve through the ASGI front end')
+
+    stream = sub.add_parser('stream', help='bulk training throughput and peak RSS from CSV')
+    stream.add_argument('--sizes', type=int, nargs='+', default=[1_000_000, 10_000_000])
+    stream.add_argument('--legacy-rows', type=int, default=100_000)
+    stream.add_argument('--passes', type=int, default=3)
+
+    ope = sub.add_parser('ope', help='off-policy estimates against known truth, and replay throughput')
+    ope.add_argument('--rows', type=int, default=1_000_000)
+    ope.add_argument('--logging-epsilon', type=float, default=0.2)
+    ope.add_argument('--replay-rows', type=int, default=200_000)
+
+    run = sub.add_parser('stream-run')
+    run.add_argument('mode', choices=['legacy', 'stream', 'cache', 'cache-reuse'])
+    run.add_argument('csv_path')
+    run.add_argument('workdir')
+    run.add_argument('--passes', type=int, default=1)
+
+    args = parser.parse_args()
+    if args.bench == 'examples':
+        bench_examples(args.steps, args.requests)
+    elif args.bench == 'batching':
+        bench_batching(args.requests, args.clients)
+    elif args.bench == 'cache':
+        bench_cache(args.requests, args.distinct)
+    elif args.bench == 'gateways':
+        bench_gateways(args.requests)
+    elif args.bench == 'recovery':
+        bench_recovery(args.wal_lengths)
+    elif args.bench == 'shards':
+        bench_shards(args.train)
+    elif args.bench == 'stages':
+        bench_stages(args.requests)
+    elif args.bench == 'prefork':
+        bench_prefork(args.workers, args.requests, args.clients, args.asgi)
+    elif args.bench == 'stream':
+        bench_stream(args.sizes, args.legacy_rows, args.passes)
+    elif args.bench == 'ope':
+        bench_ope(args.rows, args.logging_epsilon, args.replay_rows)
+    elif args.bench == 'stream-run':
+        stream_run(args.mode, args.csv_path, args.workdir, args.passes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,269 @@
+import argparse
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from load_generator import closed_loop, http_poster, local_server, open_loop, summarize
+from fraud_benchmarks import FRAUD_DIR, load_or_train_model, synthetic_instances, synthetic_transactions
+from routing_benchmarks import MERCHANT_TYPES, REGIONS, ROUTING_DIR, new_bandit, synthetic_decisions
+
+CURRENCIES = ['USD', 'EUR', 'GBP', 'JPY', 'SOL']
+MODES = ['flask', 'gunicorn', 'asgi']
+
+# Metrics the regression gate compares, and whether higher is better
+GATED_METRICS = {'throughput_per_s': True, 'p50_us': False, 'p95_us': False, 'p99_us': False}
+
+
+def fraud_payloads(n, seed=0):
+    """Invocation bodies in the `{instances: [transaction]}` envelope `FraudService` sends"""
+    return [json.dumps({'instances': [instance]}).encode() for instance in synthetic_instances(n, seed=seed)]
+
+
+def routing_context(rng):
+    """Context features as `RoutingService.extractContextFeatures` builds them"""
+    amount = float(np.round(rng.lognormal(mean=4.5, sigma=1.5), 2))
+    risk = float(rng.random() * 100)
+    day = int(rng.integers(7))
+    return {
+        'amount_log': math.log10(amount + 1),
+        'amount_bucket': 'small' if amount < 100 else 'medium' if amount < 1000 else 'large' if amount < 10000 else 'enterprise',
+        'currency_code': CURRENCIES.index(str(rng.choice(CURRENCIES))),
+        'risk_score': risk / 100,
+        'risk_bucket': 'high' if risk > 70 else 'medium' if risk > 40 else 'low',
+        'merchant_type': str(rng.choice(MERCHANT_TYPES)),
+        'region': str(rng.choice(REGIONS)),
+        'hour_of_day': int(rng.integers(24)),
+        'day_of_week': day,
+        'is_weekend': int(day in (0, 6)),
+        'optimize_for': 'cost' if amount < 50 else str(rng.choice(['success_rate', 'latency', 'balanced'])),
+    }
+
+
+def routing_payloads(n, seed=0):
+    """Invocation bodies carrying only `context_features`, as `RoutingService` sends them"""
+    rng = np.random.default_rng(seed)
+    return [json.dumps({'context_features': routing_context(rng)}).encode() for _ in range(n)]
+
+
+SERVERS = {
+    'fraud': {
+        'dir': FRAUD_DIR,
+        'module': 'xgboost_model',
+        'prefix': 'FRAUD',
+        'endpoint': '/fraud-xgboost-endpoint-local',
+        'payloads': fraud_payloads,
+        'rates': [20, 40],
+    },
+    'routing': {
+        'dir': ROUTING_DIR,
+        'module': 'vowpal_wabbit_model',
+        'prefix': 'ROUTING',
+        'endpoint': '/routing-vw-bandit-endpoint-local',
+        'payloads': routing_payloads,
+        'rates': [200, 400],
+    },
+}
+
+
+def per_call(fn, items, warmup=100):
+    """Throughput and per-call latency summary of `fn(item)` called in a loop"""
+    for item in items[:warmup]:
+        fn(item)
+    latencies = np.empty(len(items))
+    start = time.perf_counter()
+    for i, item in enumerate(items):
+        call_start = time.perf_counter()
+        fn(item)
+        latencies[i] = time.perf_counter() - call_start
+    return summarize(len(items) / (time.perf_counter() - start), latencies * 1e6)
+
+
+def micro_benchmarks(requests, seed=0):
+    """In-process cost of the calls each request or training step is made of
+
+    Frame-level calls (`prepare_features`, encoding) run on 1000-row frames,
+    copying the frame in each call, so their latencies are per frame.
+    """
+    results = {}
+    model = load_or_train_model()
+    instances = synthetic_instances(requests, seed=seed)
+    results['fraud/predict'] = per_call(lambda inst: model.predict(dict(inst)), instances[:max(1, requests // 10)])
+    results['fraud/predict_fast'] = per_call(model.predict_fast, instances)
+
+    frame = synthetic_transactions(1000, seed=seed)
+    frame['timestamp'] = frame['timestamp'].astype(str)
+    frames = [frame] * max(1, requests // 100)
+    results['fraud/prepare_features_1k'] = per_call(lambda df: model.prepare_features(df.copy()), frames)
+    results['fraud/encode_1k'] = per_call(lambda df: model.categorical_encoder.transform(df.copy()), frames)
+
+    bandit = new_bandit(True, seed=seed)
+    rng = np.random.default_rng(seed)
+    decisions = synthetic_decisions(requests, seed=seed)
+    for d in decisions:
+        d['context'] = routing_context(rng)
+    for d in decisions[:2000]:
+        bandit.train_step(d['context'], d['actions'], d['chosen_action'], d['reward'])
+    results['routing/predict'] = per_call(lambda d: bandit.predict(d['context'], d['actions']), decisions)
+    results['routing/train_step'] = per_call(
+        lambda d: bandit.train_step(d['context'], d['actions'], d['chosen_action'], d['reward']), decisions
+    )
+    return {f'micro/{name}': row for name, row in results.items()}
+
+
+def load_benchmarks(servers, modes, concurrency, rates, requests, open_seconds, open_clients, workers, threads,
+                    seed=0):
+    """Closed-loop and open-loop HTTP load against each server in each mode
+
+    Each (server, mode) pair gets a fresh server, a warm-up, then one
+    closed-loop run per concurrency level and one open-loop run per rate.
+    Without `rates`, each server is offered its own defaults, set below what
+    one worker sustains on a single core.
+    """
+    results = {}
+    for name in servers:
+        server = SERVERS[name]
+        server_rates = server['rates'] if rates is None else rates
+        bodies = server['payloads'](max(requests, max(server_rates, default=0) * open_seconds), seed=seed)
+        for mode in modes:
+            with tempfile.TemporaryDirectory() as tmp:
+                env = {'VW_SNAPSHOT_DIR': tmp} if name == 'routing' else {}
+                with local_server(server['dir'], server['module'], server['prefix'], server['endpoint'], mode,
+                                  workers, threads, env) as port:
+                    post = http_poster(port, f"{server['endpoint']}/invocations")
+                    closed_loop(post, bodies[:max(1, requests // 10)], max(concurrency))
+                    for clients in concurrency:
+                        row = summarize(*closed_loop(post, bodies[:requests], clients))
+                        results[f'load/{name}/{mode}/closed-{clients}'] = dict(row, clients=clients)
+                        print(f"{name:>8} {mode:>9} closed {clients:>5} clients  {format_row(row)}")
+                    for rate in server_rates:
+                        throughput, latencies, errors = open_loop(post, bodies[:rate * open_seconds], rate,
+                                                                  open_clients)
+                        row = dict(summarize(throughput, latencies), offered_per_s=rate, errors=errors)
+                        results[f'load/{name}/{mode}/open-{rate}'] = row
+                        print(f"{name:>8} {mode:>9} open   {rate:>5} req/s    {format_row(row)}"
+                              f"{f'  {errors} errors' if errors else ''}")
+    return results
+
+
+def format_row(row):
+    return (f"{row['throughput_per_s']:>9.0f}/s  p50 {row['p50_us']:>9.1f}  p95 {row['p95_us']:>9.1f}  "
+            f"p99 {row['p99_us']:>9.1f} us")
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def compare(results, baseline, tolerance, metrics=GATED_METRICS):
+    """Benchmarks in both runs whose gated metrics got worse by more than `tolerance`
+
+    `tolerance` is a fraction of the baseline value, so 0.2 lets throughput
+    drop by up to 20% and latencies grow by up to 20%. Benchmarks missing
+    from either run are not compared. Any benchmark with failed calls is a
+    regression, whatever the baseline says.
+    """
+    regressions = []
+    for name, row in sorted(results.items()):
+        reference = baseline.get(name)
+        if row.get('errors'):
+            errors = (reference or {}).get('errors', 0)
+            regressions.append({'benchmark': name, 'metric': 'errors', 'baseline': errors, 'current': row['errors'],
+                                'change_pct': (row['errors'] / errors - 1) * 100 if errors else math.inf})
+        if reference is None:
+            continue
+        for metric, higher_is_better in metrics.items():
+            if metric not in row or not reference.get(metric):
+                continue
+            change = row[metric] / reference[metric] - 1
+            if (-change if higher_is_better else change) > tolerance:
+                regressions.append({'benchmark': name, 'metric': metric, 'baseline': reference[metric],
+                                    'current': row[metric], 'change_pct': change * 100})
+    return regressions
+
+
+def report(regressions, tolerance):
+    if not regressions:
+        print(f"no regressions beyond {tolerance:.0%}")
+        return
+    print(f"{len(regressions)} regression(s) beyond {tolerance:.0%}:")
+    for r in regressions:
+        print(f"  {r['benchmark']:>40} {r['metric']:>16} {r['baseline']:>11.1f} -> {r['current']:>11.1f} "
+              f"({r['change_pct']:+.1f}%)")
+
+
+def read_results(path):
+    with open(path) as f:
+        return json.load(f)['results']
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Benchmark suite for both model servers: in-process micro-benchmarks and local HTTP load, '
+                    'recorded as JSON and optionally gated against a baseline'
+    )
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    run = sub.add_parser('run', help='run the suite and write the results')
+    run.add_argument('--output', default='benchmark_results.json', help='where to write the results')
+    run.add_argument('--baseline', default=None, help='results file to compare against')
+    run.add_argument('--tolerance', type=float, default=0.2, help='allowed fractional regression per metric')
+    run.add_argument('--servers', nargs='+', choices=sorted(SERVERS), default=sorted(SERVERS))
+    run.add_argument('--modes', nargs='+', choices=MODES, default=MODES)
+    run.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32],
+                     help='client counts for closed-loop load')
+    run.add_argument('--rates', type=int, nargs='+', default=None,
+                     help='request rates per second for open-loop load (default: per server)')
+    run.add_argument('--requests', type=int, default=2000, help='requests per closed-loop run and micro-benchmark')
+    run.add_argument('--open-seconds', type=int, default=5, help='length of each open-loop run')
+    run.add_argument('--open-clients', type=int, default=64, help='most requests in flight during open-loop runs')
+    run.add_argument('--workers', type=int, default=1, help='gunicorn workers in the gunicorn and asgi modes')
+    run.add_argument('--threads', type=int, default=4, help='request threads per gunicorn worker')
+    run.add_argument('--seed', type=int, default=0)
+    run.add_argument('--skip-micro', action='store_true')
+    run.add_argument('--skip-load', action='store_true')
+
+    check = sub.add_parser('compare', help='gate an existing results file against a baseline')
+    check.add_argument('results')
+    check.add_argument('baseline')
+    check.add_argument('--tolerance', type=float, default=0.2, help='allowed fractional regression per metric')
+
+    args = parser.parse_args()
+    if args.command == 'compare':
+        regressions = compare(read_results(args.results), read_results(args.baseline), args.tolerance)
+        report(regressions, args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+    results = {}
+    if not args.skip_micro:
+        results.update(micro_benchmarks(args.requests, args.seed))
+        for name, row in results.items():
+            print(f"{name:>32}  {format_row(row)}")
+    if not args.skip_load:
+        results.update(load_benchmarks(args.servers, args.modes, args.concurrency, args.rates, args.requests,
+                                       args.open_seconds, args.open_clients, args.workers, args.threads, args.seed))
+
+    config = {key: value for key, value in vars(args).items() if key not in ('command', 'output', 'baseline')}
+    with open(args.output, 'w') as f:
+        json.dump({'environment': environment(), 'config': config, 'results': results}, f, indent=2, sort_keys=True)
+    print(f"wrote {len(results)} results to {args.output}")
+
+    if args.baseline:
+        regressions = compare(results, read_results(args.baseline), args.tolerance)
+        report(regressions, args.tolerance)
+        sys.exit(1 if regressions else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+import numpy as np
+import pandas as pd
+
+CATEGORICAL_COLUMNS = ['merchantCategory', 'location', 'deviceInfo']
+
+
+class CategoricalEncoder:
+    """Lookup-table encoder for the fraud model's categorical columns
+
+    Codes follow `LabelEncoder` (position in the sorted classes) and unseen
+    values map to -1. Whole columns are encoded through a hashed `pd.Index`
+    in one `get_indexer` call.
+    """
+
+    def __init__(self, columns=CATEGORICAL_COLUMNS):
+        self.columns = list(columns)
+        self.classes_ = {}
+        self._indexes = {}
+        self._code_maps = {}
+
+    @classmethod
+    def from_label_encoders(cls, label_encoders):
+        """Build an encoder from a dict of fitted sklearn `LabelEncoder`s"""
+        encoder = cls(list(label_encoders))
+        encoder.classes_ = {col: np.asarray(le.classes_) for col, le in label_encoders.items()}
+        return encoder
+
+    def _index(self, col):
+        index = self._indexes.get(col)
+        if index is None:
+            index = pd.Index(self.classes_[col])
+            self._indexes[col] = index
+        return index
+
+    def encode_value(self, col, value):
+        """Code for a single value, -1 where unseen"""
+        codes = self._code_maps.get(col)
+        if codes is None:
+            if col not in self.classes_:
+                return -1
+            codes = {key: code for code, key in enumerate(self.classes_[col].tolist())}
+            self._code_maps[col] = codes
+        return codes.get(str(value), -1)
+
+    def fit(self, df):
+        """Learn the sorted classes of every categorical column in `df`"""
+        for col in self.columns:
+            if col in df.columns:
+                self.classes_[col] = np.unique(df[col].astype(str).to_numpy())
+                self._indexes.pop(col, None)
+                self._code_maps.pop(col, None)
+        return self
+
+    def partial_fit(self, df):
+        """Add the classes seen in `df` to the ones already learned"""
+        for col in self.columns:
+            if col in df.columns:
+                seen = np.unique(df[col].astype(str).to_numpy())
+                if col in self.classes_:
+                    seen = np.union1d(self.classes_[col], seen)
+                self.classes_[col] = seen
+                self._indexes.pop(col, None)
+                self._code_maps.pop(col, None)
+        return self
+
+    def encode(self, col, values):
+        """Codes for one column of values, -1 where unseen"""
+        if col not in self.classes_:
+            return np.full(len(values), -1, dtype=np.int64)
+        codes = self._index(col).get_indexer(pd.Series(values).astype(str))
+        return codes.astype(np.int64)
+
+    def transform(self, df):
+        """Add `<col>_encoded` columns for every categorical column in `df`"""
+        for col in self.columns:
+            if col in df.columns:
+                df[f'{col}_encoded'] = self.encode(col, df[col])
+        return df
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_indexes'] = {}
+        state['_code_maps'] = {}
+        return state
@@ -0,0 +1,402 @@
+import math
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+EMPTY_SLOT = np.iinfo(np.int64).min
+
+USER_ARRAYS = ['user_count', 'user_sum', 'user_sumsq', 'user_diversity', 'recent_times', 'recent_amounts']
+MERCHANT_ARRAYS = ['merchant_count', 'merchant_sum', 'merchant_fraud']
+
+STORE_FEATURES = [
+    'amount_zscore', 'velocity_1h', 'velocity_amount_1h',
+    'user_avg_amount', 'user_std_amount', 'user_tx_count', 'user_merchant_diversity',
+    'merchant_avg_amount', 'merchant_tx_count', 'merchant_fraud_rate'
+]
+
+
+def to_epoch_ns(timestamps):
+    """Nanoseconds since the epoch (UTC for tz-aware values) for a column of timestamps"""
+    times = pd.DatetimeIndex(pd.to_datetime(timestamps))
+    if times.tz is not None:
+        times = times.tz_convert(None)
+    return times.as_unit('ns').asi8
+
+
+class FraudFeatureStore:
+    """In-process per-user and per-merchant aggregates for online scoring
+
+    State lives in flat NumPy arrays indexed through a key -> row dict, so a
+    lookup or an update is O(1) per transaction. Aggregates include the
+    transaction being scored, matching how `prepare_features` computes them
+    over a training frame. Velocity keeps each user's last `history`
+    transactions, so it saturates at `history + 1` within one window.
+    Reads and writes take the store's lock, so request handlers and a
+    background model updater can share one store without a lookup seeing
+    an index entry before its row exists or a ring halfway through a shift.
+
+    The last `max_unlabeled` transactions observed without a label are
+    remembered by user, timestamp and amount, so `apply_labels` can tell a
+    late label for one of them from a transaction the store never saw.
+    """
+
+    def __init__(self, window_seconds=3600, history=32, capacity=1024, max_unlabeled=100000):
+        self.window_ns = int(window_seconds * 1e9)
+        self.history = history
+        self.max_unlabeled = max_unlabeled
+        self._lock = threading.RLock()
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        self.user_index = {}
+        self.merchant_index = {}
+        self.user_merchant_pairs = set()
+        self.unlabeled = OrderedDict()
+
+        self.user_count = np.zeros(capacity, dtype=np.int64)
+        self.user_sum = np.zeros(capacity, dtype=np.float64)
+        self.user_sumsq = np.zeros(capacity, dtype=np.float64)
+        self.user_diversity = np.zeros(capacity, dtype=np.int64)
+        self.recent_times = np.full((capacity, self.history), EMPTY_SLOT, dtype=np.int64)
+        self.recent_amounts = np.zeros((capacity, self.history), dtype=np.float64)
+
+        self.merchant_count = np.zeros(capacity, dtype=np.int64)
+        self.merchant_sum = np.zeros(capacity, dtype=np.float64)
+        self.merchant_fraud = np.zeros(capacity, dtype=np.float64)
+
+        self.global_count = 0
+        self.global_sum = 0.0
+        self.global_sumsq = 0.0
+
+    def _grow(self, names, size):
+        """Make room for `size` rows, swapping in all the grown arrays together"""
+        grown = {}
+        for name in names:
+            arr = getattr(self, name)
+            if arr.shape[0] >= size:
+                continue
+            fill = EMPTY_SLOT if name == 'recent_times' else 0
+            grown[name] = np.full((max(size, 2 * arr.shape[0]),) + arr.shape[1:], fill, dtype=arr.dtype)
+            grown[name][:arr.shape[0]] = arr
+        self.__dict__.update(grown)
+
+    def _user_row(self, user_id):
+        row = self.user_index.get(user_id)
+        if row is None:
+            row = len(self.user_index)
+            self._grow(USER_ARRAYS, row + 1)
+            self.user_index[user_id] = row
+        return row
+
+    def _merchant_row(self, category):
+        row = self.merchant_index.get(category)
+        if row is None:
+            row = len(self.merchant_index)
+            self._grow(MERCHANT_ARRAYS, row + 1)
+            self.merchant_index[category] = row
+        return row
+
+    @classmethod
+    def from_frame(cls, df, window_seconds=3600, history=32):
+        """Seed the store from a training frame"""
+        store = cls(window_seconds=window_seconds, history=history, capacity=1)
+        store.seed(df)
+        return store
+
+    def seed(self, df):
+        """Replace the store contents with aggregates over `df`"""
+        with self._lock:
+            self._allocate(1)
+            self.ingest(df)
+
+    def ingest(self, df):
+        """Fold a frame of transactions into the aggregates in bulk
+
+        Frames may be ingested chunk by chunk in time order; the result is the
+        same as seeding from their concatenation.
+        """
+        with self._lock:
+            amount = df['amount'].to_numpy(dtype=np.float64)
+            is_fraud = df['isFraud'].to_numpy(dtype=np.float64) if 'isFraud' in df.columns else np.zeros(len(df))
+            times = to_epoch_ns(df['timestamp'])
+
+            user_codes, user_keys = pd.factorize(df['userId'].astype(str))
+            merchant_codes, merchant_keys = pd.factorize(df['merchantCategory'].astype(str))
+            users = np.array([self._user_row(key) for key in user_keys], dtype=np.int64)[user_codes]
+            merchants = np.array([self._merchant_row(key) for key in merchant_keys], dtype=np.int64)[merchant_codes]
+            n_users, n_merchants = len(self.user_index), len(self.merchant_index)
+
+            self.user_count[:n_users] += np.bincount(users, minlength=n_users)
+            self.user_sum[:n_users] += np.bincount(users, weights=amount, minlength=n_users)
+            self.user_sumsq[:n_users] += np.bincount(users, weights=amount * amount, minlength=n_users)
+
+            for pair in np.unique(users * n_merchants + merchants).tolist():
+                user, merchant = divmod(pair, n_merchants)
+                if (user, merchant) not in self.user_merchant_pairs:
+                    self.user_merchant_pairs.add((user, merchant))
+                    self.user_diversity[user] += 1
+
+            # Shift each touched ring left by its number of new transactions, then
+            # write the newest ones, oldest first, into the freed right-hand slots
+            touched = np.unique(users)
+            shift = np.minimum(np.bincount(users, minlength=n_users)[touched], self.history)
+            source = np.arange(self.history)[None, :] + shift[:, None]
+            keep = source < self.history
+            kept_rows = np.nonzero(keep)[0]
+            for name, fill in [('recent_times', EMPTY_SLOT), ('recent_amounts', 0.0)]:
+                ring = getattr(self, name)
+                shifted = np.full((len(touched), self.history), fill, dtype=ring.dtype)
+                shifted[keep] = ring[touched][kept_rows, source[keep]]
+                ring[touched] = shifted
+
+            order = np.lexsort((times, users))
+            position = pd.Series(users[order]).groupby(users[order]).cumcount(ascending=False).to_numpy()
+            recent = position < self.history
+            rows, slots = users[order][recent], self.history - 1 - position[recent]
+            self.recent_times[rows, slots] = times[order][recent]
+            self.recent_amounts[rows, slots] = amount[order][recent]
+
+            self.merchant_count[:n_merchants] += np.bincount(merchants, minlength=n_merchants)
+            self.merchant_sum[:n_merchants] += np.bincount(merchants, weights=amount, minlength=n_merchants)
+            self.merchant_fraud[:n_merchants] += np.bincount(merchants, weights=is_fraud, minlength=n_merchants)
+
+            self.global_count += len(amount)
+            self.global_sum += float(amount.sum())
+            self.global_sumsq += float((amount * amount).sum())
+
+    def observe(self, transactions):
+        """Fold newly arrived transactions into the aggregates"""
+        with self._lock:
+            if isinstance(transactions, dict):
+                transactions = [transactions]
+            elif isinstance(transactions, pd.DataFrame):
+                transactions = transactions.to_dict('records')
+
+            for txn in transactions:
+                amount = float(txn.get('amount', 0) or 0)
+                time_ns = pd.Timestamp(txn['timestamp']).value
+                user_key = str(txn.get('userId'))
+                user = self._user_row(user_key)
+                merchant = self._merchant_row(str(txn.get('merchantCategory')))
+
+                self.user_count[user] += 1
+                self.user_sum[user] += amount
+                self.user_sumsq[user] += amount * amount
+                if (user, merchant) not in self.user_merchant_pairs:
+                    self.user_merchant_pairs.add((user, merchant))
+                    self.user_diversity[user] += 1
+                self.recent_times[user, :-1] = self.recent_times[user, 1:]
+                self.recent_times[user, -1] = time_ns
+                self.recent_amounts[user, :-1] = self.recent_amounts[user, 1:]
+                self.recent_amounts[user, -1] = amount
+
+                self.merchant_count[merchant] += 1
+                self.merchant_sum[merchant] += amount
+                self.merchant_fraud[merchant] += float(txn.get('isFraud', 0) or 0)
+                if txn.get('isFraud') is None:
+                    self.unlabeled[(user_key, time_ns, amount)] = merchant
+                    if len(self.unlabeled) > self.max_unlabeled:
+                        self.unlabeled.popitem(last=False)
+
+                self.global_count += 1
+                self.global_sum += amount
+                self.global_sumsq += amount * amount
+
+    def apply_labels(self, df):
+        """Fold a frame of labeled transactions in, counting each transaction once
+
+        A transaction this store observed unlabeled only adds its fraud label
+        to its merchant; any other row, such as one scored by another process
+        or observed too long ago to be remembered, is ingested whole.
+        """
+        with self._lock:
+            keys = zip(df['userId'].astype(str).tolist(), to_epoch_ns(df['timestamp']).tolist(),
+                       df['amount'].to_numpy(dtype=np.float64).tolist())
+            merchants = np.array([self.unlabeled.pop(key, -1) for key in keys], dtype=np.int64)
+            observed = merchants >= 0
+            labels = df['isFraud'].to_numpy(dtype=np.float64)
+            np.add.at(self.merchant_fraud, merchants[observed], labels[observed])
+            if not observed.all():
+                self.ingest(df[~observed])
+            return int(observed.sum())
+
+    def _rows(self, index, keys):
+        return np.fromiter((index.get(key, -1) for key in keys), dtype=np.int64, count=len(keys))
+
+    def lookup(self, df, timestamps=None):
+        """Aggregate features for each row of `df`, counting the row itself"""
+        with self._lock:
+            amount = df['amount'].to_numpy(dtype=np.float64)
+            times = to_epoch_ns(df['timestamp'] if timestamps is None else timestamps)
+            users = self._rows(self.user_index, df['userId'].astype(str).tolist())
+            merchants = self._rows(self.merchant_index, df['merchantCategory'].astype(str).tolist())
+            known_user = users >= 0
+            known_merchant = merchants >= 0
+            user_rows = np.where(known_user, users, 0)
+            merchant_rows = np.where(known_merchant, merchants, 0)
+
+            count = np.where(known_user, self.user_count[user_rows], 0) + 1
+            total = np.where(known_user, self.user_sum[user_rows], 0.0) + amount
+            sumsq = np.where(known_user, self.user_sumsq[user_rows], 0.0) + amount * amount
+            mean = total / count
+            with np.errstate(invalid='ignore', divide='ignore'):
+                std = np.sqrt(np.maximum(sumsq - count * mean * mean, 0.0) / (count - 1))
+            std[count < 2] = np.nan
+
+            seen_pair = np.fromiter(
+                ((u, m) in self.user_merchant_pairs for u, m in zip(users.tolist(), merchants.tolist())),
+                dtype=bool, count=len(df)
+            )
+            diversity = np.where(known_user, self.user_diversity[user_rows], 0) + (~seen_pair)
+
+            recent_times = self.recent_times[user_rows]
+            in_window = (
+                known_user[:, None]
+                & (recent_times > (times - self.window_ns)[:, None])
+                & (recent_times <= times[:, None])
+            )
+            prior = in_window.sum(axis=1)
+            recent = np.where(in_window, self.recent_amounts[user_rows], 0.0).sum(axis=1)
+
+            m_count = np.where(known_merchant, self.merchant_count[merchant_rows], 0) + 1
+            m_total = np.where(known_merchant, self.merchant_sum[merchant_rows], 0.0) + amount
+            m_fraud = np.where(known_merchant, self.merchant_fraud[merchant_rows], 0.0)
+
+            g_count = self.global_count + 1
+            g_mean = (self.global_sum + amount) / g_count
+            g_var = (self.global_sumsq + amount * amount - g_count * g_mean * g_mean) / max(g_count - 1, 1)
+            with np.errstate(invalid='ignore'):
+                g_std = np.where((g_count > 1) & (g_var > 0), np.sqrt(np.maximum(g_var, 0.0)), np.nan)
+
+            return pd.DataFrame({
+                'amount_zscore': (amount - g_mean) / g_std,
+                'velocity_1h': (prior + 1).astype(float),
+                'velocity_amount_1h': recent + amount,
+                'user_avg_amount': np.round(mean, 2),
+                'user_std_amount': np.round(std, 2),
+                'user_tx_count': count,
+                'user_merchant_diversity': diversity,
+                'merchant_avg_amount': np.round(m_total / m_count, 4),
+                'merchant_tx_count': m_count,
+                'merchant_fraud_rate': np.round(m_fraud / m_count, 4),
+            }, index=df.index)
+
+    def totals(self, df):
+        """Whole-history aggregates for rows that were already ingested
+
+        Unlike `lookup`, the rows themselves are not added again, which is what
+        training on a stream of chunks after a full `ingest` pass needs.
+        """
+        with self._lock:
+            amount = df['amount'].to_numpy(dtype=np.float64)
+            users = self._rows(self.user_index, df['userId'].astype(str).tolist())
+            merchants = self._rows(self.merchant_index, df['merchantCategory'].astype(str).tolist())
+            users, merchants = np.maximum(users, 0), np.maximum(merchants, 0)
+
+            count = self.user_count[users]
+            mean = self.user_sum[users] / np.maximum(count, 1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                std = np.sqrt(np.maximum(self.user_sumsq[users] - count * mean * mean, 0.0) / (count - 1))
+            std[count < 2] = np.nan
+            m_count = np.maximum(self.merchant_count[merchants], 1)
+
+            g_mean = self.global_sum / max(self.global_count, 1)
+            g_var = (self.global_sumsq - self.global_count * g_mean * g_mean) / max(self.global_count - 1, 1)
+            g_std = math.sqrt(g_var) if g_var > 0 else np.nan
+
+            return pd.DataFrame({
+                'amount_zscore': (amount - g_mean) / g_std,
+                'user_avg_amount': np.round(mean, 2),
+                'user_std_amount': np.round(std, 2),
+                'user_tx_count': count,
+                'user_merchant_diversity': self.user_diversity[users],
+                'merchant_avg_amount': np.round(self.merchant_sum[merchants] / m_count, 4),
+                'merchant_tx_count': self.merchant_count[merchants],
+                'merchant_fraud_rate': np.round(self.merchant_fraud[merchants] / m_count, 4),
+            }, index=df.index)
+
+    def lookup_one(self, txn, timestamp=None):
+        """`lookup` for a single transaction dict, in `STORE_FEATURES` order"""
+        with self._lock:
+            amount = float(txn['amount'])
+            time_ns = pd.Timestamp(txn['timestamp'] if timestamp is None else timestamp).value
+            user = self.user_index.get(str(txn.get('userId')), -1)
+            merchant = self.merchant_index.get(str(txn.get('merchantCategory')), -1)
+
+            count = (self.user_count[user] if user >= 0 else 0) + 1
+            total = (self.user_sum[user] if user >= 0 else 0.0) + amount
+            sumsq = (self.user_sumsq[user] if user >= 0 else 0.0) + amount * amount
+            mean = total / count
+            std = math.sqrt(max(sumsq - count * mean * mean, 0.0) / (count - 1)) if count > 1 else np.nan
+            diversity = ((self.user_diversity[user] if user >= 0 else 0)
+                         + ((user, merchant) not in self.user_merchant_pairs))
+            prior, recent = 0, 0.0
+            if user >= 0:
+                times = self.recent_times[user]
+                in_window = (times > time_ns - self.window_ns) & (times <= time_ns)
+                prior = int(in_window.sum())
+                recent = np.where(in_window, self.recent_amounts[user], 0.0).sum()
+
+            m_count = (self.merchant_count[merchant] if merchant >= 0 else 0) + 1
+            m_total = (self.merchant_sum[merchant] if merchant >= 0 else 0.0) + amount
+            m_fraud = self.merchant_fraud[merchant] if merchant >= 0 else 0.0
+
+            g_count = self.global_count + 1
+            g_mean = (self.global_sum + amount) / g_count
+            g_var = (self.global_sumsq + amount * amount - g_count * g_mean * g_mean) / max(g_count - 1, 1)
+            g_std = math.sqrt(g_var) if g_count > 1 and g_var > 0 else np.nan
+
+            return [
+                (amount - g_mean) / g_std,
+                float(prior + 1),
+                recent + amount,
+                np.round(mean, 2),
+                np.round(std, 2),
+                count,
+                diversity,
+                np.round(m_total / m_count, 4),
+                m_count,
+                np.round(m_fraud / m_count, 4),
+            ]
+
+    def save(self, path):
+        """Snapshot the store to an .npz file"""
+        with self._lock:
+            n_users, n_merchants = len(self.user_index), len(self.merchant_index)
+            pairs = np.array(sorted(self.user_merchant_pairs), dtype=np.int64).reshape(-1, 2)
+            np.savez(
+                path,
+                window_ns=self.window_ns,
+                history=self.history,
+                user_keys=np.array(list(self.user_index), dtype=str),
+                merchant_keys=np.array(list(self.merchant_index), dtype=str),
+                user_merchant_pairs=pairs,
+                user_count=self.user_count[:n_users],
+                user_sum=self.user_sum[:n_users],
+                user_sumsq=self.user_sumsq[:n_users],
+                user_diversity=self.user_diversity[:n_users],
+                recent_times=self.recent_times[:n_users],
+                recent_amounts=self.recent_amounts[:n_users],
+                merchant_count=self.merchant_count[:n_merchants],
+                merchant_sum=self.merchant_sum[:n_merchants],
+                merchant_fraud=self.merchant_fraud[:n_merchants],
+                global_stats=np.array([self.global_count, self.global_sum, self.global_sumsq], dtype=np.float64),
+            )
+
+    @classmethod
+    def load(cls, path):
+        """Restore a store written by `save`"""
+        with np.load(path) as data:
+            store = cls(window_seconds=int(data['window_ns']) / 1e9, history=int(data['history']), capacity=1)
+            store.user_index = {key: row for row, key in enumerate(data['user_keys'].tolist())}
+            store.merchant_index = {key: row for row, key in enumerate(data['merchant_keys'].tolist())}
+            store.user_merchant_pairs = {(int(u), int(m)) for u, m in data['user_merchant_pairs']}
+            for name in USER_ARRAYS + MERCHANT_ARRAYS:
+                setattr(store, name, data[name].copy())
+            count, total, sumsq = data['global_stats']
+        store._grow(USER_ARRAYS, 1)
+        store._grow(MERCHANT_ARRAYS, 1)
+        store.global_count, store.global_sum, store.global_sumsq = int(count), float(total), float(sumsq)
+        return store
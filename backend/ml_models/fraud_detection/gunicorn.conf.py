@@ -0,0 +1,57 @@
+"""Prefork serving for the fraud model: gunicorn -c gunicorn.conf.py
+
+The model is loaded once in the master and shared copy-on-write by
+FRAUD_WORKERS forked workers, each serving FRAUD_WORKER_THREADS requests
+at a time with FRAUD_MODEL_THREADS XGBoost threads per prediction. With
+FRAUD_ONLINE_UPDATES=1 a separate updater process applies labels and
+publishes versions under FRAUD_MODEL_DIR for the workers to pick up.
+
+The feature store lives in each worker, so velocity and history features
+only see the requests that worker served, and labels only reach the store
+of the worker that received them; keep FRAUD_WORKERS=1, or route each user
+to a fixed worker, when those features must see all traffic. Workers keep
+their store when they load a version the updater publishes; the store
+published with it is the updater's, which ingests every labeled row, and
+is only what a server restarted from FRAUD_MODEL_DIR starts from.
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'serving'))
+
+from prefork import prefork_settings, start_learner_process, stop_learner_process
+
+os.environ['FRAUD_PREFORK'] = '1'
+os.environ.setdefault('FRAUD_MODEL_THREADS', '1')
+os.environ.setdefault('OMP_NUM_THREADS', os.environ['FRAUD_MODEL_THREADS'])
+
+settings = prefork_settings('FRAUD')
+bind = settings['bind']
+workers = settings['workers']
+threads = settings['threads']
+worker_class = settings['worker_class']
+preload_app = settings['preload_app']
+timeout = settings['timeout']
+chdir = HERE
+wsgi_app = 'xgboost_asgi:app' if settings['asgi'] else 'xgboost_model:app'
+
+
+def on_starting(server):
+    import xgboost_model
+    xgboost_model.load_models()
+
+
+def when_ready(server):
+    import xgboost_model
+    if xgboost_model.online_updates:
+        server.updater_process = start_learner_process(xgboost_model.run_updater_process, 'fraud-updater')
+
+
+def post_fork(server, worker):
+    import xgboost_model
+    xgboost_model.start_worker()
+
+
+def on_exit(server):
+    stop_learner_process(getattr(server, 'updater_process', None))
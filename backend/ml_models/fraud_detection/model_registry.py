@@ -0,0 +1,207 @@
+import os
+import queue
+import threading
+import time
+
+CURRENT_FILE = 'CURRENT'
+
+
+def publish_version(root, version):
+    """Atomically point `root/CURRENT` at an artifact version directory"""
+    tmp_path = os.path.join(root, CURRENT_FILE + '.tmp')
+    with open(tmp_path, 'w') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(root, CURRENT_FILE))
+
+
+def current_version(root):
+    """Version `root/CURRENT` points at, or None when nothing is published"""
+    try:
+        with open(os.path.join(root, CURRENT_FILE)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class ModelHolder:
+    """Serves the live model and swaps in new versions without blocking requests
+
+    Request handlers read `current` once and keep that reference for the
+    whole request, so a swap never affects in-flight work. Loading happens
+    off the request path; only the final reference assignment is shared.
+    """
+
+    def __init__(self, loader, model=None, version=None):
+        self.loader = loader
+        self._live = (model, version)
+        self._load_lock = threading.Lock()
+        self._watcher = None
+        self._stop = threading.Event()
+
+    @property
+    def current(self):
+        return self._live[0]
+
+    @property
+    def version(self):
+        return self._live[1]
+
+    def swap(self, model, version):
+        """Publish `model` to new requests"""
+        self._live = (model, version)
+
+    def publish(self, model, save):
+        """Swap in `model` under the version `save(model)` writes it as
+
+        Writing and swapping happen under the load lock, so a watcher that
+        sees the new version on disk finds it already live and skips it.
+        """
+        with self._load_lock:
+            version = save(model)
+            self.swap(model, version)
+            return version
+
+    def load_version(self, root, version):
+        """Load `root/<version>` and swap it in unless it is already live"""
+        with self._load_lock:
+            if version == self.version:
+                return False
+            start = time.perf_counter()
+            model = self.loader(os.path.join(root, version))
+            self.swap(model, version)
+            print(f"Model version {version} live after {time.perf_counter() - start:.3f}s load")
+            return True
+
+    def reload(self, root):
+        """Swap in whatever version `root/CURRENT` points at"""
+        version = current_version(root)
+        if version is None:
+            return False
+        return self.load_version(root, version)
+
+    def reload_async(self, root):
+        """Reload in a background thread"""
+        thread = threading.Thread(target=self._reload_logged, args=(root,), daemon=True)
+        thread.start()
+        return thread
+
+    def _reload_logged(self, root):
+        try:
+            self.reload(root)
+        except Exception as e:
+            print(f"Model reload from {root} failed: {e}")
+
+    def watch(self, root, interval=30.0):
+        """Poll `root/CURRENT` and hot-swap new versions as they are published"""
+        def loop():
+            while not self._stop.wait(interval):
+                self._reload_logged(root)
+
+        self._watcher = threading.Thread(target=loop, daemon=True)
+        self._watcher.start()
+        return self._watcher
+
+    def stop(self):
+        self._stop.set()
+
+
+class ModelUpdater:
+    """Applies incremental updates in a background thread and swaps them in
+
+    Labeled records are queued by `submit` and coalesced until `min_batch`
+    rows have arrived or `max_wait` seconds have passed since the first one.
+    `update_fn(model, records)` builds the updated model from the live one;
+    it is published through the holder, and written as a new artifact
+    version under `publish_root` when one is given.
+    """
+
+    def __init__(self, holder, update_fn, min_batch=1000, max_wait=60.0, publish_root=None):
+        self.holder = holder
+        self.update_fn = update_fn
+        self.min_batch = min_batch
+        self.max_wait = max_wait
+        self.publish_root = publish_root
+        self.updates_applied = 0
+        self.rows_applied = 0
+        self.last_update_seconds = None
+        self.last_error = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def submit(self, records):
+        """Queue labeled records for the next update"""
+        self._queue.put(list(records))
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        self._stop.set()
+
+    def _next_batch(self):
+        try:
+            batch = self._queue.get(timeout=1.0)
+        except queue.Empty:
+            return None
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.min_batch and not self._stop.is_set():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.extend(self._queue.get(timeout=min(remaining, 1.0)))
+            except queue.Empty:
+                continue
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self.apply(batch)
+
+    def apply(self, records):
+        """Build, publish and swap in one update synchronously"""
+        start = time.perf_counter()
+        try:
+            model = self.update_fn(self.holder.current, records)
+            if self.publish_root:
+                version = self.holder.publish(
+                    model, lambda m: os.path.basename(m.save_artifact(self.publish_root))
+                )
+            else:
+                version = f"{self.holder.version or 'base'}+u{self.updates_applied + 1}"
+                self.holder.swap(model, version)
+        except Exception as e:
+            self.last_error = str(e)
+            print(f"Incremental update of {len(records)} records failed: {e}")
+            return False
+        self.updates_applied += 1
+        self.rows_applied += len(records)
+        self.last_update_seconds = time.perf_counter() - start
+        print(f"Model version {version} live after incremental update of "
+              f"{len(records)} records in {self.last_update_seconds:.3f}s")
+        return True
+
+    def stats(self):
+        return {
+            'running': self.running,
+            'pending_batches': self.pending,
+            'updates_applied': self.updates_applied,
+            'rows_applied': self.rows_applied,
+            'last_update_seconds': self.last_update_seconds,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,200 @@
+import json
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.tree import DecisionTreeRegressor
+
+PRESCREEN_FIELDS = ['amount', 'previousDeclines', 'velocityLastHour']
+
+
+class FraudPrescreen:
+    """Shallow regression tree distilled from the full fraud model
+
+    Scores a transaction from a few raw request fields plus a one-hot device.
+    Transactions whose distilled score is at or below `threshold` are
+    answered directly; everything else, including unseen devices, goes on to
+    the full model. The threshold is calibrated so that on the calibration
+    set at most `max_miss_rate` of short-circuited transactions score at or
+    above `alert_score` under the full model; its default matches the
+    REVIEW cut-off applied by the backend's fraud service.
+    """
+
+    def __init__(self, max_depth=4, min_samples_leaf=200):
+        self.max_depth = max_depth
+        self.min_samples_leaf = min_samples_leaf
+        self.devices = []
+        self.threshold = -np.inf
+        self.feature = np.zeros(1, dtype=np.int64)
+        self.split = np.zeros(1)
+        self.left = np.full(1, -1, dtype=np.int64)
+        self.right = np.full(1, -1, dtype=np.int64)
+        self.value = np.zeros(1)
+        self.calibration = {}
+        self._compile()
+        self.reset_stats()
+
+    def _compile(self):
+        """Plain-list copies of the tree for per-request traversal"""
+        self._nodes = list(zip(
+            self.feature.tolist(), self.split.tolist(), self.left.tolist(),
+            self.right.tolist(), self.value.tolist()
+        ))
+        self._device_codes = {device: i for i, device in enumerate(self.devices)}
+
+    def reset_stats(self):
+        self.requests = 0
+        self.short_circuited = 0
+        self.prescreen_seconds = 0.0
+        self.full_requests = 0
+        self.full_seconds = 0.0
+
+    def raw_matrix(self, df):
+        """Raw prescreen inputs for a frame and a mask of rows with a known device"""
+        X = np.zeros((len(df), len(PRESCREEN_FIELDS) + len(self.devices)))
+        for i, field in enumerate(PRESCREEN_FIELDS):
+            X[:, i] = pd.to_numeric(df[field], errors='coerce').fillna(0).to_numpy(dtype=np.float64)
+        device_codes = pd.Index(self.devices).get_indexer(df['deviceInfo'].astype(str))
+        known = device_codes >= 0
+        X[np.nonzero(known)[0], len(PRESCREEN_FIELDS) + device_codes[known]] = 1.0
+        return X, known
+
+    def fit(self, df, full_scores, alert_score=0.4, max_miss_rate=0.001):
+        """Distill the tree from full-model scores and calibrate the threshold"""
+        full_scores = np.asarray(full_scores, dtype=np.float64)
+        self.devices = sorted(df['deviceInfo'].astype(str).unique().tolist())
+        X, known = self.raw_matrix(df)
+
+        tree = DecisionTreeRegressor(
+            max_depth=self.max_depth, min_samples_leaf=self.min_samples_leaf, random_state=42
+        ).fit(X, full_scores)
+        self.feature = tree.tree_.feature.astype(np.int64)
+        self.split = tree.tree_.threshold.astype(np.float64)
+        self.left = tree.tree_.children_left.astype(np.int64)
+        self.right = tree.tree_.children_right.astype(np.int64)
+        self.value = tree.tree_.value[:, 0, 0].astype(np.float64)
+
+        # Admit leaves from the safest up while the share of short-circuited
+        # rows the full model would alert on stays within budget
+        distilled = self.value[tree.apply(X)]
+        alerts = full_scores >= alert_score
+        self.threshold = -np.inf
+        for leaf_value in np.unique(distilled):
+            covered = distilled <= leaf_value
+            if alerts[covered].mean() > max_miss_rate:
+                break
+            self.threshold = float(leaf_value)
+
+        covered = known & (distilled <= self.threshold)
+        self.calibration = {
+            'rows': int(len(df)),
+            'alert_score': alert_score,
+            'max_miss_rate': max_miss_rate,
+            'threshold': self.threshold,
+            'short_circuit_rate': float(covered.mean()),
+            'miss_rate': float(alerts[covered].mean()) if covered.any() else 0.0,
+            'max_abs_error': float(np.abs(distilled - full_scores)[covered].max()) if covered.any() else 0.0,
+        }
+        self._compile()
+        return self
+
+    def score(self, txn):
+        """Distilled score for one request dict, or None when it must go to the full model"""
+        start = time.perf_counter()
+        result = None
+        device = self._device_codes.get(str(txn.get('deviceInfo')))
+        if device is not None:
+            x = [float(txn.get(field) or 0) for field in PRESCREEN_FIELDS]
+            n_fields = len(x)
+            node = self._nodes[0]
+            while node[2] != -1:
+                feature = node[0]
+                value = x[feature] if feature < n_fields else float(feature - n_fields == device)
+                node = self._nodes[node[2] if value <= node[1] else node[3]]
+            if node[4] <= self.threshold:
+                result = node[4]
+
+        self.requests += 1
+        self.prescreen_seconds += time.perf_counter() - start
+        if result is not None:
+            self.short_circuited += 1
+        return result
+
+    def score_batch(self, df):
+        """Distilled scores for a frame, NaN where the full model is needed"""
+        start = time.perf_counter()
+        X, known = self.raw_matrix(df)
+        rows = np.arange(len(X))
+        node = np.zeros(len(X), dtype=np.int64)
+        for _ in range(self.max_depth):
+            internal = self.left[node] != -1
+            go_left = X[rows, np.maximum(self.feature[node], 0)] <= self.split[node]
+            node = np.where(internal, np.where(go_left, self.left[node], self.right[node]), node)
+        values = self.value[node]
+        confident = known & (values <= self.threshold)
+
+        self.requests += len(X)
+        self.prescreen_seconds += time.perf_counter() - start
+        self.short_circuited += int(confident.sum())
+        return np.where(confident, values, np.nan)
+
+    def record_full(self, seconds, rows=1):
+        """Account for time spent in the full model on forwarded transactions"""
+        self.full_requests += rows
+        self.full_seconds += seconds
+
+    def stats(self):
+        """Short-circuit rate and the full-model time it saved"""
+        full_us = self.full_seconds / self.full_requests * 1e6 if self.full_requests else None
+        prescreen_us = self.prescreen_seconds / self.requests * 1e6 if self.requests else None
+        saved_seconds = None
+        if full_us is not None:
+            saved_seconds = self.short_circuited * full_us / 1e6 - self.prescreen_seconds
+        return {
+            'requests': self.requests,
+            'short_circuited': self.short_circuited,
+            'short_circuit_rate': self.short_circuited / self.requests if self.requests else 0.0,
+            'prescreen_us_per_request': prescreen_us,
+            'full_us_per_request': full_us,
+            'latency_saved_seconds': saved_seconds,
+            'calibration': self.calibration,
+        }
+
+    def save(self, path):
+        """Write the tree and calibration to an .npz file"""
+        np.savez(
+            path,
+            max_depth=self.max_depth,
+            min_samples_leaf=self.min_samples_leaf,
+            devices=np.array(self.devices, dtype=str),
+            threshold=self.threshold,
+            feature=self.feature,
+            split=self.split,
+            left=self.left,
+            right=self.right,
+            value=self.value,
+            calibration=json.dumps(self.calibration),
+        )
+
+    @classmethod
+    def load(cls, path):
+        """Restore a prescreen written by `save`"""
+        with np.load(path) as data:
+            prescreen = cls(int(data['max_depth']), int(data['min_samples_leaf']))
+            prescreen.devices = data['devices'].tolist()
+            prescreen.threshold = float(data['threshold'])
+            for name in ('feature', 'split', 'left', 'right', 'value'):
+                setattr(prescreen, name, data[name].copy())
+            prescreen.calibration = json.loads(str(data['calibration']))
+        prescreen._compile()
+        return prescreen
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state.pop('_nodes', None)
+        state.pop('_device_codes', None)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._compile()
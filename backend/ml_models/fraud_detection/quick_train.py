@@ -1,19 +1,38 @@
+import argparse
 import os
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 from xgboost_model import FraudDetectionXGBoost
 
-def csv_main():
-    csv_in = 'creditcard.csv'
-    csv_out = 'creditcard_augmented.csv'
-
-    if not os.path.exists(csv_in):
-        raise FileNotFoundError(
-            f"Please download 'creditcard.csv' into this folder before running."
-        )
-
-    df = pd.read_csv(csv_in)
+CSV_IN = 'creditcard.csv'
+CACHE_PATH = 'creditcard_augmented.arrow'
+CHUNK_ROWS = 250_000
+NUM_USERS = 1000
+
+USERS = [f'user_{i}' for i in range(NUM_USERS)]
+CATEGORIES = [
+    'online_retail', 'electronics', 'luxury_goods',
+    'travel', 'subscription', 'gambling'
+]
+LOCATIONS = [
+    'San Francisco, CA', 'New York, NY',
+    'unknown', 'tor_network', 'vpn'
+]
+DEVICES = [
+    'Chrome/Mac', 'Firefox/Windows',
+    'Safari/iOS', 'AndroidApp', 'emulator'
+]
+
+def cache_is_fresh(cache_path=CACHE_PATH, source_path=CSV_IN):
+    """True when the columnar cache exists and is newer than its CSV source"""
+    return (
+        os.path.exists(cache_path)
+        and os.path.getmtime(cache_path) >= os.path.getmtime(source_path)
+    )
 
+def augment_chunk(df, offset, rng):
+    """Rename credit-card columns and add the synthetic transaction fields"""
     df = df.rename(columns={
         'Time':   'time_seconds',
         'Class':  'isFraud',
@@ -27,55 +46,122 @@ def csv_main():
     )
     df.drop(columns=['time_seconds'], inplace=True)
 
-    df['userId'] = ['user_' + str(i % 1000) for i in df.index]
-
-    categories = [
-        'online_retail', 'electronics', 'luxury_goods',
-        'travel', 'subscription', 'gambling'
-    ]
-    df['merchantCategory'] = np.random.choice(categories, size=len(df))
-
-    locations = [
-        'San Francisco, CA', 'New York, NY',
-        'unknown', 'tor_network', 'vpn'
-    ]
-    df['location'] = np.random.choice(locations, size=len(df))
+    n = len(df)
+    user_codes = (offset + np.arange(n)) % NUM_USERS
+    df['userId'] = pd.Categorical.from_codes(user_codes, categories=USERS)
+    df['merchantCategory'] = pd.Categorical.from_codes(
+        rng.integers(0, len(CATEGORIES), size=n), categories=CATEGORIES
+    )
+    df['location'] = pd.Categorical.from_codes(
+        rng.integers(0, len(LOCATIONS), size=n), categories=LOCATIONS
+    )
+    df['deviceInfo'] = pd.Categorical.from_codes(
+        rng.integers(0, len(DEVICES), size=n), categories=DEVICES
+    )
 
-    devices = [
-        'Chrome/Mac', 'Firefox/Windows',
-        'Safari/iOS', 'AndroidApp', 'emulator'
-    ]
-    df['deviceInfo'] = np.random.choice(devices, size=len(df))
+    df['previousDeclines']  = rng.poisson(lam=0.1, size=n)
+    df['velocityLastHour']  = rng.poisson(lam=0.5, size=n)
+    return df
 
-    df['previousDeclines']  = np.random.poisson(lam=0.1, size=len(df))
-    df['velocityLastHour']  = np.random.poisson(lam=0.5, size=len(df))
+def csv_main(csv_in=CSV_IN, cache_path=CACHE_PATH, chunk_rows=CHUNK_ROWS, force=False):
+    """Stream the credit-card CSV into an augmented Arrow IPC cache
 
-    df.to_csv(csv_out, index=False)
-    print(f"Augmented dataset written to '{csv_out}' ({len(df)} rows).")
+    The CSV is read in chunks so datasets larger than memory can be
+    augmented; categorical columns are stored as Arrow dictionaries.
+    """
+    if not os.path.exists(csv_in):
+        raise FileNotFoundError(
+            f"Please download '{csv_in}' into this folder before running."
+        )
 
-def main():
-    csv_path = 'creditcard_augmented.csv'
+    if not force and cache_is_fresh(cache_path, csv_in):
+        print(f"Augmented cache '{cache_path}' is up to date, skipping augmentation.")
+        return
+
+    rng = np.random.default_rng()
+    tmp_path = cache_path + '.tmp'
+    writer = None
+    rows = 0
+    try:
+        for chunk in pd.read_csv(csv_in, chunksize=chunk_rows):
+            batch = pa.RecordBatch.from_pandas(
+                augment_chunk(chunk, rows, rng), preserve_index=False
+            )
+            if writer is None:
+                writer = pa.ipc.new_file(tmp_path, batch.schema)
+            writer.write_batch(batch)
+            rows += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+
+    os.replace(tmp_path, cache_path)
+    print(f"Augmented dataset written to '{cache_path}' ({rows} rows).")
+
+def load_cache(cache_path=CACHE_PATH, columns=None):
+    """Memory-map the augmented cache and return it as a DataFrame"""
+    table = pa.ipc.open_file(pa.memory_map(cache_path)).read_all()
+    if columns is not None:
+        table = table.select(columns)
+    return table.to_pandas()
+
+def iter_cache_chunks(cache_path=CACHE_PATH):
+    """Yield the augmented cache one record batch at a time"""
+    reader = pa.ipc.open_file(pa.memory_map(cache_path))
+    for i in range(reader.num_record_batches):
+        yield reader.get_batch(i).to_pandas()
+
+def main(external_memory=False, nthread=None, early_stopping_rounds=None, use_scaler=True,
+         prescreen=False, prescreen_rows=200_000):
+    cache_path = CACHE_PATH
     model_path = 'fraud_model.joblib'
 
-    if not os.path.exists(csv_path):
+    if not os.path.exists(cache_path):
         raise FileNotFoundError(
-            f"Augmented file '{csv_path}' not found. Run 'augment_creditcard.py' first."
+            f"Augmented cache '{cache_path}' not found. Run 'csv_main()' first."
         )
 
-    print("Loading augmented dataset...")
-    df = pd.read_csv(csv_path)
-
-    if df['timestamp'].dtype == object:
-        df['timestamp'] = pd.to_datetime(df['timestamp'])
-
     print("Initializing FraudDetectionXGBoost modeler...")
     modeler = FraudDetectionXGBoost()
 
     print("Starting training...")
-    modeler.train(df)
+    if external_memory:
+        modeler.train_external_memory(
+            lambda: iter_cache_chunks(cache_path),
+            cache_dir='xgb_external_cache',
+            nthread=nthread,
+            early_stopping_rounds=early_stopping_rounds or 20
+        )
+    else:
+        print("Loading augmented dataset...")
+        df = load_cache(cache_path)
+        modeler.train(
+            df,
+            nthread=nthread,
+            early_stopping_rounds=early_stopping_rounds,
+            use_scaler=use_scaler
+        )
+    
+    if prescreen:
+        print("Calibrating prescreen stage...")
+        if external_memory:
+            sample = next(iter_cache_chunks(cache_path))
+        else:
+            sample = df
+        modeler.fit_prescreen(sample.sample(n=min(len(sample), prescreen_rows), random_state=42))
     modeler.save_model(model_path)
     print(f"Training complete. Model saved to '{model_path}'.")
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Augment the credit-card dataset and train the fraud model')
+    parser.add_argument('--external-memory', action='store_true',
+                        help='stream the cache into an external-memory DMatrix instead of loading it')
+    parser.add_argument('--nthread', type=int, default=None)
+    parser.add_argument('--early-stopping-rounds', type=int, default=None)
+    parser.add_argument('--no-scaler', dest='use_scaler', action='store_false')
+    parser.add_argument('--prescreen', action='store_true',
+                        help='distill and calibrate the prescreen cascade stage after training')
+    args = parser.parse_args()
+
     csv_main()
-    main()
+    main(args.external_memory, args.nthread, args.early_stopping_rounds, args.use_scaler, args.prescreen)
@@ -0,0 +1,60 @@
+"""ASGI front end for the fraud model
+
+Serves /invocations natively: orjson decoding and encoding, one-pass
+validation against a compiled schema, and scoring on a bounded thread pool
+that answers 429 once FRAUD_MAX_PENDING calls are in flight. Every other
+URL goes to the Flask app unchanged.
+
+Run with `python xgboost_asgi.py`, or set FRAUD_ASGI=1 for gunicorn.conf.py
+to run it in prefork workers.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'serving'))
+
+from asgi import BoundedExecutor, asgi_app
+from schema import NUMBER, Field, compile_schema
+import xgboost_model
+
+TRANSACTION = compile_schema({
+    'amount': Field(NUMBER, required=True),
+    'timestamp': Field(str, required=True),
+    'userId': Field((str, int), nullable=True),
+    'merchantCategory': Field(str, nullable=True),
+    'location': Field(str, nullable=True),
+    'deviceInfo': Field(str, nullable=True),
+    'previousDeclines': Field(NUMBER, nullable=True),
+    'velocityLastHour': Field(NUMBER, nullable=True),
+    'isFraud': Field(NUMBER, nullable=True),
+})
+BATCH = compile_schema({'instances': Field(list, required=True, items=TRANSACTION)})
+
+
+def validate_invocation(data):
+    """A single transaction, or a batch under `instances`"""
+    if isinstance(data, dict) and 'instances' in data:
+        return BATCH(data)
+    return TRANSACTION(data)
+
+
+executor = BoundedExecutor(
+    workers=int(os.environ.get('FRAUD_WORKER_THREADS', '4')),
+    max_pending=int(os.environ.get('FRAUD_MAX_PENDING', '64'))
+)
+
+app = asgi_app(
+    '/fraud-xgboost-endpoint-local',
+    {'invocations': (xgboost_model.invoke, validate_invocation)},
+    executor,
+    xgboost_model.app,
+    metrics=xgboost_model.stage_metrics
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    xgboost_model.load_models()
+    xgboost_model.start_standalone()
+
+    uvicorn.run(app, host='0.0.0.0', port=8080)
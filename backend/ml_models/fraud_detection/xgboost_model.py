@@ -2,201 +2,997 @@
 import xgboost as xgb
 import pandas as pd
 import numpy as np
-from sklearn.preprocessing import LabelEncoder, StandardScaler
+from sklearn.preprocessing import StandardScaler
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import classification_report, roc_auc_score
 import joblib
 import json
+import math
 import os
+import queue
+import sys
+import time
+from datetime import datetime, timezone
+from feature_store import FraudFeatureStore, STORE_FEATURES
+from categorical_encoder import CategoricalEncoder
+from prescreen import FraudPrescreen
+from model_registry import ModelHolder, ModelUpdater, current_version, publish_version
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'serving'))
+from micro_batcher import MicroBatcher
+from prefork import message_queue, run_until_terminated
+from run_stats import RunStats
+from stage_metrics import PROMETHEUS_CONTENT_TYPE, StageMetrics, perf_counter_ns
+from profiler import SamplingProfiler
+
+ARTIFACT_FORMAT = 1
+
+# Threads one prediction may use; 0 leaves XGBoost's default of every core
+MODEL_THREADS = int(os.environ.get('FRAUD_MODEL_THREADS', '0'))
+
+# Per-stage latency histograms behind /metrics; while None every hook is a single comparison
+stage_metrics = StageMetrics('fraud') if os.environ.get('FRAUD_STAGE_METRICS') == '1' else None
+
+VELOCITY_WINDOW = '1h'
+
+FEATURE_COLUMNS = [
+    'amount', 'amount_log', 'amount_zscore',
+    'hour', 'day_of_week', 'is_weekend', 'is_night',
+    'velocity_1h', 'velocity_amount_1h',
+    'user_avg_amount', 'user_std_amount', 'user_tx_count', 'user_merchant_diversity',
+    'merchant_avg_amount', 'merchant_tx_count', 'merchant_fraud_rate',
+    'merchantCategory_encoded', 'location_encoded', 'deviceInfo_encoded',
+    'previousDeclines', 'velocityLastHour'
+]
+
+XGB_PARAMS = {
+    'max_depth': 6,
+    'learning_rate': 0.1,
+    'subsample': 0.8,
+    'colsample_bytree': 0.8,
+    'random_state': 42,
+}
+
+def feature_store_path(model_path):
+    """Location of the feature store snapshot saved next to a model file"""
+    return os.path.splitext(model_path)[0] + '_features.npz'
+
+def parse_timestamp(value):
+    """Parse a request timestamp without going through pandas when possible"""
+    if isinstance(value, datetime):
+        return value
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return pd.Timestamp(value)
+
+class FeatureChunkIter(xgb.DataIter):
+    """Feeds feature chunks saved as .npy files into an external-memory DMatrix"""
+    def __init__(self, chunk_paths, cache_prefix):
+        self._chunk_paths = chunk_paths
+        self._position = 0
+        super().__init__(cache_prefix=cache_prefix)
+    
+    def next(self, input_data):
+        if self._position == len(self._chunk_paths):
+            return 0
+        X_path, y_path = self._chunk_paths[self._position]
+        input_data(data=np.load(X_path, mmap_mode='r'), label=np.load(y_path, mmap_mode='r'))
+        self._position += 1
+        return 1
+    
+    def reset(self):
+        self._position = 0
 
 class FraudDetectionXGBoost:
     def __init__(self):
         self.model = None
-        self.label_encoders = {}
+        self.categorical_encoder = CategoricalEncoder()
         self.scaler = StandardScaler()
         self.feature_names = []
+        self.feature_store = None
+        self.last_run_stats = None
+        self.prescreen = None
+        self._fast_path = None
         
-    def prepare_features(self, df):
-        """Feature engineering for fraud detection"""
+    def add_time_features(self, df):
+        """Calendar features; returns the parsed timestamps for reuse"""
+        timestamps = pd.to_datetime(df['timestamp'])
         
-        df['hour'] = pd.to_datetime(df['timestamp']).dt.hour
-        df['day_of_week'] = pd.to_datetime(df['timestamp']).dt.dayofweek
+        df['hour'] = timestamps.dt.hour
+        df['day_of_week'] = timestamps.dt.dayofweek
         df['is_weekend'] = df['day_of_week'].isin([5, 6]).astype(int)
         df['is_night'] = ((df['hour'] < 6) | (df['hour'] > 22)).astype(int)
         
+        return timestamps
+    
+    def prepare_features(self, df):
+        """Feature engineering for fraud detection"""
+        timestamps = self.add_time_features(df)
+        
         df['amount_log'] = np.log1p(df['amount'])
         df['amount_zscore'] = (df['amount'] - df['amount'].mean()) / df['amount'].std()
         
-        df['velocity_1h'] = df.groupby('userId')['amount'].transform(
-            lambda x: x.rolling(window=10, min_periods=1).count()
-        )
-        df['velocity_amount_1h'] = df.groupby('userId')['amount'].transform(
-            lambda x: x.rolling(window=10, min_periods=1).sum()
-        )
+        df['velocity_1h'], df['velocity_amount_1h'] = self.rolling_velocity(df, timestamps)
         
-        user_stats = df.groupby('userId').agg({
-            'amount': ['mean', 'std', 'count'],
-            'merchantCategory': lambda x: x.nunique()
-        }).round(2)
-        user_stats.columns = ['user_avg_amount', 'user_std_amount', 'user_tx_count', 'user_merchant_diversity']
-        df = df.merge(user_stats, left_on='userId', right_index=True, how='left')
+        by_user = df.groupby('userId')
+        df['user_avg_amount'] = by_user['amount'].transform('mean').round(2)
+        df['user_std_amount'] = by_user['amount'].transform('std').round(2)
+        df['user_tx_count'] = by_user['amount'].transform('count')
+        df['user_merchant_diversity'] = by_user['merchantCategory'].transform('nunique')
         
-        merchant_stats = df.groupby('merchantCategory').agg({
-            'amount': ['mean', 'count'],
-            'isFraud': 'mean'
-        }).round(4)
-        merchant_stats.columns = ['merchant_avg_amount', 'merchant_tx_count', 'merchant_fraud_rate']
-        df = df.merge(merchant_stats, left_on='merchantCategory', right_index=True, how='left')
+        by_merchant = df.groupby('merchantCategory')
+        df['merchant_avg_amount'] = by_merchant['amount'].transform('mean').round(4)
+        df['merchant_tx_count'] = by_merchant['amount'].transform('count')
+        df['merchant_fraud_rate'] = by_merchant['isFraud'].transform('mean').round(4)
         
         return df
     
-    def encode_categorical_features(self, df, fit=True):
-        """Encode categorical features"""
-        categorical_cols = ['merchantCategory', 'location', 'deviceInfo']
-        
-        for col in categorical_cols:
-            if col in df.columns:
-                if fit:
-                    le = LabelEncoder()
-                    df[f'{col}_encoded'] = le.fit_transform(df[col].astype(str))
-                    self.label_encoders[col] = le
-                else:
-                    if col in self.label_encoders:
-                        df[f'{col}_encoded'] = df[col].astype(str).map(
-                            lambda x: self.label_encoders[col].transform([x])[0] 
-                            if x in self.label_encoders[col].classes_ else -1
-                        )
-                    else:
-                        df[f'{col}_encoded'] = -1
+    def rolling_velocity(self, df, timestamps, window=VELOCITY_WINDOW):
+        """Per-user transaction count and amount over a trailing time window
+
+        Rows are ordered by user then time so a single native groupby-rolling
+        pass covers every user; results are scattered back to the input order.
+        """
+        times = pd.DatetimeIndex(timestamps)
+        if times.tz is not None:
+            times = times.tz_convert(None)
+        users, _ = pd.factorize(df['userId'])
+        order = np.lexsort((times.asi8, users))
+        ordered = pd.DataFrame(
+            {'user': users[order], 'amount': df['amount'].to_numpy(dtype=np.float64)[order]},
+            index=times[order]
+        )
+        rolling = ordered.groupby('user', sort=True)['amount'].rolling(window)
         
-        return df
+        count = np.empty(len(df))
+        total = np.empty(len(df))
+        count[order] = rolling.count().to_numpy()
+        total[order] = rolling.sum().to_numpy()
+        return count, total
     
-    def train(self, df):
-        """Train XGBoost model"""
-        print("Preparing features...")
-        df = self.prepare_features(df)
-        df = self.encode_categorical_features(df, fit=True)
+    def prepare_batch_features(self, df):
+        """Feature engineering for a batch of independently scored transactions
+
+        Aggregates come from the online feature store when one is attached.
+        Without a store this yields the values `prepare_features` produces for
+        each row scored on its own, without the groupby/merge passes.
+        """
+        timestamps = self.add_time_features(df)
         
-        feature_cols = [
-            'amount', 'amount_log', 'amount_zscore',
-            'hour', 'day_of_week', 'is_weekend', 'is_night',
-            'velocity_1h', 'velocity_amount_1h',
-            'user_avg_amount', 'user_std_amount', 'user_tx_count', 'user_merchant_diversity',
-            'merchant_avg_amount', 'merchant_tx_count', 'merchant_fraud_rate',
-            'merchantCategory_encoded', 'location_encoded', 'deviceInfo_encoded',
-            'previousDeclines', 'velocityLastHour'
-        ]
+        amount = df['amount'].astype(float)
+        df['amount_log'] = np.log1p(amount)
         
-        available_features = [col for col in feature_cols if col in df.columns]
-        self.feature_names = available_features
+        if self.feature_store is not None:
+            df[STORE_FEATURES] = self.feature_store.lookup(df, timestamps)
+            return df
         
-        X = df[available_features].fillna(0)
-        y = df['isFraud']
+        df['amount_zscore'] = np.nan
         
-        X_scaled = self.scaler.fit_transform(X)
+        df['velocity_1h'] = 1.0
+        df['velocity_amount_1h'] = amount
         
-        X_train, X_test, y_train, y_test = train_test_split(
-            X_scaled, y, test_size=0.2, random_state=42, stratify=y
-        )
+        df['user_avg_amount'] = amount.round(2)
+        df['user_std_amount'] = np.nan
+        df['user_tx_count'] = 1
+        df['user_merchant_diversity'] = df['merchantCategory'].notna().astype(int)
         
-        print(f"Training on {len(X_train)} samples with {len(available_features)} features")
+        df['merchant_avg_amount'] = amount.round(4)
+        df['merchant_tx_count'] = 1
+        is_fraud = df['isFraud'] if 'isFraud' in df.columns else pd.Series(0, index=df.index)
+        df['merchant_fraud_rate'] = is_fraud.fillna(0).astype(float).round(4)
         
-        self.model = xgb.XGBClassifier(
-            n_estimators=100,
-            max_depth=6,
-            learning_rate=0.1,
-            subsample=0.8,
-            colsample_bytree=0.8,
-            random_state=42,
-            use_label_encoder=False
-        )
+        return df
+    
+    def prepare_stream_features(self, df, history=None):
+        """Feature engineering for one chunk of a time-ordered training stream
 
-        self.model.fit(
-            X_train,
-            y_train,
-            verbose=True
-        )
-        \
+        Whole-history aggregates come from the feature store, which must have
+        ingested the full stream first. Velocity runs over the chunk plus
+        `history`, the rows of earlier chunks still inside the window. Returns
+        the features and the history to pass along with the next chunk.
+        """
+        timestamps = self.add_time_features(df)
+        df['amount_log'] = np.log1p(df['amount'])
+        
+        recent = pd.DataFrame({
+            'userId': df['userId'].astype(str).to_numpy(),
+            'amount': df['amount'].to_numpy(dtype=np.float64),
+            'timestamp': timestamps.to_numpy(),
+        })
+        if history is not None:
+            recent = pd.concat([history, recent], ignore_index=True)
+        count, total = self.rolling_velocity(recent, recent['timestamp'])
+        df['velocity_1h'] = count[-len(df):]
+        df['velocity_amount_1h'] = total[-len(df):]
+        
+        totals = self.feature_store.totals(df)
+        df[list(totals.columns)] = totals
+        df = self.categorical_encoder.transform(df)
+        
+        cutoff = recent['timestamp'].max() - pd.Timedelta(VELOCITY_WINDOW)
+        return df, recent[recent['timestamp'] > cutoff].reset_index(drop=True)
+    
+    def encode_categorical_features(self, df, fit=True):
+        """Encode categorical features"""
+        if fit:
+            self.categorical_encoder.fit(df)
+        
+        return self.categorical_encoder.transform(df)
+    
+    def train(self, df, n_estimators=100, tree_method='hist', nthread=None,
+              early_stopping_rounds=None, use_scaler=True):
+        """Train XGBoost model
+
+        With `early_stopping_rounds`, boosting stops once AUC on the held-out
+        split stops improving. `use_scaler=False` skips standardization, which
+        trees do not need.
+        """
+        self._fast_path = None
+        
+        with RunStats() as stats:
+            print("Seeding feature store...")
+            self.feature_store = FraudFeatureStore.from_frame(df)
+            
+            print("Preparing features...")
+            df = self.prepare_features(df)
+            df = self.encode_categorical_features(df, fit=True)
+            
+            available_features = [col for col in FEATURE_COLUMNS if col in df.columns]
+            self.feature_names = available_features
+            
+            X = df[available_features].fillna(0)
+            y = df['isFraud']
+            
+            if use_scaler:
+                self.scaler = StandardScaler()
+                X_model = self.scaler.fit_transform(X)
+            else:
+                self.scaler = None
+                X_model = X.to_numpy(dtype=np.float32)
+            
+            X_train, X_test, y_train, y_test = train_test_split(
+                X_model, y, test_size=0.2, random_state=42, stratify=y
+            )
+            
+            print(f"Training on {len(X_train)} samples with {len(available_features)} features")
+            
+            self.model = xgb.XGBClassifier(
+                n_estimators=n_estimators,
+                tree_method=tree_method,
+                n_jobs=nthread,
+                early_stopping_rounds=early_stopping_rounds,
+                eval_metric='auc',
+                use_label_encoder=False,
+                **XGB_PARAMS
+            )
+            
+            eval_set = [(X_test, y_test)] if early_stopping_rounds else None
+            self.model.fit(
+                X_train,
+                y_train,
+                eval_set=eval_set,
+                verbose=True
+            )
+        
         y_pred = self.model.predict(X_test)
         y_pred_proba = self.model.predict_proba(X_test)[:, 1]
         
         print("\nModel Performance:")
         print(classification_report(y_test, y_pred))
         print(f"ROC AUC: {roc_auc_score(y_test, y_pred_proba):.4f}")
+        self.report_run(stats, auc=roc_auc_score(y_test, y_pred_proba))
         
         return self.model
     
+    def train_external_memory(self, make_chunks, cache_dir, valid_fraction=0.1,
+                              num_boost_round=500, early_stopping_rounds=20,
+                              tree_method='hist', nthread=None):
+        """Train from a stream of raw chunks without holding the dataset in memory
+
+        `make_chunks` is called once per pass and must yield DataFrames in time
+        order. The first pass seeds the feature store and encoder; the second
+        writes feature matrices under `cache_dir`, from which XGBoost builds an
+        external-memory DMatrix. A random `valid_fraction` of rows is held out
+        in memory for early stopping. The scaler is skipped.
+        """
+        os.makedirs(cache_dir, exist_ok=True)
+        self._fast_path = None
+        self.scaler = None
+        self.feature_names = list(FEATURE_COLUMNS)
+        
+        with RunStats() as stats:
+            print("Seeding feature store and encoders...")
+            self.feature_store = FraudFeatureStore(capacity=1)
+            self.categorical_encoder = CategoricalEncoder()
+            for chunk in make_chunks():
+                self.feature_store.ingest(chunk)
+                self.categorical_encoder.partial_fit(chunk)
+            
+            print("Writing feature chunks...")
+            rng = np.random.default_rng(42)
+            chunk_paths, valid_X, valid_y = [], [], []
+            history = None
+            for i, chunk in enumerate(make_chunks()):
+                features, history = self.prepare_stream_features(chunk, history)
+                X = features[self.feature_names].fillna(0).to_numpy(dtype=np.float32)
+                y = features['isFraud'].to_numpy(dtype=np.float32)
+                valid = rng.random(len(X)) < valid_fraction
+                valid_X.append(X[valid])
+                valid_y.append(y[valid])
+                
+                X_path = os.path.join(cache_dir, f'chunk_{i:05d}_X.npy')
+                y_path = os.path.join(cache_dir, f'chunk_{i:05d}_y.npy')
+                np.save(X_path, X[~valid])
+                np.save(y_path, y[~valid])
+                chunk_paths.append((X_path, y_path))
+            
+            dtrain = xgb.DMatrix(FeatureChunkIter(chunk_paths, os.path.join(cache_dir, 'dmatrix')))
+            dvalid = xgb.DMatrix(np.concatenate(valid_X), label=np.concatenate(valid_y))
+            
+            params = dict(XGB_PARAMS, objective='binary:logistic', eval_metric='auc', tree_method=tree_method)
+            if nthread:
+                params['nthread'] = nthread
+            
+            print(f"Training on {dtrain.num_row()} samples from {len(chunk_paths)} chunks")
+            booster = xgb.train(
+                params,
+                dtrain,
+                num_boost_round=num_boost_round,
+                evals=[(dvalid, 'valid')],
+                early_stopping_rounds=early_stopping_rounds,
+                verbose_eval=10
+            )
+            self.model = self.classifier_from_booster(booster)
+        
+        auc = roc_auc_score(dvalid.get_label(), self.model.predict_proba(dvalid.get_data())[:, 1])
+        print(f"ROC AUC: {auc:.4f}")
+        self.report_run(stats, auc=auc)
+        
+        return self.model
+    
+    def classifier_from_booster(self, booster):
+        """Wrap a native Booster in the sklearn classifier the rest of the code expects"""
+        model = xgb.XGBClassifier()
+        model.load_model(bytearray(booster.save_raw(raw_format='ubj')))
+        return model
+    
+    def report_run(self, stats, **metrics):
+        """Record and print wall-clock time, peak memory and model size of a training run"""
+        booster = self.model.get_booster()
+        best_iteration = booster.attr('best_iteration')
+        self.last_run_stats = dict(
+            stats.as_dict(),
+            trees=booster.num_boosted_rounds(),
+            best_iteration=int(best_iteration) if best_iteration is not None else None,
+            **metrics
+        )
+        print(f"Training run: {json.dumps(self.last_run_stats)}")
+
+    def update(self, df, mode='append', num_boost_round=10, nthread=None):
+        """Return a copy of the model updated with a freshly labeled batch
+
+        `mode='append'` boosts `num_boost_round` new trees on the batch on top
+        of the existing ensemble; `mode='refresh'` keeps every tree's structure
+        and re-estimates its leaf values from the batch. Encoders and scaler
+        are reused unchanged. The batch goes into the feature store through
+        `apply_labels`, so transactions the store already observed when they
+        were scored only add their labels and the rest are ingested. The live
+        model is left untouched and shares its feature store with the copy.
+        """
+        if self.model is None:
+            raise ValueError("Model not trained yet")
+        if mode not in ('append', 'refresh'):
+            raise ValueError(f"Unknown update mode '{mode}'")
+
+        with RunStats() as stats:
+            if self.feature_store is None:
+                self.feature_store = FraudFeatureStore(capacity=1)
+            self.feature_store.apply_labels(df)
+
+            features, _ = self.prepare_stream_features(df.copy())
+            X = features[self.feature_names].fillna(0)
+            X = self.scaler.transform(X) if self.scaler is not None else X.to_numpy(dtype=np.float32)
+            dtrain = xgb.DMatrix(X, label=features['isFraud'].to_numpy(dtype=np.float32))
+
+            booster = self.model.get_booster()
+            best_iteration = booster.attr('best_iteration')
+            if best_iteration is not None:
+                booster = booster[:int(best_iteration) + 1]
+                booster.set_attr(best_iteration=None, best_score=None)
+
+            params = dict(XGB_PARAMS, objective='binary:logistic', eval_metric='auc', tree_method='hist')
+            if nthread:
+                params['nthread'] = nthread
+            if mode == 'refresh':
+                params.update(process_type='update', updater='refresh', refresh_leaf=True)
+                num_boost_round = booster.num_boosted_rounds()
+
+            booster = xgb.train(params, dtrain, num_boost_round=num_boost_round, xgb_model=booster)
+
+            updated = FraudDetectionXGBoost()
+            updated.model = self.classifier_from_booster(booster)
+            updated.categorical_encoder = self.categorical_encoder
+            updated.scaler = self.scaler
+            updated.feature_names = self.feature_names
+            updated.feature_store = self.feature_store
+            updated.prescreen = self.prescreen
+            updated._compile_fast_path()
+
+        updated.report_run(stats, mode=mode, rows=len(df))
+        return updated
+
     def predict(self, features):
         """Predict fraud probability"""
         if self.model is None:
             raise ValueError("Model not trained yet")
             
+        metrics = stage_metrics
+        if metrics is not None:
+            t = perf_counter_ns()
         if isinstance(features, dict):
-            df = pd.DataFrame([features])
+            df = self.prepare_batch_features(pd.DataFrame([features]))
         else:
-            df = features.copy()
+            df = self.prepare_features(features.copy())
+        if metrics is not None:
+            t = metrics.lap('prepare_features', t)
             
-        df = self.prepare_features(df)
         df = self.encode_categorical_features(df, fit=False)
+        if metrics is not None:
+            t = metrics.lap('encode_categorical', t)
         
         X = df[self.feature_names].fillna(0)
-        X_scaled = self.scaler.transform(X)
+        X_scaled = self.scaler.transform(X) if self.scaler is not None else X.to_numpy(dtype=np.float32)
+        if metrics is not None:
+            t = metrics.lap('scale', t)
         
         probabilities = self.model.predict_proba(X_scaled)[:, 1]
+        if metrics is not None:
+            metrics.lap('predict_proba', t)
         return probabilities[0] if len(probabilities) == 1 else probabilities
     
+    def predict_batch(self, instances):
+        """Predict fraud probabilities for many transactions with a single model call"""
+        if self.model is None:
+            raise ValueError("Model not trained yet")
+        
+        if isinstance(instances, pd.DataFrame):
+            df = instances.copy()
+        else:
+            df = pd.DataFrame(list(instances))
+        
+        if len(df) == 0:
+            return np.empty(0, dtype=np.float32)
+        
+        metrics = stage_metrics
+        if metrics is not None:
+            t = perf_counter_ns()
+        df = self.prepare_batch_features(df)
+        if metrics is not None:
+            t = metrics.lap('prepare_features', t)
+        df = self.encode_categorical_features(df, fit=False)
+        if metrics is not None:
+            t = metrics.lap('encode_categorical', t)
+        
+        X = df[self.feature_names].fillna(0)
+        X_scaled = self.scaler.transform(X) if self.scaler is not None else X.to_numpy(dtype=np.float32)
+        if metrics is not None:
+            t = metrics.lap('scale', t)
+        
+        probabilities = self.model.predict_proba(X_scaled)[:, 1]
+        if metrics is not None:
+            metrics.lap('predict_proba', t)
+        return probabilities
+    
+    def _compile_fast_path(self):
+        """Fold the scaler and booster into what `predict_fast` needs"""
+        if isinstance(self.scaler, StandardScaler) and hasattr(self.scaler, 'mean_'):
+            mean = np.asarray(self.scaler.mean_, dtype=np.float64)
+            scale = np.asarray(self.scaler.scale_, dtype=np.float64)
+        else:
+            mean = np.zeros(len(self.feature_names))
+            scale = np.ones(len(self.feature_names))
+        booster = self.model.get_booster()
+        if MODEL_THREADS:
+            booster.set_param({'nthread': MODEL_THREADS})
+            self.model.set_params(n_jobs=MODEL_THREADS)
+        best_iteration = booster.attr('best_iteration')
+        self._fast_path = {
+            'booster': booster,
+            'iteration_range': (0, int(best_iteration) + 1) if best_iteration is not None else (0, 0),
+            'mean': mean,
+            'scale': scale,
+            'positions': {name: i for i, name in enumerate(self.feature_names)},
+        }
+        return self._fast_path
+    
+    def build_feature_vector(self, features):
+        """Raw feature vector for one request dict, in `feature_names` order"""
+        fast = self._fast_path or self._compile_fast_path()
+        ts = parse_timestamp(features['timestamp'])
+        amount = float(features['amount'])
+        hour, day_of_week = ts.hour, ts.weekday()
+        
+        values = {
+            'amount': amount,
+            'amount_log': math.log1p(amount),
+            'hour': hour,
+            'day_of_week': day_of_week,
+            'is_weekend': int(day_of_week >= 5),
+            'is_night': int(hour < 6 or hour > 22),
+            'previousDeclines': features.get('previousDeclines'),
+            'velocityLastHour': features.get('velocityLastHour'),
+        }
+        for col in self.categorical_encoder.columns:
+            values[f'{col}_encoded'] = self.categorical_encoder.encode_value(col, features.get(col))
+        
+        if self.feature_store is not None:
+            values.update(zip(STORE_FEATURES, self.feature_store.lookup_one(features, ts)))
+        else:
+            merchant = features.get('merchantCategory')
+            values.update({
+                'velocity_1h': 1.0,
+                'velocity_amount_1h': amount,
+                'user_avg_amount': np.round(amount, 2),
+                'user_tx_count': 1,
+                'user_merchant_diversity': int(merchant is not None and merchant == merchant),
+                'merchant_avg_amount': np.round(amount, 4),
+                'merchant_tx_count': 1,
+                'merchant_fraud_rate': np.round(float(features.get('isFraud') or 0), 4),
+            })
+        
+        x = np.zeros(len(fast['positions']), dtype=np.float64)
+        for name, i in fast['positions'].items():
+            value = values.get(name)
+            if value is not None and value == value:
+                x[i] = value
+        return x
+    
+    def predict_fast(self, features):
+        """Predict fraud probability for one request dict via the native Booster"""
+        if self.model is None:
+            raise ValueError("Model not trained yet")
+        
+        metrics = stage_metrics
+        if metrics is not None:
+            t = perf_counter_ns()
+        fast = self._fast_path or self._compile_fast_path()
+        x = self.build_feature_vector(features)
+        if metrics is not None:
+            t = metrics.lap('build_features', t)
+        x_scaled = ((x - fast['mean']) / fast['scale']).astype(np.float32)
+        if metrics is not None:
+            t = metrics.lap('scale', t)
+        
+        prob = fast['booster'].inplace_predict(
+            x_scaled.reshape(1, -1), iteration_range=fast['iteration_range']
+        )[0]
+        if metrics is not None:
+            metrics.lap('booster_predict', t)
+        return prob
+    
+    def predict_fast_batch(self, instances, cascade=False):
+        """`predict_fast` for a list of request dicts with a single Booster call
+
+        With `cascade`, requests the prescreen can answer skip the Booster.
+        """
+        if self.model is None:
+            raise ValueError("Model not trained yet")
+
+        metrics = stage_metrics
+        probs = np.empty(len(instances), dtype=np.float64)
+        forward = list(range(len(instances)))
+        if cascade and self.prescreen is not None:
+            if metrics is not None:
+                t = perf_counter_ns()
+            forward = []
+            for i, features in enumerate(instances):
+                score = self.prescreen.score(features)
+                if score is None:
+                    forward.append(i)
+                else:
+                    probs[i] = score
+            if metrics is not None:
+                metrics.lap('prescreen', t)
+        if not forward:
+            return probs
+
+        start = time.perf_counter()
+        if metrics is not None:
+            t = perf_counter_ns()
+        fast = self._fast_path or self._compile_fast_path()
+        X = np.vstack([self.build_feature_vector(instances[i]) for i in forward])
+        if metrics is not None:
+            t = metrics.lap('build_features', t)
+        X_scaled = ((X - fast['mean']) / fast['scale']).astype(np.float32)
+        if metrics is not None:
+            t = metrics.lap('scale', t)
+        probs[forward] = fast['booster'].inplace_predict(X_scaled, iteration_range=fast['iteration_range'])
+        if metrics is not None:
+            metrics.lap('booster_predict', t)
+        if cascade and self.prescreen is not None:
+            self.prescreen.record_full(time.perf_counter() - start, len(forward))
+        return probs
+
+    def fit_prescreen(self, df, alert_score=0.4, max_miss_rate=0.001, max_depth=4):
+        """Distill and calibrate the prescreen stage against this model's scores on `df`"""
+        if self.model is None:
+            raise ValueError("Model not trained yet")
+        
+        df = df.drop(columns=['isFraud'], errors='ignore').reset_index(drop=True)
+        full_scores = self.predict_batch(df)
+        self.prescreen = FraudPrescreen(max_depth=max_depth).fit(
+            df, full_scores, alert_score=alert_score, max_miss_rate=max_miss_rate
+        )
+        print(f"Prescreen calibration: {json.dumps(self.prescreen.calibration)}")
+        return self.prescreen
+    
+    def predict_cascade(self, features):
+        """Score one request dict with the prescreen, falling back to the full model"""
+        if self.prescreen is not None:
+            metrics = stage_metrics
+            if metrics is not None:
+                t = perf_counter_ns()
+            score = self.prescreen.score(features)
+            if metrics is not None:
+                metrics.lap('prescreen', t)
+            if score is not None:
+                return score
+        
+        start = time.perf_counter()
+        prob = self.predict_fast(features)
+        if self.prescreen is not None:
+            self.prescreen.record_full(time.perf_counter() - start)
+        return prob
+    
+    def predict_batch_cascade(self, instances):
+        """`predict_batch` that only sends rows the prescreen is unsure about to the full model"""
+        df = instances.copy() if isinstance(instances, pd.DataFrame) else pd.DataFrame(list(instances))
+        if self.prescreen is None or len(df) == 0:
+            return self.predict_batch(df)
+        
+        metrics = stage_metrics
+        if metrics is not None:
+            t = perf_counter_ns()
+        scores = self.prescreen.score_batch(df)
+        if metrics is not None:
+            metrics.lap('prescreen', t)
+        forward = np.isnan(scores)
+        if forward.any():
+            start = time.perf_counter()
+            scores[forward] = self.predict_batch(df[forward].reset_index(drop=True))
+            self.prescreen.record_full(time.perf_counter() - start, int(forward.sum()))
+        return scores
+    
     def save_model(self, path):
         """Save model and encoders"""
         model_data = {
             'model': self.model,
-            'label_encoders': self.label_encoders,
+            'categorical_encoder': self.categorical_encoder,
             'scaler': self.scaler,
-            'feature_names': self.feature_names
+            'feature_names': self.feature_names,
+            'prescreen': self.prescreen
         }
         joblib.dump(model_data, path)
+        if self.feature_store is not None:
+            self.feature_store.save(feature_store_path(path))
         print(f"Model saved to {path}")
     
     def load_model(self, path):
         """Load model and encoders"""
         model_data = joblib.load(path)
+        self._fast_path = None
         self.model = model_data['model']
-        self.label_encoders = model_data['label_encoders']
+        if 'categorical_encoder' in model_data:
+            self.categorical_encoder = model_data['categorical_encoder']
+        else:
+            self.categorical_encoder = CategoricalEncoder.from_label_encoders(model_data['label_encoders'])
         self.scaler = model_data['scaler']
         self.feature_names = model_data['feature_names']
+        self.prescreen = model_data.get('prescreen')
+        store_path = feature_store_path(path)
+        self.feature_store = FraudFeatureStore.load(store_path) if os.path.exists(store_path) else None
         print(f"Model loaded from {path}")
+    
+    def save_artifact(self, root, version=None, publish=True):
+        """Write a versioned, pickle-free model directory under `root`
 
-from flask import Flask, request, jsonify
+        The directory holds the native UBJSON booster, encoder classes, scaler
+        parameters and feature store as flat .npz arrays, plus a manifest. It
+        is assembled under a temporary name and renamed into place, then
+        published through `root/CURRENT` unless `publish` is False.
+        """
+        version = version or datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%fZ')
+        path = os.path.join(root, version)
+        tmp_path = path + '.tmp'
+        os.makedirs(tmp_path)
+        
+        self.model.save_model(os.path.join(tmp_path, 'model.ubj'))
+        encoder = self.categorical_encoder
+        np.savez(
+            os.path.join(tmp_path, 'encoders.npz'),
+            **{col: np.asarray(classes).astype(str) for col, classes in encoder.classes_.items()}
+        )
+        if self.scaler is not None:
+            np.savez(os.path.join(tmp_path, 'scaler.npz'), mean=self.scaler.mean_, scale=self.scaler.scale_)
+        if self.feature_store is not None:
+            self.feature_store.save(os.path.join(tmp_path, 'features.npz'))
+        if self.prescreen is not None:
+            self.prescreen.save(os.path.join(tmp_path, 'prescreen.npz'))
+        
+        manifest = {
+            'format': ARTIFACT_FORMAT,
+            'version': version,
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'xgboost_version': xgb.__version__,
+            'feature_names': self.feature_names,
+            'categorical_columns': encoder.columns,
+            'files': sorted(os.listdir(tmp_path)),
+        }
+        with open(os.path.join(tmp_path, 'manifest.json'), 'w') as f:
+            json.dump(manifest, f, indent=2)
+        
+        os.rename(tmp_path, path)
+        if publish:
+            publish_version(root, version)
+        print(f"Model artifact saved to {path}")
+        return path
+    
+    def load_artifact(self, path):
+        """Load a model directory written by `save_artifact`"""
+        with open(os.path.join(path, 'manifest.json')) as f:
+            manifest = json.load(f)
+        if manifest['format'] > ARTIFACT_FORMAT:
+            raise ValueError(f"Unsupported model artifact format {manifest['format']}")
+        files = set(manifest['files'])
+        
+        model = xgb.XGBClassifier()
+        model.load_model(os.path.join(path, 'model.ubj'))
+        
+        encoder = CategoricalEncoder(manifest['categorical_columns'])
+        with np.load(os.path.join(path, 'encoders.npz')) as classes:
+            encoder.classes_ = {col: classes[col] for col in classes.files}
+        
+        scaler = None
+        if 'scaler.npz' in files:
+            with np.load(os.path.join(path, 'scaler.npz')) as params:
+                scaler = StandardScaler()
+                scaler.mean_ = params['mean']
+                scaler.scale_ = params['scale']
+                scaler.var_ = params['scale'] ** 2
+                scaler.n_features_in_ = len(params['mean'])
+                scaler.feature_names_in_ = np.asarray(manifest['feature_names'], dtype=object)
+        
+        self.model = model
+        self.categorical_encoder = encoder
+        self.scaler = scaler
+        self.feature_names = manifest['feature_names']
+        self.feature_store = FraudFeatureStore.load(os.path.join(path, 'features.npz')) if 'features.npz' in files else None
+        self.prescreen = FraudPrescreen.load(os.path.join(path, 'prescreen.npz')) if 'prescreen.npz' in files else None
+        self._fast_path = None
+        print(f"Model artifact {manifest['version']} loaded from {path}")
+
+def load_fraud_artifact(path):
+    """Load an artifact directory and precompute its fast path before it goes live"""
+    model = FraudDetectionXGBoost()
+    model.load_artifact(path)
+    model._compile_fast_path()
+    return model
+
+def load_serving_artifact(path):
+    """Load a published version for `model_holder`, keeping the feature store being served
+
+    The live store holds every transaction this process scored since it
+    started, which a published store cannot know about; a version only
+    brings its own store to a process that has none yet.
+    """
+    model = load_fraud_artifact(path)
+    live_store = model_holder.current.feature_store
+    if live_store is not None:
+        model.feature_store = live_store
+    return model
+
+from flask import Flask, Response, request, jsonify
 
 app = Flask(__name__)
-fraud_model = FraudDetectionXGBoost()
+model_holder = ModelHolder(load_serving_artifact, model=FraudDetectionXGBoost())
+model_dir = os.environ.get('FRAUD_MODEL_DIR')
+fast_path_enabled = os.environ.get('FRAUD_FAST_PATH', '1') == '1'
+prescreen_enabled = os.environ.get('FRAUD_PRESCREEN', '0') == '1'
+update_mode = os.environ.get('FRAUD_UPDATE_MODE', 'append')
+online_updates = os.environ.get('FRAUD_ONLINE_UPDATES') == '1'
+prefork = os.environ.get('FRAUD_PREFORK') == '1'
+label_messages = message_queue() if prefork else None
+profiler = SamplingProfiler() if os.environ.get('FRAUD_PROFILER') == '1' else None
+model_updater = ModelUpdater(
+    model_holder,
+    lambda model, records: model.update(pd.DataFrame(records), mode=update_mode),
+    min_batch=int(os.environ.get('FRAUD_UPDATE_MIN_BATCH', '1000')),
+    max_wait=float(os.environ.get('FRAUD_UPDATE_MAX_WAIT', '60')),
+    publish_root=model_dir
+)
+
+def score_requests(records):
+    """Score a micro-batch of single-transaction requests with one model call"""
+    fraud_model = model_holder.current
+    if prescreen_enabled or fast_path_enabled:
+        probs = fraud_model.predict_fast_batch(records, cascade=prescreen_enabled)
+    else:
+        probs = fraud_model.predict_batch(records)
+    if fraud_model.feature_store is not None:
+        fraud_model.feature_store.observe(records)
+    return probs
+
+request_batcher = MicroBatcher(
+    score_requests,
+    max_batch=int(os.environ.get('FRAUD_BATCH_MAX', '32')),
+    max_wait_us=int(os.environ.get('FRAUD_BATCH_WAIT_US', '500'))
+)
 
 @app.route('/fraud-xgboost-endpoint-local/ping', methods=['GET'])
 def ping():
     """Health check endpoint"""
-    return jsonify({'status': 'healthy'})
+    return jsonify({'status': 'healthy', 'model_version': model_holder.version})
+
+@app.route('/fraud-xgboost-endpoint-local/reload', methods=['POST'])
+def reload():
+    """Load the published model version in the background and swap it in"""
+    if not model_dir:
+        return jsonify({'error': 'FRAUD_MODEL_DIR is not configured'}), 400
+    model_holder.reload_async(model_dir)
+    return jsonify({'status': 'reloading', 'model_version': model_holder.version}), 202
+
+@app.route('/fraud-xgboost-endpoint-local/labels', methods=['POST'])
+def labels():
+    """Queue labeled transactions for an incremental model update"""
+    if not (model_updater.running or (prefork and online_updates)):
+        return jsonify({'error': 'incremental updates are disabled'}), 400
+    data = request.get_json()
+    records = data.get('instances', [])
+    if not records or any('isFraud' not in record for record in records):
+        return jsonify({'error': "every instance needs an 'isFraud' label"}), 400
+    if prefork:
+        # The updater process keeps a store of its own, so this worker's
+        # store takes the labels here
+        fraud_model = model_holder.current
+        if fraud_model.feature_store is not None:
+            fraud_model.feature_store.apply_labels(pd.DataFrame(records))
+        label_messages.put(records)
+        return jsonify({'status': 'queued'}), 202
+    model_updater.submit(records)
+    return jsonify({'status': 'queued', 'updater': model_updater.stats()}), 202
+
+@app.route('/fraud-xgboost-endpoint-local/prescreen', methods=['GET'])
+def prescreen_stats():
+    """Short-circuit rate and latency saved by the prescreen stage"""
+    fraud_model = model_holder.current
+    if fraud_model.prescreen is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(fraud_model.prescreen.stats(), enabled=prescreen_enabled))
+
+@app.route('/fraud-xgboost-endpoint-local/batcher', methods=['GET'])
+def batcher_stats():
+    """Micro-batch sizes and queueing delay"""
+    return jsonify(request_batcher.stats())
 
 @app.route('/fraud-xgboost-endpoint-local/invocations', methods=['POST'])
 def predict():
     """Prediction endpoint"""
+    metrics = stage_metrics
     try:
-        data = request.get_json()
+        if metrics is None:
+            return jsonify(invoke(request.get_json()))
         
-        if 'instances' in data:
-            predictions = []
-            for instance in data['instances']:
-                prob = fraud_model.predict(instance)
-                predictions.append({'score': float(prob)})
-            return jsonify({'predictions': predictions})
-        else:
-            prob = fraud_model.predict(data)
-            return jsonify({'score': float(prob)})
+        start = perf_counter_ns()
+        data = request.get_json()
+        t = metrics.lap('parse', start)
+        body = invoke(data)
+        t = perf_counter_ns()
+        response = jsonify(body)
+        metrics.lap('serialize', t)
+        metrics.lap('request', start)
+        return response
             
     except Exception as e:
         return jsonify({'error': str(e)}), 400
 
+def invoke(data):
+    """Scores for one invocations request: a single transaction or `instances`"""
+    fraud_model = model_holder.current
+    
+    if 'instances' in data:
+        if prescreen_enabled:
+            probs = fraud_model.predict_batch_cascade(data['instances'])
+        else:
+            probs = fraud_model.predict_batch(data['instances'])
+        if fraud_model.feature_store is not None:
+            fraud_model.feature_store.observe(data['instances'])
+        return {'predictions': [{'score': float(prob)} for prob in probs]}
+    elif request_batcher.running:
+        return {'score': float(request_batcher.submit(data))}
+    else:
+        if prescreen_enabled:
+            prob = fraud_model.predict_cascade(data)
+        elif fast_path_enabled:
+            prob = fraud_model.predict_fast(data)
+        else:
+            prob = fraud_model.predict(data)
+        if fraud_model.feature_store is not None:
+            fraud_model.feature_store.observe(data)
+        return {'score': float(prob)}
+
+@app.route('/fraud-xgboost-endpoint-local/metrics', methods=['GET'])
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Per-stage latency histograms in the Prometheus text format"""
+    if stage_metrics is None:
+        return Response('# stage metrics are disabled; set FRAUD_STAGE_METRICS=1\n', content_type=PROMETHEUS_CONTENT_TYPE)
+    return Response(stage_metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.route('/fraud-xgboost-endpoint-local/profile', methods=['POST'])
+def profile():
+    """Sample every thread's stack for `seconds` and return them collapsed for a flame graph"""
+    if profiler is None:
+        return jsonify({'error': 'profiling is disabled; set FRAUD_PROFILER=1'}), 400
+    data = request.get_json(silent=True) or {}
+    try:
+        stacks, samples = profiler.profile(float(data.get('seconds', 10)), float(data.get('interval_ms', 5)) / 1e3)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    return Response(profiler.collapsed(stacks), mimetype='text/plain', headers={'X-Profile-Samples': str(samples)})
+
+def load_models():
+    """Load the serving model; under gunicorn this runs once in the master, before workers fork"""
+    if model_dir and current_version(model_dir):
+        model_holder.reload(model_dir)
+    else:
+        model_path = os.environ.get('ml_models/fraud_detection', './fraud_model.joblib')
+        if os.path.exists(model_path):
+            model_holder.current.load_model(model_path)
+    
+    if model_holder.current.model is not None:
+        model_holder.current._compile_fast_path()
+
+def start_worker():
+    """Start the threads each serving process needs for itself"""
+    if model_dir:
+        model_holder.watch(model_dir, float(os.environ.get('FRAUD_RELOAD_INTERVAL', '30')))
+    
+    if os.environ.get('FRAUD_MICRO_BATCH') == '1':
+        request_batcher.start()
+
+def run_updater_process():
+    """The one process applying incremental updates when serving prefork
+
+    Workers forward labels here; updated models are published under
+    FRAUD_MODEL_DIR, which every worker watches. This process scores
+    nothing, so its feature store ingests every labeled row whole; workers
+    keep their own stores when they load a published version.
+    """
+    if not model_dir:
+        print("FRAUD_MODEL_DIR is not set, so workers will never see incremental updates")
+    
+    def loop(stopping):
+        model_updater.start()
+        while not stopping.is_set():
+            try:
+                records = label_messages.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            model_updater.submit(records)
+        model_updater.stop()
+    
+    run_until_terminated(loop)
+
+def start_standalone():
+    """Start the serving and update threads of a single-process server"""
+    start_worker()
+    
+    if online_updates:
+        model_updater.start()
+
 if __name__ == '__main__':
-    model_path = os.environ.get('ml_models/fraud_detection', './fraud_model.joblib')
-    if os.path.exists(model_path):
-        fraud_model.load_model(model_path)
+    load_models()
+    start_standalone()
     
     app.run(host='0.0.0.0', port=8080)
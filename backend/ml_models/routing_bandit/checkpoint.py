@@ -0,0 +1,233 @@
+import glob
+import json
+import logging
+import os
+import tempfile
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def write_atomic(path, write):
+    """Write a file through `write(tmp_path)` and move it into place in one rename"""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    os.close(fd)
+    try:
+        write(tmp_path)
+        with open(tmp_path, 'rb') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def write_json_atomic(path, data):
+    def write(tmp_path):
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+    write_atomic(path, write)
+
+
+class Checkpointer:
+    """Checkpoints and a training write-ahead log for the online bandit
+
+    Every example is appended to the current WAL segment before it is
+    learned, tagged with a sequence number. A checkpoint saves the model
+    next to a metadata file holding the VW arguments and the sequence
+    number it covers, each moved into place atomically; the metadata is
+    written last, so only complete checkpoints are ever picked up. Each
+    checkpoint starts a new WAL segment, and the newest `keep` checkpoints
+    are retained along with the segments needed to roll forward from the
+    oldest of them.
+
+    `recover` loads the newest checkpoint that opens cleanly, falling back
+    to older ones, and replays the WAL entries after it. WAL lines are
+    flushed as they are written, so a process crash loses nothing that was
+    logged; segments are fsynced when they are closed.
+
+    All methods except `stats` are called from the learner thread only.
+    """
+
+    def __init__(self, directory, interval=60.0, every=None, keep=5):
+        self.directory = directory
+        self.interval = interval
+        self.every = every
+        self.keep = keep
+        self.seq = 0
+        self.checkpoint_seq = 0
+        self.checkpoints_written = 0
+        self.last_checkpoint_at = None
+        self.last_checkpoint_seconds = None
+        self.last_error = None
+        self.recovery = None
+        self._period_start = time.monotonic()
+        self._wal = None
+        self._wal_path = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _checkpoint_paths(self):
+        """(seq, model path, metadata path) of complete checkpoints, newest first"""
+        paths = []
+        for meta_path in glob.glob(os.path.join(self.directory, 'checkpoint-*.json')):
+            seq = int(os.path.basename(meta_path)[len('checkpoint-'):-len('.json')])
+            paths.append((seq, meta_path[:-len('.json')] + '.vw', meta_path))
+        return sorted(paths, reverse=True)
+
+    def _wal_segments(self):
+        """(first seq, path) of WAL segments, oldest first"""
+        segments = []
+        for path in glob.glob(os.path.join(self.directory, 'wal-*.jsonl')):
+            segments.append((int(os.path.basename(path)[len('wal-'):-len('.jsonl')]), path))
+        return sorted(segments)
+
+    def _open_segment(self):
+        self._close_segment()
+        self._wal_path = os.path.join(self.directory, f'wal-{self.seq + 1:012d}.jsonl')
+        self._wal = open(self._wal_path, 'a', buffering=1)
+
+    def _close_segment(self):
+        if self._wal is not None:
+            self._wal.flush()
+            os.fsync(self._wal.fileno())
+            self._wal.close()
+            self._wal = None
+
+    def log(self, context, actions, chosen_action, reward, probability):
+        """Append one training example to the WAL"""
+        if self._wal is None:
+            self._open_segment()
+        self.seq += 1
+        self._wal.write(json.dumps({
+            'seq': self.seq,
+            'context': context,
+            'actions': actions,
+            'chosen_action': chosen_action,
+            'reward': reward,
+            'probability': probability,
+        }) + '\n')
+
+    def due(self):
+        unsaved = self.seq - self.checkpoint_seq
+        if unsaved == 0:
+            return False
+        if self.every is not None and unsaved >= self.every:
+            return True
+        return self.interval is not None and time.monotonic() - self._period_start >= self.interval
+
+    def checkpoint(self, bandit):
+        """Save `bandit` as covering every example logged so far"""
+        start = time.perf_counter()
+        seq = self.seq
+        base = os.path.join(self.directory, f'checkpoint-{seq:012d}')
+        with bandit._lock:
+            write_atomic(base + '.vw', bandit.vw_model.save)
+        write_json_atomic(base + '.json', {
+            'seq': seq,
+            'vw_args': bandit.vw_args,
+            'num_actions': bandit.num_actions,
+            'created_at': time.time(),
+        })
+        self._open_segment()
+        self.checkpoint_seq = seq
+        self.checkpoints_written += 1
+        self.last_checkpoint_at = self._period_start = time.monotonic()
+        self.last_checkpoint_seconds = time.perf_counter() - start
+        self._prune()
+        logger.info(f"Checkpoint {seq} written in {self.last_checkpoint_seconds:.3f}s")
+        return base + '.vw'
+
+    def _prune(self):
+        """Drop checkpoints beyond `keep` and WAL segments older than the oldest one kept"""
+        checkpoints = self._checkpoint_paths()
+        for _, model_path, meta_path in checkpoints[self.keep:]:
+            os.remove(meta_path)
+            if os.path.exists(model_path):
+                os.remove(model_path)
+        oldest_seq = checkpoints[:self.keep][-1][0]
+        segments = self._wal_segments()
+        for (_, path), (next_first, _) in zip(segments, segments[1:]):
+            if next_first <= oldest_seq + 1 and path != self._wal_path:
+                os.remove(path)
+
+    def _replay(self, bandit, after_seq):
+        replayed = failed = 0
+        for _, path in self._wal_segments():
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        # A torn final line from a crash mid-write
+                        failed += 1
+                        continue
+                    self.seq = max(self.seq, entry['seq'])
+                    if entry['seq'] <= after_seq:
+                        continue
+                    try:
+                        bandit.train_step(entry['context'], entry['actions'], entry['chosen_action'],
+                                          entry['reward'], entry['probability'])
+                        replayed += 1
+                    except Exception as e:
+                        failed += 1
+                        logger.error(f"WAL replay of example {entry['seq']} failed: {e}")
+        return replayed, failed
+
+    def recover(self, bandit):
+        """Restore `bandit` from the newest usable checkpoint plus the WAL after it"""
+        start = time.perf_counter()
+        checkpoint_seq = 0
+        loaded = None
+        for seq, model_path, meta_path in self._checkpoint_paths():
+            try:
+                with open(meta_path) as f:
+                    meta = json.load(f)
+                bandit.load_model(model_path, meta['vw_args'])
+            except Exception as e:
+                logger.error(f"Skipping unreadable checkpoint {model_path}: {e}")
+                continue
+            checkpoint_seq, loaded = seq, model_path
+            break
+
+        load_seconds = time.perf_counter() - start
+        replayed, failed = self._replay(bandit, checkpoint_seq)
+        self.seq = max(self.seq, checkpoint_seq)
+        self.checkpoint_seq = checkpoint_seq
+        self.recovery = {
+            'checkpoint': loaded,
+            'checkpoint_seq': checkpoint_seq,
+            'replayed': replayed,
+            'replay_failures': failed,
+            'load_seconds': load_seconds,
+            'recovery_seconds': time.perf_counter() - start,
+        }
+        if replayed:
+            self.checkpoint(bandit)
+        else:
+            self._open_segment()
+        logger.info(f"Recovered bandit: {json.dumps(self.recovery)}")
+        return self.recovery
+
+    def close(self):
+        self._close_segment()
+
+    def stats(self):
+        checkpoint_age = None
+        if self.last_checkpoint_at is not None:
+            checkpoint_age = time.monotonic() - self.last_checkpoint_at
+        return {
+            'directory': self.directory,
+            'seq': self.seq,
+            'checkpoint_seq': self.checkpoint_seq,
+            'examples_since_checkpoint': self.seq - self.checkpoint_seq,
+            'checkpoints_written': self.checkpoints_written,
+            'checkpoint_age_seconds': checkpoint_age,
+            'last_checkpoint_seconds': self.last_checkpoint_seconds,
+            'interval_seconds': self.interval,
+            'every': self.every,
+            'keep': self.keep,
+            'last_error': self.last_error,
+            'recovery': self.recovery,
+        }
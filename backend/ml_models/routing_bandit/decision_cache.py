@@ -0,0 +1,149 @@
+import math
+import threading
+import time
+from collections import OrderedDict
+
+
+class DecisionCache:
+    """Exploration pmfs for recently seen routing contexts
+
+    Requests whose context falls in the same quantization cell share one VW
+    prediction. Categorical context (merchant type, region, currency, hour,
+    day of week, weekend flag) is matched exactly, `amount_log` and
+    `risk_score` are bucketed into `amount_step` and `risk_step` wide bins,
+    and gateway success rate and cost are rounded to `action_decimals`; the
+    other action features are matched exactly, as VW sees them. The cache
+    holds the pmf rather than a chosen action, so every hit still samples
+    its own action and reports the probability it was drawn with.
+
+    Entries expire after `ttl` seconds and the least recently used are
+    dropped beyond `max_entries`. Every entry belongs to the model version
+    it was scored with; the first lookup against a different version (a new
+    snapshot, a reload, or an inline training step) empties the cache.
+    """
+
+    def __init__(self, max_entries=10000, ttl=60.0, amount_step=0.25, risk_step=0.05, action_decimals=2):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.amount_step = amount_step
+        self.risk_step = risk_step
+        self.action_decimals = action_decimals
+        self.model_version = None
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evicted = 0
+        self.invalidations = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def key(self, context, actions):
+        """Quantization cell of a (context, actions) decision"""
+        get = context.get
+        context_key = (
+            math.floor(get('amount_log', 0) / self.amount_step),
+            math.floor(get('risk_score', 0) / self.risk_step),
+            get('hour', 0),
+            get('day_of_week', 0),
+            get('is_weekend', 0),
+            get('merchant_type', 'unknown'),
+            get('region', 'unknown'),
+            get('currency_code', 0),
+        )
+        decimals = self.action_decimals
+        actions_key = tuple([
+            (
+                round(action.get('success_rate', 95), decimals),
+                round(action.get('cost', 2.5), decimals),
+                action.get('latency', 200),
+                action.get('supports_region', 1),
+                action.get('supports_amount', 1),
+                action.get('volume', 100),
+            )
+            for action in actions
+        ])
+        return context_key, actions_key
+
+    def _get(self, key, model_version, now):
+        with self._lock:
+            if model_version != self.model_version:
+                if self._entries:
+                    self.invalidations += 1
+                self._entries.clear()
+                self.model_version = model_version
+                return None
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            pmf, cached_at = entry
+            if now - cached_at > self.ttl:
+                del self._entries[key]
+                self.expired += 1
+                return None
+            self._entries.move_to_end(key)
+            return pmf
+
+    def _put(self, key, model_version, pmf, now):
+        with self._lock:
+            if model_version != self.model_version:
+                return
+            self._entries[key] = (pmf, now)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def predict(self, bandit, context, actions, score):
+        """Prediction for one decision, scoring it with `score(context, actions)` on a miss
+
+        `bandit` is the model the prediction is served from: its
+        `model_version` scopes the entry and its `format_prediction`
+        samples the action on a hit.
+        """
+        start = time.perf_counter()
+        key = self.key(context, actions)
+        model_version = bandit.model_version
+        pmf = self._get(key, model_version, time.monotonic())
+        if pmf is not None:
+            result = bandit.format_prediction(pmf)
+            self.hits += 1
+            self.hit_seconds += time.perf_counter() - start
+            return result
+
+        result = score(context, actions)
+        self._put(key, model_version, result['all_probabilities'], time.monotonic())
+        self.misses += 1
+        self.miss_seconds += time.perf_counter() - start
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        mean_hit = self.hit_seconds / self.hits if self.hits else None
+        mean_miss = self.miss_seconds / self.misses if self.misses else None
+        saved = None
+        if mean_hit is not None and mean_miss is not None:
+            saved = self.hits * max(0.0, mean_miss - mean_hit)
+        return {
+            'entries': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'amount_step': self.amount_step,
+            'risk_step': self.risk_step,
+            'action_decimals': self.action_decimals,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else None,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'invalidations': self.invalidations,
+            'model_version': self.model_version,
+            'mean_hit_us': mean_hit * 1e6 if mean_hit is not None else None,
+            'mean_miss_us': mean_miss * 1e6 if mean_miss is not None else None,
+            'latency_saved_seconds': saved,
+        }
@@ -0,0 +1,137 @@
+import json
+import queue
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+
+def decision_entry(context, actions, chosen_action, probability, gateway_actions=False):
+    """A served decision under a fresh random ID
+
+    `gateway_actions` marks an action set built from the server's gateway
+    table, whose outcomes can be credited back to a gateway.
+    """
+    return {
+        'decision_id': uuid.uuid4().hex,
+        'timestamp': time.time(),
+        'context': context,
+        'actions': actions,
+        'chosen_action': int(chosen_action),
+        'probability': float(probability),
+        'gateway_actions': gateway_actions,
+    }
+
+
+class DecisionLog:
+    """Served routing decisions, held until their reward arrives
+
+    Each decision keeps its context, action set, chosen action and the
+    probability it was sampled with, keyed by a random decision ID. Entries
+    are held in arrival order and dropped once they are older than `ttl`
+    seconds or when more than `max_entries` are pending, so memory stays
+    bounded however many rewards never show up. When `path` is set every
+    decision and joined reward is also appended to it as a JSON line.
+    """
+
+    def __init__(self, max_entries=100000, ttl=3600.0, path=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.decisions = 0
+        self.joined = 0
+        self.unmatched = 0
+        self.expired = 0
+        self.evicted = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', buffering=1) if path else None
+
+    def _append(self, record):
+        if self._file is not None:
+            self._file.write(json.dumps(record) + '\n')
+
+    def _expire(self, now):
+        """Drop entries past their TTL, then the oldest beyond `max_entries`"""
+        while self._entries:
+            entry = next(iter(self._entries.values()))
+            if now - entry['timestamp'] <= self.ttl:
+                break
+            self._entries.popitem(last=False)
+            self.expired += 1
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evicted += 1
+
+    def record(self, context, actions, chosen_action, probability, gateway_actions=False):
+        """Log a served decision and return its ID"""
+        return self.insert(decision_entry(context, actions, chosen_action, probability, gateway_actions))
+
+    def insert(self, entry):
+        """Log a decision built by `decision_entry`, possibly in another process"""
+        with self._lock:
+            self._entries[entry['decision_id']] = entry
+            self._expire(time.time())
+            self.decisions += 1
+            self._append(dict(entry, type='decision'))
+        return entry['decision_id']
+
+    def join(self, decision_id, reward):
+        """The logged decision for a reward, or None when it is unknown or expired
+
+        A decision joins at most once; repeated rewards are unmatched.
+        """
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._entries.pop(decision_id, None)
+            if entry is None:
+                self.unmatched += 1
+                return None
+            self.joined += 1
+            self._append({'type': 'reward', 'decision_id': decision_id, 'timestamp': now, 'reward': reward})
+        return entry
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def stats(self):
+        return {
+            'pending': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl_seconds': self.ttl,
+            'decisions': self.decisions,
+            'rewards_joined': self.joined,
+            'rewards_unmatched': self.unmatched,
+            'expired': self.expired,
+            'evicted': self.evicted,
+            'path': self.path,
+        }
+
+
+class ForwardedDecisionLog:
+    """Sends served decisions to the process holding the `DecisionLog`
+
+    Request workers in prefork serving record through this; rewards are
+    joined by the learner process, which is the only one that sees every
+    decision.
+    """
+
+    def __init__(self, messages):
+        self.messages = messages
+        self.forwarded = 0
+        self.dropped = 0
+
+    def record(self, context, actions, chosen_action, probability, gateway_actions=False):
+        entry = decision_entry(context, actions, chosen_action, probability, gateway_actions)
+        try:
+            self.messages.put_nowait(('decision', entry))
+            self.forwarded += 1
+        except queue.Full:
+            self.dropped += 1
+        return entry['decision_id']
+
+    def stats(self):
+        return {'forwarded': self.forwarded, 'dropped': self.dropped}
@@ -0,0 +1,235 @@
+import re
+import struct
+from collections import OrderedDict
+
+from vowpalwabbit import pyvw
+
+# Numbers VW's text parser reads on its fast path: [-]digits[.digits][e[-]digits]
+VW_NUMBER = re.compile(r'(-?)(\d*)(?:\.(\d*))?(?:e(-?\d+))?$')
+NAME_BREAKS = re.compile(r'[\s:|]')
+EXACT_DIGITS = 2 ** 24
+
+
+def to_float32(value):
+    return struct.unpack('f', struct.pack('f', value))[0]
+
+
+class VWExampleBuilder:
+    """Builds cb_adf examples for the routing bandit without VW text parsing
+
+    Produces the same features, in the same order and with bit-identical
+    values, as `RoutingContextualBandit.create_vw_example` followed by
+    `Workspace.parse`. Namespace and feature-name hashes are computed once,
+    and action examples are cached per gateway-stats payload and reused
+    until the stats change. Anything the text format would treat specially
+    (non-numeric values, names containing separators) makes `build` return
+    None so the caller can fall back to the text path.
+
+    Examples are tied to one workspace; build a new builder after loading a
+    model. The shared example is rewritten in place on every `build`, so a
+    returned list is only valid until the next call, and callers must
+    serialize access. Reused examples are never passed to `finish_example`,
+    so VW's progress counters do not include builder-made examples.
+    """
+
+    def __init__(self, vw, action_names, cache_size=1024, value_cache_size=65536):
+        self.vw = vw
+        self.action_names = action_names
+        self.cache_size = cache_size
+        self.value_cache_size = value_cache_size
+        self.label_type = vw.get_label_type()
+        self.prediction_type = vw.get_prediction_type()
+        self.shared_hash = vw.hash_space('s')
+        self.action_hash = vw.hash_space('a')
+        self._feature_hashes = {}
+        self._actions = OrderedDict()
+        self._values = {}
+        self._shared = None
+        self._scales = self._calibrate_scales()
+        self.hits = 0
+        self.misses = 0
+        self.fallbacks = 0
+
+    def _calibrate_scales(self, low=-40, high=38):
+        """Powers of ten exactly as VW's float parser applies them
+
+        VW scales the accumulated digits by its own float32 power of ten,
+        which is not always the correctly rounded one, so the table is read
+        back from the parser itself.
+        """
+        probe = pyvw.Workspace(quiet=True)
+        try:
+            exponents = list(range(low, high + 1))
+            ex = probe.parse(' |p ' + ' '.join(f'e{e}:1e{e}' for e in exponents))
+            # Values that underflow to zero are dropped by the parser, so
+            # match features back to exponents by hash rather than position
+            parsed = dict(ex['p'].iter_features())
+            probe_hash = probe.hash_space('p')
+            scales = {}
+            for e in exponents:
+                value = parsed.get(probe.hash_feature(f'e{e}', probe_hash))
+                if value:
+                    scales[e] = value
+            probe.finish_example(ex)
+        finally:
+            probe.finish()
+        return scales
+
+    def parse_value(self, text):
+        """Value VW's text parser produces for a feature value string, or None"""
+        try:
+            return self._values[text]
+        except KeyError:
+            pass
+        value = self._parse_value(text)
+        if len(self._values) >= self.value_cache_size:
+            self._values.clear()
+        self._values[text] = value
+        return value
+
+    def _parse_value(self, text):
+        match = VW_NUMBER.match(text)
+        if match is None:
+            return None
+        sign, integer, fraction, exponent = match.groups()
+        fraction = (fraction or '')[:35]
+        digits = integer + fraction
+        if not digits:
+            return None
+        scale = self._scales.get((int(exponent) if exponent else 0) - len(fraction))
+        if scale is None:
+            return None
+
+        mantissa = int(digits)
+        if mantissa < EXACT_DIGITS:
+            # Exact in float32, and the product is exact in a double, so
+            # VW's float conversion performs the one float32 rounding
+            value = mantissa * scale
+        else:
+            # Replay VW's float32 digit accumulation, rounding for rounding:
+            # `acc * 10 + *p - '0'` before the point, `acc * 10 + (*p - '0')` after
+            acc = 0.0
+            for ch in integer:
+                acc = to_float32(to_float32(to_float32(acc * 10) + ord(ch)) - ord('0'))
+            for ch in fraction:
+                acc = to_float32(to_float32(acc * 10) + (ord(ch) - ord('0')))
+            value = to_float32(acc * scale)
+        return -value if sign else value
+
+    def _hash(self, name, namespace_hash):
+        key = (name, namespace_hash)
+        h = self._feature_hashes.get(key)
+        if h is None:
+            if NAME_BREAKS.search(name):
+                return None
+            h = self.vw.hash_feature(name, namespace_hash)
+            self._feature_hashes[key] = h
+        return h
+
+    def _features(self, pairs, namespace_hash):
+        """Hashed (feature, value) list for (name, value text or None) pairs"""
+        features = []
+        for name, text in pairs:
+            h = self._hash(name, namespace_hash)
+            value = 1.0 if text is None else self.parse_value(text)
+            if h is None or value is None:
+                return None
+            features.append((h, value))
+        return features
+
+    def context_features(self, context):
+        region = context.get('region', 'unknown').replace(' ', '_')
+        return self._features([
+            ('amount_log', f"{context.get('amount_log', 0):.3f}"),
+            ('risk_score', f"{context.get('risk_score', 0):.3f}"),
+            ('hour', f"{context.get('hour', 0)}"),
+            ('day_of_week', f"{context.get('day_of_week', 0)}"),
+            ('is_weekend', f"{context.get('is_weekend', 0)}"),
+            (f"merchant_{context.get('merchant_type', 'unknown')}", None),
+            (f"region_{region}", None),
+            ('currency', f"{context.get('currency_code', 0)}"),
+        ], self.shared_hash)
+
+    def action_features(self, action_id, action_data):
+        pairs = [
+            ('success_rate', f"{action_data.get('success_rate', 95):.2f}"),
+            ('cost', f"{action_data.get('cost', 2.5):.2f}"),
+            ('latency', f"{action_data.get('latency', 200)}"),
+            ('supports_region', f"{action_data.get('supports_region', 1)}"),
+            ('supports_amount', f"{action_data.get('supports_amount', 1)}"),
+            ('volume', f"{action_data.get('volume', 100)}"),
+        ]
+        if action_id < len(self.action_names):
+            pairs.append((f"gateway_{self.action_names[action_id]}", None))
+        return self._features(pairs, self.action_hash)
+
+    def _example(self, namespace, namespace_hash, features, label=None):
+        ex = pyvw.Example(self.vw, labelType=self.label_type)
+        if label is not None:
+            ex.set_label_string(label)
+        ex.ensure_namespace_exists(namespace)
+        ex.push_feature_list(self.vw, ord(namespace), namespace_hash, features)
+        ex.setup_example()
+        return ex
+
+    def _shared_example(self, features):
+        """The one shared example, refilled with this request's context"""
+        ex = self._shared
+        if ex is None:
+            ex = self._shared = self._example('s', self.shared_hash, features, 'shared')
+            return ex
+        ex.unsetup_example()
+        ex.erase_namespace(ord('s'))
+        ex.ensure_namespace_exists('s')
+        ex.push_feature_list(self.vw, ord('s'), self.shared_hash, features)
+        ex.setup_example()
+        return ex
+
+    def _cached_actions(self, actions):
+        """Feature lists and unlabeled examples for an action set, built once per stats payload"""
+        key = tuple(tuple(action.items()) for action in actions)
+        entry = self._actions.get(key)
+        if entry is not None:
+            self._actions.move_to_end(key)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        features = [self.action_features(i, action) for i, action in enumerate(actions)]
+        if any(f is None for f in features):
+            entry = None
+        else:
+            entry = (features, [self._example('a', self.action_hash, f) for f in features])
+        self._actions[key] = entry
+        if len(self._actions) > self.cache_size:
+            self._actions.popitem(last=False)
+        return entry
+
+    def build(self, context, actions, chosen_action=None, reward=None, probability=1):
+        """Shared plus action examples, or None when the text path must be used"""
+        shared = self.context_features(context)
+        cached = self._cached_actions(actions)
+        if shared is None or cached is None:
+            self.fallbacks += 1
+            return None
+
+        features, action_examples = cached
+        examples = [self._shared_example(shared)] + list(action_examples)
+        if chosen_action is not None and reward is not None:
+            # Label the action the text path would label, which is the one
+            # whose position compares equal to `chosen_action`, if any
+            for i in range(len(actions)):
+                if i == chosen_action:
+                    cost = max(0.0, 1.0 - reward)
+                    examples[i + 1] = self._example(
+                        'a', self.action_hash, features[i], f"{i}:{cost:.3f}:{probability}"
+                    )
+        return examples
+
+    def stats(self):
+        return {
+            'action_cache_entries': len(self._actions),
+            'action_cache_hits': self.hits,
+            'action_cache_misses': self.misses,
+            'text_fallbacks': self.fallbacks,
+        }
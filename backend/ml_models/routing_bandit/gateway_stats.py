@@ -0,0 +1,177 @@
+import threading
+import time
+
+import numpy as np
+
+# Mirrors RoutingService.GATEWAYS; base rates stand in until outcomes arrive
+GATEWAYS = [
+    {'name': 'Stripe', 'success_rate': 97.8, 'cost': 2.9, 'latency': 150, 'regions': ['US', 'EU', 'Global']},
+    {'name': 'AmazonPay', 'success_rate': 96.2, 'cost': 2.5, 'latency': 120, 'regions': ['US', 'EU']},
+    {'name': 'Solana', 'success_rate': 99.1, 'cost': 0.1, 'latency': 800, 'regions': ['Global']},
+]
+MAX_AMOUNT = 50000
+
+
+class GatewayOutcomes:
+    """Last `window` outcomes of one gateway in fixed-size ring buffers
+
+    `record` overwrites the oldest slot and keeps running totals, so it is
+    O(1); percentiles are only computed when the action table is rebuilt.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self.successes = np.zeros(window, dtype=np.float64)
+        self.latencies = np.full(window, np.nan)
+        self.timestamps = np.zeros(window, dtype=np.float64)
+        self.count = 0
+        self.total = 0
+        self.success_sum = 0.0
+
+    def record(self, success, latency, now):
+        slot = self.total % self.window
+        if self.count == self.window:
+            self.success_sum -= self.successes[slot]
+        else:
+            self.count += 1
+        self.successes[slot] = success
+        self.latencies[slot] = np.nan if latency is None else latency
+        self.timestamps[slot] = now
+        self.success_sum += success
+        self.total += 1
+
+    def success_rate(self):
+        return self.success_sum / self.count if self.count else None
+
+    def latency_percentiles(self, percentiles=(50, 95, 99)):
+        latencies = self.latencies[:self.count]
+        latencies = latencies[~np.isnan(latencies)]
+        if len(latencies) == 0:
+            return None
+        return {f'p{p}': value for p, value in zip(percentiles, np.percentile(latencies, percentiles).tolist())}
+
+    def volume(self, since):
+        return int(np.count_nonzero(self.timestamps[:self.count] >= since))
+
+
+class GatewayStats:
+    """Per-gateway statistics the bandit server builds action features from
+
+    Outcomes reported with training examples update each gateway's rolling
+    success rate, latency and volume. Requests that omit `actions` get an
+    action set built from these: success rate in percent over the last
+    `window` outcomes, median latency, outcomes in the last
+    `volume_seconds`, and region and amount support from the gateway table
+    and the request context. A gateway keeps its base rates until it has
+    `min_samples` outcomes.
+
+    The derived features are recomputed at most every `refresh_interval`
+    seconds, and the action lists handed out are reused until then, so
+    repeated requests pass the same objects to the example builder. A
+    process that does not see outcomes itself can serve features computed
+    elsewhere through `use_features`.
+    """
+
+    def __init__(self, gateways=GATEWAYS, window=1000, min_samples=20, volume_seconds=60.0, refresh_interval=1.0):
+        self.gateways = gateways
+        self.window = window
+        self.min_samples = min_samples
+        self.volume_seconds = volume_seconds
+        self.refresh_interval = refresh_interval
+        self.outcomes = [GatewayOutcomes(window) for _ in gateways]
+        self.refreshes = 0
+        self._features = None
+        self._refreshed_at = None
+        self._published = False
+        self._action_sets = {}
+        self._lock = threading.Lock()
+
+    def valid_action(self, action):
+        """Whether `action` indexes a gateway in the table"""
+        return isinstance(action, int) and 0 <= action < len(self.outcomes)
+
+    def record(self, action, success, latency=None):
+        """Add one outcome for gateway index `action`"""
+        if not self.valid_action(action):
+            raise ValueError(f'no gateway for action {action!r}')
+        with self._lock:
+            self.outcomes[action].record(float(success), latency, time.time())
+
+    def _gateway_features(self, gateway, outcomes, now):
+        success_rate = gateway['success_rate']
+        latency = gateway['latency']
+        if outcomes.count >= self.min_samples:
+            success_rate = outcomes.success_rate() * 100
+            percentiles = outcomes.latency_percentiles((50,))
+            if percentiles is not None:
+                latency = round(percentiles['p50'])
+        return {
+            'success_rate': success_rate,
+            'cost': gateway['cost'],
+            'latency': latency,
+            'volume': outcomes.volume(now - self.volume_seconds),
+        }
+
+    def _refresh(self):
+        now = time.time()
+        if self._published or (self._features is not None and now - self._refreshed_at < self.refresh_interval):
+            return
+        with self._lock:
+            self._features = [
+                self._gateway_features(gateway, outcomes, now)
+                for gateway, outcomes in zip(self.gateways, self.outcomes)
+            ]
+            self._action_sets = {}
+            self._refreshed_at = now
+            self.refreshes += 1
+
+    def features(self):
+        """Current per-gateway features, in gateway order"""
+        self._refresh()
+        return self._features
+
+    def use_features(self, features):
+        """Serve `features` from now on instead of deriving them from local outcomes"""
+        with self._lock:
+            self._features = features
+            self._action_sets = {}
+            self._published = True
+
+    def actions(self, context):
+        """Action feature dicts for a request context, one per gateway"""
+        self._refresh()
+        region = context.get('region', 'unknown')
+        amount = 10 ** float(context.get('amount_log', 0)) - 1
+        supports_amount = 1 if amount <= MAX_AMOUNT else 0
+        key = (region, supports_amount)
+        action_set = self._action_sets.get(key)
+        if action_set is None:
+            action_set = [
+                dict(features,
+                     supports_region=1 if region in gateway['regions'] else 0,
+                     supports_amount=supports_amount)
+                for gateway, features in zip(self.gateways, self._features)
+            ]
+            self._action_sets[key] = action_set
+        return action_set
+
+    def stats(self):
+        now = time.time()
+        gateways = []
+        for gateway, outcomes in zip(self.gateways, self.outcomes):
+            success_rate = outcomes.success_rate()
+            gateways.append({
+                'name': gateway['name'],
+                'outcomes': outcomes.count,
+                'success_rate': success_rate * 100 if success_rate is not None else None,
+                'latency_percentiles': outcomes.latency_percentiles(),
+                'volume': outcomes.volume(now - self.volume_seconds),
+            })
+        return {
+            'window': self.window,
+            'min_samples': self.min_samples,
+            'volume_seconds': self.volume_seconds,
+            'refresh_interval_seconds': self.refresh_interval,
+            'refreshes': self.refreshes,
+            'gateways': gateways,
+        }
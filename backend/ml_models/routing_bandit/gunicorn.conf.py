@@ -0,0 +1,52 @@
+"""Prefork serving for the routing bandit: gunicorn -c gunicorn.conf.py
+
+ROUTING_WORKERS forked workers, each serving ROUTING_WORKER_THREADS
+requests at a time, predict from read-only snapshots of the bandit. One
+learner process owns the training workspace, the decision log, the
+checkpoints and the gateway outcomes; workers forward /train and /reward
+to it and it publishes a snapshot under VW_SNAPSHOT_DIR, with the gateway
+features derived from those outcomes, every VW_SNAPSHOT_INTERVAL seconds.
+Workers poll for new snapshots every VW_SNAPSHOT_POLL seconds.
+
+The /learner, /decisions and /gateways stats describe the worker that
+answered, not the learner process. Per-segment shards are not served
+prefork.
+"""
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(HERE), 'serving'))
+
+from prefork import prefork_settings, start_learner_process, stop_learner_process
+
+os.environ['ROUTING_PREFORK'] = '1'
+
+settings = prefork_settings('ROUTING')
+bind = settings['bind']
+workers = settings['workers']
+threads = settings['threads']
+worker_class = settings['worker_class']
+preload_app = settings['preload_app']
+timeout = settings['timeout']
+chdir = HERE
+wsgi_app = 'vowpal_wabbit_asgi:app' if settings['asgi'] else 'vowpal_wabbit_model:app'
+
+
+def on_starting(server):
+    import vowpal_wabbit_model
+    vowpal_wabbit_model.load_models()
+
+
+def when_ready(server):
+    import vowpal_wabbit_model
+    server.learner_process = start_learner_process(vowpal_wabbit_model.run_learner_process, 'routing-learner')
+
+
+def post_fork(server, worker):
+    import vowpal_wabbit_model
+    vowpal_wabbit_model.start_worker()
+
+
+def on_exit(server):
+    stop_learner_process(getattr(server, 'learner_process', None))
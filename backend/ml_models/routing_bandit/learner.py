@@ -0,0 +1,319 @@
+import glob
+import json
+import logging
+import os
+import queue
+import tempfile
+import threading
+import time
+
+from vowpalwabbit import pyvw
+
+from checkpoint import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+CURRENT_SNAPSHOT = 'CURRENT.json'
+
+
+def load_snapshot(bandit_type, num_actions, prehashed_examples, vw_args, path):
+    """A read-only bandit of the same kind as the learner's, loaded from a saved model"""
+    # The snapshot must match a bandit instance of the same kind so it
+    # predicts exactly as the learner would at this point
+    snapshot = bandit_type(num_actions, prehashed_examples)
+    snapshot.vw_model = pyvw.vw(f"{vw_args} -i {path} --quiet")
+    snapshot.vw_args = vw_args
+    snapshot._attach_example_builder()
+    return snapshot
+
+
+class BanditLearner:
+    """Single writer for the routing bandit, serving reads from snapshots
+
+    Training examples are queued by `submit` and applied in order by one
+    background thread, which is the only code that touches the learning
+    workspace. Predictions run against a read-only copy of the model that
+    the learner republishes once `snapshot_interval` seconds have passed, or
+    `snapshot_every` examples have been applied, since the last one. A
+    snapshot is swapped in with a single reference assignment, so reads
+    never wait on training; they only serialize against other reads of the
+    same snapshot.
+
+    With a `checkpointer`, every example is written to its WAL before it is
+    learned, and checkpoints are saved from this thread when due, so they
+    hold up training but never predictions.
+
+    With a `publish_dir`, each snapshot is also written there for
+    `SnapshotFollower`s in other processes, together with whatever
+    `publish_metadata()` returns.
+    """
+
+    def __init__(self, bandit, snapshot_interval=5.0, snapshot_every=None, max_queue=10000, checkpointer=None,
+                 publish_dir=None, publish_metadata=None):
+        self.bandit = bandit
+        self.checkpointer = checkpointer
+        self.publish_dir = publish_dir
+        self.publish_metadata = publish_metadata
+        if publish_dir is not None:
+            os.makedirs(publish_dir, exist_ok=True)
+        self.snapshot_interval = snapshot_interval
+        self.snapshot_every = snapshot_every
+        self.snapshot = None
+        self.snapshot_version = 0
+        self.snapshot_published_at = None
+        self.examples_applied = 0
+        self.examples_dropped = 0
+        self.last_update_lag = None
+        self.last_error = None
+        self._examples_in_snapshot = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def submit(self, context, actions, chosen_action, reward, probability=1):
+        """Queue one training example; False when the queue is full"""
+        try:
+            self._queue.put_nowait((time.monotonic(), context, actions, chosen_action, reward, probability))
+        except queue.Full:
+            self.examples_dropped += 1
+            return False
+        return True
+
+    def start(self):
+        if self.bandit.vw_model is None:
+            self.bandit.initialize_model()
+        self.publish()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        if self.checkpointer is not None and not self.running:
+            if self.checkpointer.seq > self.checkpointer.checkpoint_seq:
+                self.checkpointer.checkpoint(self.bandit)
+            self.checkpointer.close()
+
+    def _snapshot_due(self):
+        unpublished = self.examples_applied - self._examples_in_snapshot
+        if unpublished == 0:
+            return False
+        if self.snapshot_every is not None and unpublished >= self.snapshot_every:
+            return True
+        return time.monotonic() - self.snapshot_published_at >= self.snapshot_interval
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                item = self._queue.get(timeout=min(self.snapshot_interval, 1.0))
+            except queue.Empty:
+                item = None
+            if item is not None:
+                self.apply(*item)
+            if self._snapshot_due():
+                try:
+                    self.publish()
+                except Exception as e:
+                    self.last_error = str(e)
+                    logger.error(f"Snapshot publish failed: {e}")
+            if self.checkpointer is not None and self.checkpointer.due():
+                try:
+                    self.checkpointer.checkpoint(self.bandit)
+                except Exception as e:
+                    self.checkpointer.last_error = str(e)
+                    logger.error(f"Checkpoint failed: {e}")
+
+    def apply(self, enqueued_at, context, actions, chosen_action, reward, probability=1):
+        """Train the learning workspace on one queued example"""
+        try:
+            if self.checkpointer is not None:
+                self.checkpointer.log(context, actions, chosen_action, reward, probability)
+            self.bandit.train_step(context, actions, chosen_action, reward, probability)
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Training error: {e}")
+            return False
+        self.examples_applied += 1
+        self.last_update_lag = time.monotonic() - enqueued_at
+        return True
+
+    def publish(self):
+        """Copy the learning workspace into a fresh read-only snapshot"""
+        applied = self.examples_applied
+        fd, path = tempfile.mkstemp(suffix='.vw', dir=self.publish_dir)
+        os.close(fd)
+        try:
+            with self.bandit._lock:
+                self.bandit.vw_model.save(path)
+            snapshot = load_snapshot(type(self.bandit), self.bandit.num_actions,
+                                     self.bandit.prehashed_examples, self.bandit.vw_args, path)
+        except BaseException:
+            os.remove(path)
+            raise
+
+        self.snapshot = snapshot
+        self.snapshot_version += 1
+        self.snapshot_published_at = time.monotonic()
+        self._examples_in_snapshot = applied
+        if self.publish_dir is None:
+            os.remove(path)
+        else:
+            self._export(path)
+        logger.debug(f"Published bandit snapshot {self.snapshot_version} after {applied} examples")
+        return snapshot
+
+    def _export(self, path, keep=3):
+        """Move a saved snapshot into `publish_dir` and point CURRENT.json at it"""
+        name = f'snapshot-{os.getpid()}-{self.snapshot_version:08d}.vw'
+        os.replace(path, os.path.join(self.publish_dir, name))
+        metadata = self.publish_metadata() if self.publish_metadata is not None else {}
+        write_json_atomic(os.path.join(self.publish_dir, CURRENT_SNAPSHOT), dict(
+            metadata, model=name, version=self.snapshot_version, vw_args=self.bandit.vw_args,
+            published_at=time.time(),
+        ))
+        # Followers may still be loading the previous few
+        published = sorted(glob.glob(os.path.join(self.publish_dir, 'snapshot-*.vw')), key=os.path.getmtime)
+        for old in published[:-keep]:
+            os.remove(old)
+
+    def predict(self, context, actions):
+        """Predict from the current snapshot"""
+        return self.snapshot.predict(context, actions)
+
+    def predict_batch(self, decisions):
+        """Predict many (context, actions) decisions from the current snapshot"""
+        return self.snapshot.predict_batch(decisions)
+
+    def stats(self):
+        snapshot_age = None
+        if self.snapshot_published_at is not None:
+            snapshot_age = time.monotonic() - self.snapshot_published_at
+        return {
+            'running': self.running,
+            'queue_depth': self.pending,
+            'examples_applied': self.examples_applied,
+            'examples_dropped': self.examples_dropped,
+            'examples_since_snapshot': self.examples_applied - self._examples_in_snapshot,
+            'last_update_lag_seconds': self.last_update_lag,
+            'snapshot_version': self.snapshot_version,
+            'snapshot_age_seconds': snapshot_age,
+            'snapshot_interval_seconds': self.snapshot_interval,
+            'snapshot_every': self.snapshot_every,
+            'last_error': self.last_error,
+        }
+
+
+class SnapshotFollower:
+    """Serves the snapshots a `BanditLearner` in another process publishes
+
+    Stands in for the learner inside a prefork request worker. A thread
+    polls `publish_dir` every `interval` seconds and swaps in each newly
+    published snapshot, passing its metadata to `on_update`. Until the
+    first one arrives, predictions come from `initial`, the model loaded
+    before the fork. `submit` forwards training examples to the learner
+    process over `messages`.
+    """
+
+    def __init__(self, publish_dir, messages, initial, interval=1.0, on_update=None):
+        self.publish_dir = publish_dir
+        self.messages = messages
+        self.interval = interval
+        self.on_update = on_update
+        self.snapshot = initial
+        self.snapshot_version = None
+        self.snapshot_published_at = None
+        self.snapshots_loaded = 0
+        self.examples_forwarded = 0
+        self.examples_dropped = 0
+        self.last_error = None
+        self._model_name = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def submit(self, context, actions, chosen_action, reward, probability=1):
+        """Forward one training example; False when the learner's queue is full"""
+        try:
+            self.messages.put_nowait(('train', context, actions, chosen_action, reward, probability))
+        except queue.Full:
+            self.examples_dropped += 1
+            return False
+        self.examples_forwarded += 1
+        return True
+
+    def poll(self):
+        """Load the published snapshot if it is not the one being served"""
+        try:
+            with open(os.path.join(self.publish_dir, CURRENT_SNAPSHOT)) as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            return False
+        if meta['model'] == self._model_name:
+            return False
+        initial = self.snapshot
+        self.snapshot = load_snapshot(type(initial), initial.num_actions, initial.prehashed_examples,
+                                      meta['vw_args'], os.path.join(self.publish_dir, meta['model']))
+        self._model_name = meta['model']
+        self.snapshot_version = meta['version']
+        self.snapshot_published_at = meta['published_at']
+        self.snapshots_loaded += 1
+        if self.on_update is not None:
+            self.on_update(meta)
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                self.poll()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Snapshot load failed: {e}")
+            if self._stop.wait(self.interval):
+                return
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def predict(self, context, actions):
+        return self.snapshot.predict(context, actions)
+
+    def predict_batch(self, decisions):
+        return self.snapshot.predict_batch(decisions)
+
+    def stats(self):
+        snapshot_age = None
+        if self.snapshot_published_at is not None:
+            snapshot_age = time.time() - self.snapshot_published_at
+        return {
+            'running': self.running,
+            'pid': os.getpid(),
+            'snapshot_version': self.snapshot_version,
+            'snapshot_age_seconds': snapshot_age,
+            'snapshots_loaded': self.snapshots_loaded,
+            'poll_interval_seconds': self.interval,
+            'examples_forwarded': self.examples_forwarded,
+            'examples_dropped': self.examples_dropped,
+            'last_error': self.last_error,
+        }
@@ -0,0 +1,368 @@
+import argparse
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from quick_train_vw import ACTION_FIELDS, CHUNK_ROWS, CSV_COLUMNS, NUM_ACTIONS, chunk_vw_examples, numeric
+from vowpal_wabbit_model import RoutingContextualBandit
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+LOGGED_COLUMNS = CSV_COLUMNS + ['probability']
+CONTEXT_NUMERIC = ['amount_log', 'risk_score', 'hour', 'day_of_week', 'is_weekend', 'currency_code']
+CATEGORY_BUCKETS = 8
+RIDGE = 1.0
+Z_95 = 1.959964
+
+# Defaults the serving path applies to missing request fields
+CONTEXT_DEFAULTS = {
+    'amount_log': 0, 'risk_score': 0, 'hour': 0, 'day_of_week': 0, 'is_weekend': 0,
+    'merchant_type': 'unknown', 'region': 'unknown', 'currency_code': 0,
+}
+ACTION_DEFAULTS = {
+    'success_rate': 95, 'cost': 2.5, 'latency': 200,
+    'supports_region': 1, 'supports_amount': 1, 'volume': 100,
+}
+
+
+def iter_logged_chunks(path, chunk_rows=CHUNK_ROWS):
+    """Logged decisions with rewards as flat frames of `LOGGED_COLUMNS`
+
+    Reads either a decision log written by `DecisionLog` (.jsonl), joining
+    each decision to its reward and skipping unrewarded ones, or a CSV in
+    the training layout with a `probability` column.
+    """
+    if path.endswith('.jsonl'):
+        yield from iter_decision_log_chunks(path, chunk_rows)
+        return
+    for chunk in pd.read_csv(path, usecols=LOGGED_COLUMNS, chunksize=chunk_rows):
+        yield chunk.reset_index(drop=True)
+
+
+def iter_decision_log_chunks(path, chunk_rows=CHUNK_ROWS):
+    """Decisions joined to their rewards, in reward order
+
+    Each line is parsed once. `DecisionLog` writes a reward after its
+    decision, so decisions are held until their reward shows up; those
+    still waiting at the end of the file are dropped.
+    """
+    pending = {}
+    rows = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            kind = record.get('type')
+            if kind == 'decision':
+                pending[record['decision_id']] = record
+                continue
+            if kind != 'reward':
+                continue
+            decision = pending.pop(record['decision_id'], None)
+            if decision is None:
+                continue
+            context = decision['context']
+            row = {name: context.get(name, default) for name, default in CONTEXT_DEFAULTS.items()}
+            for i in range(NUM_ACTIONS):
+                action = decision['actions'][i] if i < len(decision['actions']) else {}
+                for field in ACTION_FIELDS:
+                    row[f'action{i}_{field}'] = action.get(field, ACTION_DEFAULTS[field])
+            row.update(chosen_action=decision['chosen_action'], reward=record['reward'],
+                       probability=decision['probability'])
+            rows.append(row)
+            if len(rows) == chunk_rows:
+                yield pd.DataFrame(rows, columns=LOGGED_COLUMNS)
+                rows = []
+    if rows:
+        yield pd.DataFrame(rows, columns=LOGGED_COLUMNS)
+
+
+def category_codes(column):
+    """Stable hashed bucket for every category value"""
+    values = column.astype(str).to_numpy(dtype=object)
+    return (pd.util.hash_array(values) % CATEGORY_BUCKETS).astype(np.int64)
+
+
+def reward_design(df):
+    """Per-action design matrices (n, k, d) for the reward regression"""
+    n = len(df)
+    context = np.column_stack([np.ones(n)] + [numeric(df[name]) for name in CONTEXT_NUMERIC])
+    merchant = np.eye(CATEGORY_BUCKETS)[category_codes(df['merchant_type'])]
+    region = np.eye(CATEGORY_BUCKETS)[category_codes(df['region'])]
+    shared = np.hstack([context, merchant, region])
+    return np.stack([
+        np.hstack([shared, np.column_stack([numeric(df[f'action{i}_{field}']) for field in ACTION_FIELDS])])
+        for i in range(NUM_ACTIONS)
+    ], axis=1)
+
+
+class RewardModel:
+    """Per-action ridge regression of reward, cross-fitted over two folds
+
+    Rows are split by position into alternating folds; each row's
+    prediction comes from the model fitted on the other fold, so the
+    doubly-robust correction is not fitted to the rewards it corrects.
+    """
+
+    def __init__(self, ridge=RIDGE):
+        self.ridge = ridge
+        self.xtx = None
+        self.xty = None
+        self.coef = None
+        self.rows = 0
+
+    def partial_fit(self, df, offset):
+        X = reward_design(df)
+        d = X.shape[2]
+        if self.xtx is None:
+            self.xtx = np.zeros((2, NUM_ACTIONS, d, d))
+            self.xty = np.zeros((2, NUM_ACTIONS, d))
+        fold = (offset + np.arange(len(df))) % 2
+        chosen = df['chosen_action'].to_numpy(dtype=np.int64)
+        reward = numeric(df['reward'])
+        for f in range(2):
+            for a in range(NUM_ACTIONS):
+                rows = (fold == f) & (chosen == a)
+                Xa = X[rows, a]
+                self.xtx[f, a] += Xa.T @ Xa
+                self.xty[f, a] += Xa.T @ reward[rows]
+        self.rows += len(df)
+        return self
+
+    def finalize(self):
+        d = self.xtx.shape[-1]
+        self.coef = np.linalg.solve(self.xtx + self.ridge * np.eye(d), self.xty[..., None])[..., 0]
+        return self
+
+    def predict(self, df, offset):
+        """Expected reward of every action for every row, (n, k)"""
+        X = reward_design(df)
+        other_fold = 1 - (offset + np.arange(len(df))) % 2
+        predictions = np.einsum('nkd,fkd->nfk', X, self.coef)
+        return np.clip(predictions[np.arange(len(df)), other_fold], 0.0, 1.0)
+
+
+class PolicyValue:
+    """Streaming IPS, SNIPS and doubly-robust estimates of one target policy
+
+    Only sums are kept, so memory does not grow with the number of rows.
+    Intervals are normal approximations; SNIPS uses the delta method.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.sums = dict.fromkeys(['ips', 'ips2', 'dr', 'dr2', 'dm', 'w', 'w2', 'w2r'], 0.0)
+
+    def update(self, target_probability, logged_probability, reward, direct, predicted_reward):
+        """Add a chunk of rows; all arguments are aligned 1-d arrays
+
+        `direct` is the target policy's expected reward under the reward
+        model and `predicted_reward` the model's estimate for the logged action.
+        """
+        w = target_probability / logged_probability
+        ips = w * reward
+        dr = direct + w * (reward - predicted_reward)
+        s = self.sums
+        s['ips'] += ips.sum()
+        s['ips2'] += (ips * ips).sum()
+        s['dr'] += dr.sum()
+        s['dr2'] += (dr * dr).sum()
+        s['dm'] += direct.sum()
+        s['w'] += w.sum()
+        s['w2'] += (w * w).sum()
+        s['w2r'] += (w * ips).sum()
+        self.n += len(w)
+
+    def _mean_interval(self, total, total_sq):
+        mean = total / self.n
+        variance = max(total_sq / self.n - mean * mean, 0.0)
+        half_width = Z_95 * np.sqrt(variance / self.n)
+        return {'estimate': mean, 'ci_low': mean - half_width, 'ci_high': mean + half_width}
+
+    def result(self):
+        s = self.sums
+        snips = s['ips'] / s['w'] if s['w'] else float('nan')
+        snips_sq = s['ips2'] - 2 * snips * s['w2r'] + snips * snips * s['w2']
+        snips_half = Z_95 * np.sqrt(max(snips_sq, 0.0)) / s['w'] if s['w'] else float('nan')
+        return {
+            'rows': self.n,
+            'ips': self._mean_interval(s['ips'], s['ips2']),
+            'snips': {'estimate': snips, 'ci_low': snips - snips_half, 'ci_high': snips + snips_half},
+            'dr': self._mean_interval(s['dr'], s['dr2']),
+            'direct_method': s['dm'] / self.n,
+            'effective_sample_size': s['w'] ** 2 / s['w2'] if s['w2'] else 0.0,
+            'mean_importance_weight': s['w'] / self.n,
+        }
+
+
+class BanditCandidate:
+    """A VW configuration scored on logged decisions
+
+    With `learn` the candidate replays the log progressively: each row is
+    scored before the candidate learns from it, with the logged propensity.
+    Otherwise a loaded `model_path` is scored frozen.
+    """
+
+    needs_examples = True
+
+    def __init__(self, name, learning_rate=0.1, epsilon=0.1, cb_type='mtr', model_path=None, learn=True):
+        self.name = name
+        self.learn = learn
+        self.bandit = RoutingContextualBandit(prehashed_examples=False)
+        if model_path:
+            self.bandit.load_model(model_path)
+        else:
+            self.bandit.initialize_model(learning_rate=learning_rate, epsilon=epsilon, cb_type=cb_type,
+                                         driver_args='--quiet')
+        self.seconds = 0.0
+
+    def pmfs(self, df, examples):
+        start = time.perf_counter()
+        vw = self.bandit.vw_model
+        prediction_type = self.bandit.prediction_type
+        probs = np.empty((len(examples), NUM_ACTIONS))
+        for i, text in enumerate(examples):
+            parsed = vw.parse(text)
+            probs[i] = vw.predict(parsed, prediction_type)
+            if self.learn:
+                vw.learn(parsed)
+            vw.finish_example(parsed)
+        self.seconds += time.perf_counter() - start
+        return probs
+
+
+class FixedPolicy:
+    """A policy given as a vectorized function from a chunk to its (n, k) pmfs"""
+
+    needs_examples = False
+
+    def __init__(self, name, pmf_fn):
+        self.name = name
+        self.pmf_fn = pmf_fn
+        self.seconds = 0.0
+
+    def pmfs(self, df, examples):
+        start = time.perf_counter()
+        probs = self.pmf_fn(df)
+        self.seconds += time.perf_counter() - start
+        return probs
+
+
+def uniform_policy(df):
+    return np.full((len(df), NUM_ACTIONS), 1.0 / NUM_ACTIONS)
+
+
+def evaluate(path, candidates, chunk_rows=CHUNK_ROWS, ridge=RIDGE):
+    """IPS, SNIPS and DR estimates for every candidate over a decision log
+
+    Two passes: the first fits the reward model, the second scores the
+    candidates chunk by chunk and accumulates the estimators.
+    """
+    reward_model = RewardModel(ridge)
+    offset = 0
+    for df in iter_logged_chunks(path, chunk_rows):
+        reward_model.partial_fit(df, offset)
+        offset += len(df)
+    reward_model.finalize()
+
+    values = {candidate.name: PolicyValue() for candidate in candidates}
+    logged = PolicyValue()
+    offset = 0
+    for df in iter_logged_chunks(path, chunk_rows):
+        rows = np.arange(len(df))
+        chosen = df['chosen_action'].to_numpy(dtype=np.int64)
+        reward = numeric(df['reward'])
+        propensity = numeric(df['probability'], 1.0)
+        predicted = reward_model.predict(df, offset)
+        predicted_chosen = predicted[rows, chosen]
+        examples = chunk_vw_examples(df) if any(c.needs_examples for c in candidates) else None
+
+        logged.update(np.ones(len(df)), np.ones(len(df)), reward, predicted_chosen, predicted_chosen)
+        for candidate in candidates:
+            probs = candidate.pmfs(df, examples)
+            values[candidate.name].update(
+                probs[rows, chosen], propensity, reward, (probs * predicted).sum(axis=1), predicted_chosen
+            )
+        offset += len(df)
+        logger.info(f"→ {offset} logged rows evaluated")
+
+    results = {'logged_policy_mean_reward': logged.result()['ips']['estimate'], 'candidates': {}}
+    for candidate in candidates:
+        result = values[candidate.name].result()
+        result['rows_per_second'] = offset / candidate.seconds if candidate.seconds else None
+        results['candidates'][candidate.name] = result
+    return results
+
+
+def logged_decisions(df):
+    """Per-row (context, actions, chosen_action, reward, probability) as the server sees them"""
+    context = df[list(CONTEXT_DEFAULTS)].to_dict('records')
+    actions = [
+        df[[f'action{i}_{field}' for field in ACTION_FIELDS]].set_axis(ACTION_FIELDS, axis=1).to_dict('records')
+        for i in range(NUM_ACTIONS)
+    ]
+    return zip(
+        context, zip(*actions), df['chosen_action'].astype(int).tolist(),
+        numeric(df['reward']).tolist(), numeric(df['probability'], 1.0).tolist()
+    )
+
+
+def replay(path, bandit, chunk_rows=CHUNK_ROWS):
+    """Feed a decision log through `train_step` and measure learning throughput"""
+    rows = 0
+    seconds = 0.0
+    for df in iter_logged_chunks(path, chunk_rows):
+        decisions = list(logged_decisions(df))
+        start = time.perf_counter()
+        for context, actions, chosen_action, reward, probability in decisions:
+            bandit.train_step(context, list(actions), chosen_action, reward, probability)
+        seconds += time.perf_counter() - start
+        rows += len(decisions)
+    return {'rows': rows, 'seconds': seconds, 'rows_per_second': rows / seconds if seconds else None}
+
+
+def parse_candidate(spec):
+    """`name:key=value,...` with keys learning_rate, epsilon, cb_type, model"""
+    name, _, options = spec.partition(':')
+    kwargs = {}
+    for option in filter(None, options.split(',')):
+        key, value = option.split('=', 1)
+        if key == 'model':
+            kwargs['model_path'] = value
+        elif key == 'cb_type':
+            kwargs['cb_type'] = value
+        else:
+            kwargs[key] = float(value)
+    return name, kwargs
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Off-policy evaluation of routing bandit configurations')
+    parser.add_argument('log', help='decision log (.jsonl) or CSV with a probability column')
+    parser.add_argument('--candidate', action='append', default=[],
+                        help='name:learning_rate=0.1,epsilon=0.05,cb_type=dr or name:model=path.vw')
+    parser.add_argument('--frozen', action='store_true', help='score candidates without learning from the log')
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--replay', action='store_true', help='also time train_step over the log')
+    args = parser.parse_args()
+
+    candidates = [FixedPolicy('uniform', uniform_policy)]
+    for spec in args.candidate:
+        name, kwargs = parse_candidate(spec)
+        candidates.append(BanditCandidate(name, learn=not args.frozen, **kwargs))
+
+    results = evaluate(args.log, candidates, args.chunk_rows)
+    if args.replay:
+        bandit = RoutingContextualBandit()
+        bandit.initialize_model()
+        results['replay'] = replay(args.log, bandit, args.chunk_rows)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,71 +1,179 @@
+import argparse
+import json
+import os
+import sys
 import pandas as pd
 import numpy as np
 import logging
 from vowpal_wabbit_model import RoutingContextualBandit
 
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'serving'))
+from run_stats import RunStats
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def safe_float(x, default=0.0):
-    try:
-        v = float(x)
-        return v if np.isfinite(v) else default
-    except:
-        return default
-
-def main():
-    csv_path = "routing_synthetic.csv"
-    logger.info(f"Loading dataset from {csv_path}…")
-    df = pd.read_csv(csv_path)
-    logger.info(f"→ {len(df)} rows loaded")
-
-    ctx_feats = ['amount_log', 'risk_score', 'hour', 'day_of_week']
-    df['is_weekend'] = df['is_weekend'].astype(int)
-    logger.info("Context features normalized")
-
-    training_data = []
-    for idx, row in df.iterrows():
-        
-        context = {
-            'amount_log':   safe_float(row['amount_log']),
-            'risk_score':   safe_float(row['risk_score']),
-            'hour':         safe_float(row['hour']),
-            'day_of_week':  safe_float(row['day_of_week']),
-            'is_weekend':   int(row['is_weekend']),
-            'merchant_type': str(row['merchant_type']),
-            'region':       str(row['region']),
-            'currency_code': safe_float(row['currency_code'])
-        }
-
-        actions = []
-        for i in range(3):
-            actions.append({
-                'success_rate':    safe_float(row[f'action{i}_success_rate'], 0.0),
-                'cost':            safe_float(row[f'action{i}_cost'],          0.0),
-                'latency':         safe_float(row[f'action{i}_latency'],       0.0),
-                'supports_region': int(row[f'action{i}_supports_region']),
-                'supports_amount': int(row[f'action{i}_supports_amount']),
-                'volume':          safe_float(row[f'action{i}_volume'],        0.0)
-            })
-
-        chosen = int(row['chosen_action'])
-        reward = safe_float(row['reward'], 0.0)
-
-        training_data.append({
-            'context': context,
-            'actions': actions,
-            'chosen_action': chosen,
-            'reward': reward
-        })
+CSV_IN = 'routing_synthetic.csv'
+MODEL_OUT = 'routing_model.vw'
+CHUNK_ROWS = 20_000
+NUM_ACTIONS = 3
+ACTION_NAMES = ['Stripe', 'AmazonPay', 'Solana']
 
-    bandit = RoutingContextualBandit()
+ACTION_FIELDS = ['success_rate', 'cost', 'latency', 'supports_region', 'supports_amount', 'volume']
+CSV_COLUMNS = (
+    ['amount_log', 'risk_score', 'hour', 'day_of_week', 'is_weekend',
+     'merchant_type', 'region', 'currency_code', 'chosen_action', 'reward']
+    + [f'action{i}_{field}' for i in range(NUM_ACTIONS) for field in ACTION_FIELDS]
+)
+
+def numeric(column, default=0.0):
+    """Column as floats, with unparseable or non-finite values replaced by `default`"""
+    values = pd.to_numeric(column, errors='coerce').to_numpy(dtype=np.float64)
+    return np.where(np.isfinite(values), values, default)
+
+def as_text(values):
+    """`str()` of every value"""
+    return values.astype(str).tolist()
+
+def fixed(values, decimals):
+    """`f"{value:.<decimals>f}"` of every value"""
+    return np.char.mod(f'%.{decimals}f', values).tolist()
+
+SHARED_TEMPLATE = (
+    'shared |s amount_log:%s risk_score:%s hour:%s day_of_week:%s is_weekend:%s'
+    ' merchant_%s region_%s currency:%s'
+)
+ACTION_TEMPLATE = (
+    '\n%s|a success_rate:%s cost:%s latency:%s supports_region:%s'
+    ' supports_amount:%s volume:%s gateway_{name}'
+)
+EXAMPLE_TEMPLATE = SHARED_TEMPLATE + ''.join(ACTION_TEMPLATE.format(name=name) for name in ACTION_NAMES)
+
+def chunk_vw_examples(df):
+    """Multi-line cb_adf examples for a chunk of CSV rows
+
+    Every field is converted to text column-wise; each example is then a
+    single template fill, and matches the text
+    `RoutingContextualBandit.create_vw_example` produces for the same row.
+    An optional `probability` column supplies the logged propensity of the
+    chosen action; without one it is 1.
+    """
+    columns = [
+        fixed(numeric(df['amount_log']), 3),
+        fixed(numeric(df['risk_score']), 3),
+        as_text(numeric(df['hour'])),
+        as_text(numeric(df['day_of_week'])),
+        as_text(df['is_weekend'].astype(int).to_numpy()),
+        df['merchant_type'].astype(str).tolist(),
+        df['region'].astype(str).str.replace(' ', '_').tolist(),
+        as_text(numeric(df['currency_code'])),
+    ]
+
+    chosen = df['chosen_action'].astype(int).to_numpy()
+    cost = np.char.mod('%.3f', np.maximum(0.0, 1.0 - numeric(df['reward'])))
+    if 'probability' in df.columns:
+        probability = numeric(df['probability'], 1.0).astype(str)
+    else:
+        probability = np.full(len(df), '1')
+    cost_and_probability = np.char.add(np.char.add(np.char.add(cost, ':'), probability), ' ')
+    for i in range(NUM_ACTIONS):
+        columns += [
+            np.where(chosen == i, np.char.add(f'{i}:', cost_and_probability), '').tolist(),
+            fixed(numeric(df[f'action{i}_success_rate']), 2),
+            fixed(numeric(df[f'action{i}_cost']), 2),
+            as_text(numeric(df[f'action{i}_latency'])),
+            as_text(df[f'action{i}_supports_region'].astype(int).to_numpy()),
+            as_text(df[f'action{i}_supports_amount'].astype(int).to_numpy()),
+            as_text(numeric(df[f'action{i}_volume'])),
+        ]
+    return [EXAMPLE_TEMPLATE % row for row in zip(*columns)]
+
+def iter_csv_examples(csv_path=CSV_IN, chunk_rows=CHUNK_ROWS):
+    """Yield (rows, examples) per chunk without holding the dataset in memory"""
+    for chunk in pd.read_csv(csv_path, usecols=CSV_COLUMNS, chunksize=chunk_rows):
+        yield len(chunk), chunk_vw_examples(chunk)
+
+def write_vw_data(data_path, csv_path=CSV_IN, chunk_rows=CHUNK_ROWS):
+    """Convert the CSV to a VW text data file, one blank line between examples"""
+    rows = 0
+    with open(data_path, 'w') as f:
+        for n, examples in iter_csv_examples(csv_path, chunk_rows):
+            f.write('\n\n'.join(examples))
+            f.write('\n\n')
+            rows += n
+    return rows
+
+def cache_is_fresh(cache_path, source_path):
+    """True when the VW cache exists and is newer than its CSV source"""
+    return (
+        os.path.exists(cache_path)
+        and os.path.getmtime(cache_path) >= os.path.getmtime(source_path)
+    )
+
+def train_streaming(bandit, csv_path=CSV_IN, chunk_rows=CHUNK_ROWS):
+    """Feed examples straight into the workspace as chunks are converted"""
     bandit.initialize_model(learning_rate=0.1, epsilon=0.1)
-    logger.info(f"Starting batch training on {len(training_data)} examples…")
-    bandit.batch_train(training_data)
+    rows = 0
+    for n, examples in iter_csv_examples(csv_path, chunk_rows):
+        for example in examples:
+            bandit.vw_model.learn(example)
+        rows += n
+        logger.info(f"→ {rows} rows trained")
+    return rows
+
+def train_from_cache(bandit, cache_path, csv_path=CSV_IN, chunk_rows=CHUNK_ROWS, passes=1, data_path=None):
+    """Train through VW's own reader, building the cache from the CSV when it is stale
+
+    A fresh cache is read directly; otherwise the CSV is converted to a VW
+    text file first and VW writes the cache on the first pass.
+    """
+    driver_args = f"--cache_file {cache_path} --passes {passes} --holdout_off --quiet"
+    converted = None
+    if cache_is_fresh(cache_path, csv_path):
+        logger.info(f"Training from cache {cache_path}")
+    else:
+        if os.path.exists(cache_path):
+            os.remove(cache_path)
+        converted = data_path or cache_path + '.txt'
+        logger.info(f"Writing VW data to {converted}")
+        write_vw_data(converted, csv_path, chunk_rows)
+        driver_args = f"-d {converted} {driver_args}"
+
+    bandit.initialize_model(learning_rate=0.1, epsilon=0.1, driver_args=driver_args)
+    bandit.vw_model.run_parser()
+    if converted is not None and data_path is None:
+        os.remove(converted)
+    return int(bandit.vw_model.get_weighted_examples() / passes)
+
+def main(csv_path=CSV_IN, model_path=MODEL_OUT, chunk_rows=CHUNK_ROWS, cache_file=None, passes=1):
+    bandit = RoutingContextualBandit()
+    logger.info(f"Streaming {csv_path} in chunks of {chunk_rows} rows…")
+    with RunStats() as stats:
+        if cache_file:
+            rows = train_from_cache(bandit, cache_file, csv_path, chunk_rows, passes)
+        else:
+            rows = train_streaming(bandit, csv_path, chunk_rows)
+
+    passes = passes if cache_file else 1
+    report = dict(stats.as_dict(), rows=rows, passes=passes,
+                  rows_per_second=round(rows / stats.wall_seconds),
+                  examples_per_second=round(rows * passes / stats.wall_seconds))
+    logger.info(f"Training run: {json.dumps(report)}")
 
-    model_path = "routing_model.vw"
     bandit.save_model(model_path)
     logger.info(f"Model written to {model_path}")
+    return report
 
 if __name__ == "__main__":
-    main()
+    parser = argparse.ArgumentParser(description='Train the routing bandit from the synthetic CSV')
+    parser.add_argument('--csv', default=CSV_IN)
+    parser.add_argument('--model', default=MODEL_OUT)
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    parser.add_argument('--cache_file', '--cache-file', dest='cache_file', default=None,
+                        help='train through a VW cache file, rebuilt when older than the CSV')
+    parser.add_argument('--passes', type=int, default=1,
+                        help='passes over the cache; requires --cache_file when above 1')
+    args = parser.parse_args()
+    if args.passes > 1 and not args.cache_file:
+        parser.error('--passes above 1 requires --cache_file')
+    main(args.csv, args.model, args.chunk_rows, args.cache_file, args.passes)
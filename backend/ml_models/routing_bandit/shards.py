@@ -0,0 +1,325 @@
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import zlib
+from collections import OrderedDict
+
+from checkpoint import write_json_atomic
+
+logger = logging.getLogger(__name__)
+
+
+class Shard:
+    __slots__ = ('name', 'bandit', 'examples', 'dirty', 'evicted', 'lock')
+
+    def __init__(self, name, bandit, examples=0):
+        self.name = name
+        self.bandit = bandit
+        self.examples = examples
+        self.dirty = False
+        self.evicted = False
+        self.lock = threading.Lock()
+
+
+class ShardedBandit:
+    """Per-segment routing policies keyed on context fields
+
+    Each distinct value of `shard_key` (one or more context fields, such as
+    `region` or `merchant_type`) gets its own bandit, created by
+    `new_bandit()`. A shard only answers predictions once it has learned
+    `min_examples`; until then, and for segments never seen, `predict`
+    returns None so the caller serves the global model.
+
+    At most `max_loaded` shards are held in memory, fewer when
+    `max_memory_mb` is set: each model is counted at the size of its weight
+    table, which is what a trained shard grows to. Beyond that the least
+    recently used shard is saved to `directory` and dropped, and loaded
+    back the next time it is needed. Shards already on disk from an
+    earlier run are picked up the same way. Loading, creating and saving
+    shards happens outside the registry lock, on the thread that needs the
+    shard; a prediction for a shard that is not loaded is answered by the
+    global model while the shard's worker loads it.
+
+    Learning runs on `workers` threads. Every shard is owned by one worker,
+    chosen by a stable hash of its name, so examples for a shard are
+    applied in order and different shards learn concurrently. Predictions
+    take the shard's lock and so can wait for at most one training step on
+    that shard.
+    """
+
+    def __init__(self, shard_key, directory, new_bandit, max_loaded=32, max_memory_mb=None,
+                 min_examples=100, workers=2, max_queue=10000):
+        self.shard_key = [field.strip() for field in shard_key.split(',') if field.strip()]
+        self.directory = directory
+        self.new_bandit = new_bandit
+        self.max_loaded = max_loaded
+        self.max_memory_mb = max_memory_mb
+        self.min_examples = min_examples
+        self.model_bytes = None
+        self.loads = 0
+        self.evictions = 0
+        self.created = 0
+        self.shard_predictions = 0
+        self.fallback_predictions = 0
+        self.examples_applied = 0
+        self.examples_dropped = 0
+        self.last_error = None
+        self._shards = OrderedDict()
+        self._on_disk = {}
+        self._pending = {}
+        self._prefetching = set()
+        self._lock = threading.Lock()
+        self._index_lock = threading.Lock()
+        self._queues = [queue.Queue(maxsize=max_queue) for _ in range(workers)]
+        self._threads = []
+        self._stop = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+        self._read_index()
+
+    @property
+    def running(self):
+        return any(thread.is_alive() for thread in self._threads)
+
+    def shard_name(self, context):
+        return '|'.join(str(context.get(field, 'unknown')) for field in self.shard_key)
+
+    def _path(self, name):
+        safe = re.sub(r'[^A-Za-z0-9_.-]', '_', name)[:64]
+        return os.path.join(self.directory, f'shard-{safe}-{zlib.crc32(name.encode()):08x}.vw')
+
+    def _index_path(self):
+        return os.path.join(self.directory, 'shards.json')
+
+    def _read_index(self):
+        if os.path.exists(self._index_path()):
+            with open(self._index_path()) as f:
+                self._on_disk = json.load(f)
+
+    def _write_index(self):
+        with self._index_lock:
+            with self._lock:
+                index = dict(self._on_disk)
+            write_json_atomic(self._index_path(), index)
+
+    def _capacity(self):
+        """Loaded shards allowed at once"""
+        if self.max_memory_mb is None or self.model_bytes is None:
+            return self.max_loaded
+        return max(1, min(self.max_loaded, int(self.max_memory_mb * 2**20 // self.model_bytes)))
+
+    def _shard(self, name, create):
+        """The loaded shard, loading or creating it as needed; None if absent and not `create`
+
+        The registry lock only covers the bookkeeping. The thread that finds
+        a shard missing marks it pending and loads or creates it without the
+        lock; others asking for the same shard wait on the pending event, as
+        they do while an evicted shard is being saved.
+        """
+        while True:
+            with self._lock:
+                shard = self._shards.get(name)
+                if shard is not None:
+                    self._shards.move_to_end(name)
+                    return shard
+                pending = self._pending.get(name)
+                if pending is None:
+                    examples = self._on_disk.get(name)
+                    if examples is None and not create:
+                        return None
+                    pending = self._pending[name] = threading.Event()
+                    break
+            pending.wait()
+
+        victims = []
+        try:
+            path = self._path(name)
+            if examples is not None and os.path.exists(path):
+                shard = Shard(name, self.new_bandit(load_path=path), examples)
+                self.loads += 1
+            elif create:
+                shard = Shard(name, self.new_bandit())
+                self.created += 1
+            else:
+                shard = None
+        finally:
+            with self._lock:
+                del self._pending[name]
+                if shard is not None:
+                    if self.model_bytes is None:
+                        vw = shard.bandit.vw_model
+                        self.model_bytes = vw.num_weights() * vw.get_stride() * 4
+                    self._shards[name] = shard
+                    while len(self._shards) > self._capacity():
+                        victim = self._shards.popitem(last=False)[1]
+                        self._pending[victim.name] = threading.Event()
+                        victims.append(victim)
+            pending.set()
+        for victim in victims:
+            self._evict(victim)
+        return shard
+
+    def _evict(self, shard):
+        """Save a shard already taken out of the registry and drop it from memory
+
+        It stays pending until it is on disk, so nothing loads it back from a
+        stale file in the meantime.
+        """
+        try:
+            with shard.lock:
+                saved = shard.dirty or shard.name not in self._on_disk
+                if saved:
+                    shard.bandit.save_model(self._path(shard.name))
+                    with self._lock:
+                        self._on_disk[shard.name] = shard.examples
+                shard.evicted = True
+                shard.bandit = None
+            if saved:
+                self._write_index()
+        finally:
+            with self._lock:
+                pending = self._pending.pop(shard.name)
+            pending.set()
+        self.evictions += 1
+        logger.debug(f"Evicted shard {shard.name} after {shard.examples} examples")
+
+    def _enqueue(self, name, example):
+        worker = self._queues[zlib.crc32(name.encode()) % len(self._queues)]
+        try:
+            worker.put_nowait((name, example))
+        except queue.Full:
+            return False
+        return True
+
+    def predict(self, context, actions):
+        """Prediction from the context's shard, or None when the global model should answer
+
+        Only a loaded shard answers. A trained shard that was evicted is
+        queued for loading on its worker, and the global model answers until
+        it is back, so predictions never wait on disk.
+        """
+        name = self.shard_name(context)
+        prefetch = False
+        with self._lock:
+            shard = self._shards.get(name)
+            if shard is not None:
+                self._shards.move_to_end(name)
+            elif (self._on_disk.get(name, 0) >= self.min_examples and name not in self._pending
+                  and name not in self._prefetching and self.running):
+                self._prefetching.add(name)
+                prefetch = True
+        if shard is None:
+            if prefetch and not self._enqueue(name, None):
+                with self._lock:
+                    self._prefetching.discard(name)
+            self.fallback_predictions += 1
+            return None
+        with shard.lock:
+            if shard.evicted or shard.examples < self.min_examples:
+                self.fallback_predictions += 1
+                return None
+            result = shard.bandit.predict(context, actions)
+        self.shard_predictions += 1
+        result['shard'] = name
+        return result
+
+    def submit(self, context, actions, chosen_action, reward, probability=1):
+        """Queue an example for its shard's worker; False when that queue is full"""
+        if not self._enqueue(self.shard_name(context), (context, actions, chosen_action, reward, probability)):
+            self.examples_dropped += 1
+            return False
+        return True
+
+    def learn(self, name, context, actions, chosen_action, reward, probability=1):
+        """Train one shard, reloading it if it was evicted in the meantime"""
+        while True:
+            shard = self._shard(name, create=True)
+            with shard.lock:
+                if shard.evicted:
+                    continue
+                shard.bandit.train_step(context, actions, chosen_action, reward, probability)
+                shard.examples += 1
+                shard.dirty = True
+            self.examples_applied += 1
+            return
+
+    def _run(self, worker):
+        while not self._stop.is_set():
+            try:
+                name, example = worker.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if example is None:
+                    self._shard(name, create=False)
+                else:
+                    self.learn(name, *example)
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Shard training error: {e}")
+            finally:
+                if example is None:
+                    with self._lock:
+                        self._prefetching.discard(name)
+                worker.task_done()
+
+    def start(self):
+        self._stop.clear()
+        self._threads = [threading.Thread(target=self._run, args=(worker,), daemon=True) for worker in self._queues]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join(timeout)
+
+    def drain(self, timeout=None):
+        """Wait until every queued example has been applied"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while any(q.unfinished_tasks for q in self._queues):
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.01)
+        return True
+
+    def flush(self):
+        """Save every loaded shard with unsaved learning"""
+        with self._lock:
+            shards = list(self._shards.values())
+        for shard in shards:
+            with shard.lock:
+                if shard.dirty and not shard.evicted:
+                    shard.bandit.save_model(self._path(shard.name))
+                    shard.dirty = False
+                    with self._lock:
+                        self._on_disk[shard.name] = shard.examples
+        self._write_index()
+
+    def stats(self):
+        with self._lock:
+            loaded = {name: shard.examples for name, shard in self._shards.items()}
+        return {
+            'shard_key': self.shard_key,
+            'loaded': len(loaded),
+            'capacity': self._capacity(),
+            'max_loaded': self.max_loaded,
+            'max_memory_mb': self.max_memory_mb,
+            'model_mb': self.model_bytes / 2**20 if self.model_bytes else None,
+            'on_disk': len(self._on_disk),
+            'min_examples': self.min_examples,
+            'created': self.created,
+            'loads': self.loads,
+            'evictions': self.evictions,
+            'shard_predictions': self.shard_predictions,
+            'fallback_predictions': self.fallback_predictions,
+            'examples_applied': self.examples_applied,
+            'examples_dropped': self.examples_dropped,
+            'queue_depths': [q.qsize() for q in self._queues],
+            'workers': len(self._queues),
+            'last_error': self.last_error,
+            'shards': dict(self._on_disk, **loaded),
+        }
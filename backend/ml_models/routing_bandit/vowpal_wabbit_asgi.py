@@ -0,0 +1,85 @@
+"""ASGI front end for the routing bandit
+
+Serves /invocations, /train and /reward natively: orjson decoding and
+encoding, one-pass validation against compiled schemas, and model calls on
+a bounded thread pool that answers 429 once ROUTING_MAX_PENDING calls are
+in flight. Every other URL goes to the Flask app unchanged.
+
+Run with `python vowpal_wabbit_asgi.py`, or set ROUTING_ASGI=1 for
+gunicorn.conf.py to run it in prefork workers.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'serving'))
+
+from asgi import BoundedExecutor, asgi_app
+from schema import NUMBER, Field, compile_schema
+import vowpal_wabbit_model
+
+CONTEXT = compile_schema({
+    'amount_log': Field(NUMBER),
+    'risk_score': Field(NUMBER),
+    'hour': Field(int),
+    'day_of_week': Field(int),
+    'is_weekend': Field((int, bool)),
+    'merchant_type': Field(str),
+    'region': Field(str),
+    'currency_code': Field(NUMBER),
+})
+ACTION = compile_schema({
+    'action_id': Field(int),
+    'features': Field(dict),
+    'success_rate': Field(NUMBER),
+    'cost': Field(NUMBER),
+    'latency': Field(NUMBER),
+    'supports_region': Field((int, bool)),
+    'supports_amount': Field((int, bool)),
+    'volume': Field(NUMBER),
+})
+OUTCOME = {
+    'success': Field(bool, nullable=True),
+    'latency_ms': Field(NUMBER, nullable=True),
+}
+INVOCATION = compile_schema({
+    'context_features': Field(dict, schema=CONTEXT),
+    'actions': Field(list, nullable=True, items=ACTION),
+})
+TRAINING = compile_schema(dict(
+    OUTCOME,
+    context_features=Field(dict, schema=CONTEXT),
+    actions=Field(list, nullable=True, items=ACTION),
+    chosen_action=Field(int, required=True),
+    reward=Field(NUMBER, required=True),
+    probability=Field(NUMBER),
+))
+REWARD = compile_schema(dict(
+    OUTCOME,
+    decision_id=Field(str, required=True),
+    reward=Field(NUMBER, required=True),
+))
+
+executor = BoundedExecutor(
+    workers=int(os.environ.get('ROUTING_WORKER_THREADS', '4')),
+    max_pending=int(os.environ.get('ROUTING_MAX_PENDING', '64'))
+)
+
+app = asgi_app(
+    '/routing-vw-bandit-endpoint-local',
+    {
+        'invocations': (vowpal_wabbit_model.invoke, INVOCATION),
+        'train': (vowpal_wabbit_model.train_example, TRAINING),
+        'reward': (vowpal_wabbit_model.join_reward, REWARD),
+    },
+    executor,
+    vowpal_wabbit_model.app,
+    metrics=vowpal_wabbit_model.stage_metrics
+)
+
+if __name__ == '__main__':
+    import uvicorn
+
+    vowpal_wabbit_model.load_models()
+    vowpal_wabbit_model.start_standalone()
+
+    uvicorn.run(app, host='0.0.0.0', port=8080)
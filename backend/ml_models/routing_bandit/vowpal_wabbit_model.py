@@ -1,28 +1,77 @@
 
-import numpy as np
+import atexit
+import itertools
 import json
 import os
+import queue
+import random
+import sys
+import tempfile
+import threading
 from vowpalwabbit import pyvw
 import logging
+from example_builder import VWExampleBuilder
+from learner import BanditLearner, SnapshotFollower
+from checkpoint import Checkpointer, write_json_atomic
+from decision_log import DecisionLog, ForwardedDecisionLog
+from decision_cache import DecisionCache
+from gateway_stats import GatewayStats
+from shards import ShardedBandit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'serving'))
+from micro_batcher import MicroBatcher
+from prefork import message_queue, run_until_terminated
+from stage_metrics import PROMETHEUS_CONTENT_TYPE, StageMetrics, perf_counter_ns
+from profiler import SamplingProfiler
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+_model_versions = itertools.count(1)
+
+# Per-stage latency histograms behind /metrics; while None every hook is a single comparison
+stage_metrics = StageMetrics('routing') if os.environ.get('VW_STAGE_METRICS') == '1' else None
+
 class RoutingContextualBandit:
-    def __init__(self, num_actions=3):
+    def __init__(self, num_actions=3, prehashed_examples=True, seed=None):
         self.num_actions = num_actions
         self.vw_model = None
+        self.vw_args = None
+        self.prehashed_examples = prehashed_examples
+        self.example_builder = None
+        self.prediction_type = None
+        self.model_version = 0
+        self._lock = threading.Lock()
+        self._rng = random.Random(seed)
         self.action_names = ['Stripe', 'AmazonPay', 'Solana']
         self.feature_names = [
             'amount_log', 'risk_score', 'hour', 'day_of_week', 'is_weekend',
             'merchant_type', 'region', 'currency'
         ]
         
-    def initialize_model(self, learning_rate=0.1, epsilon=0.1):
-        """Initialize Vowpal Wabbit contextual bandit model"""
-        vw_args = f"--cb_explore_adf --epsilon {epsilon} -l {learning_rate} --power_t 0 --cb_type mtr"
-        self.vw_model = pyvw.vw(vw_args)
+    def initialize_model(self, learning_rate=0.1, epsilon=0.1, driver_args=None, cb_type='mtr', bits=None):
+        """Initialize Vowpal Wabbit contextual bandit model
+
+        `driver_args` (input files, cache, passes) only apply to this
+        workspace and are not carried into snapshots or reloads. `bits`
+        sets the weight table size, 2**bits entries, instead of VW's 18.
+        """
+        vw_args = f"--cb_explore_adf --epsilon {epsilon} -l {learning_rate} --power_t 0 --cb_type {cb_type}"
+        if bits is not None:
+            vw_args += f" -b {bits}"
+        self.vw_model = pyvw.vw(f"{vw_args} {driver_args}" if driver_args else vw_args)
+        self.vw_args = vw_args
+        self._attach_example_builder()
         logger.info(f"Initialized VW model with args: {vw_args}")
+
+    def _attach_example_builder(self):
+        """Cached examples belong to one workspace, so rebuild on every model change"""
+        self.model_version = next(_model_versions)
+        self.prediction_type = self.vw_model.get_prediction_type()
+        if self.prehashed_examples:
+            self.example_builder = VWExampleBuilder(self.vw_model, self.action_names)
+        else:
+            self.example_builder = None
         
     def format_context_features(self, context):
         """Format context features for VW"""
@@ -56,12 +105,18 @@ class RoutingContextualBandit:
         features.append(f"supports_amount:{action_data.get('supports_amount', 1)}")
         features.append(f"volume:{action_data.get('volume', 100)}")
         
-        features.append(f"gateway_{self.action_names[action_id]}")
+        # Client action sets may be longer than the gateway table
+        if action_id < len(self.action_names):
+            features.append(f"gateway_{self.action_names[action_id]}")
         
         return " ".join(features)
     
-    def create_vw_example(self, context, actions, chosen_action=None, reward=None):
-        """Create VW example in CB ADF format"""
+    def create_vw_example(self, context, actions, chosen_action=None, reward=None, probability=1):
+        """Create VW example in CB ADF format
+
+        `probability` is the propensity with which `chosen_action` was
+        sampled when the decision was served.
+        """
         context_features = self.format_context_features(context)
         
         if chosen_action is not None and reward is not None:
@@ -78,7 +133,7 @@ class RoutingContextualBandit:
                 
                 if i == chosen_action:
                     cost = max(0.0, 1.0-reward)
-                    action_line = f"{i}:{cost:.3f}:1 |a {action_features}"
+                    action_line = f"{i}:{cost:.3f}:{probability} |a {action_features}"
                 else:
                     action_line = f"|a {action_features}"
             else:
@@ -88,19 +143,34 @@ class RoutingContextualBandit:
         
         return shared_line, action_lines
     
-    def train_step(self, context, actions, chosen_action, reward):
-        """Single training step"""
-        if self.vw_model is None:
-            self.initialize_model()
+    def vw_examples(self, context, actions, chosen_action=None, reward=None, probability=1):
+        """Pre-hashed example objects when possible, otherwise the ADF text"""
+        if self.example_builder is not None:
+            examples = self.example_builder.build(context, actions, chosen_action, reward, probability)
+            if examples is not None:
+                return examples
         
         shared_line, action_lines = self.create_vw_example(
-            context, actions, chosen_action, reward
+            context, actions, chosen_action, reward, probability
         )
+        return "\n".join([shared_line] + action_lines)
+    
+    def train_step(self, context, actions, chosen_action, reward, probability=1):
+        """Single training step"""
+        if self.vw_model is None:
+            self.initialize_model()
         
-        example_lines = [shared_line] + action_lines
-        example = "\n".join(example_lines)
-        
-        self.vw_model.learn(example)
+        metrics = stage_metrics
+        with self._lock:
+            if metrics is not None:
+                t = perf_counter_ns()
+            examples = self.vw_examples(context, actions, chosen_action, reward, probability)
+            if metrics is not None:
+                t = metrics.lap('train_example', t)
+            self.vw_model.learn(examples)
+            if metrics is not None:
+                metrics.lap('vw_learn', t)
+            self.model_version = next(_model_versions)
         
         logger.debug(f"Trained on example with reward {reward} for action {chosen_action}")
     
@@ -109,28 +179,77 @@ class RoutingContextualBandit:
         if self.vw_model is None:
             self.initialize_model()
         
-        shared_line, action_lines = self.create_vw_example(context, actions)
-        
-        example_lines = [shared_line] + action_lines
-        example = "\n".join(example_lines)
-        
-        predictions = self.vw_model.predict(example)
+        metrics = stage_metrics
+        if metrics is None:
+            with self._lock:
+                predictions = self.vw_model.predict(self.vw_examples(context, actions), self.prediction_type)
+            return self.format_prediction(predictions)
+        
+        with self._lock:
+            t = perf_counter_ns()
+            examples = self.vw_examples(context, actions)
+            t = metrics.lap('build_example', t)
+            predictions = self.vw_model.predict(examples, self.prediction_type)
+            t = metrics.lap('vw_predict', t)
+        result = self.format_prediction(predictions)
+        metrics.lap('format_prediction', t)
+        return result
+    
+    def predict_batch(self, decisions):
+        """Predict many (context, actions) decisions under one lock acquisition"""
+        if self.vw_model is None:
+            self.initialize_model()
         
+        metrics = stage_metrics
+        if metrics is None:
+            with self._lock:
+                predictions = [
+                    self.vw_model.predict(self.vw_examples(context, actions), self.prediction_type)
+                    for context, actions in decisions
+                ]
+            return [self.format_prediction(p) for p in predictions]
+        
+        predictions = []
+        with self._lock:
+            t = perf_counter_ns()
+            for context, actions in decisions:
+                examples = self.vw_examples(context, actions)
+                t = metrics.lap('build_example', t)
+                predictions.append(self.vw_model.predict(examples, self.prediction_type))
+                t = metrics.lap('vw_predict', t)
+        results = []
+        for p in predictions:
+            results.append(self.format_prediction(p))
+            t = metrics.lap('format_prediction', t)
+        return results
+    
+    def sample_action(self, action_probs):
+        """Draw an action from the exploration pmf"""
+        target = self._rng.random() * sum(action_probs)
+        cumulative = 0.0
+        for i, p in enumerate(action_probs):
+            cumulative += p
+            if target < cumulative:
+                return i
+        return len(action_probs) - 1
+    
+    def format_prediction(self, predictions):
+        """Response body for one VW prediction, with the action sampled from its pmf"""
         if isinstance(predictions, list):
             action_probs = predictions
         else:
             action_probs = [predictions] + [0.0] * (self.num_actions - 1)
         
-        chosen_action = np.argmax(action_probs)
-        confidence = max(action_probs)
+        chosen_action = self.sample_action(action_probs)
+        probability = action_probs[chosen_action]
         
-        exploration = confidence < 0.7
+        exploration = probability < max(action_probs)
         
         return {
             'chosen_action': int(chosen_action),
-            'action_probability': float(confidence),
-            'exploration': exploration,
-            'expected_reward': float(confidence),
+            'action_probability': float(probability),
+            'exploration': bool(exploration),
+            'expected_reward': float(probability),
             'all_probabilities': [float(p) for p in action_probs]
         }
     
@@ -146,40 +265,190 @@ class RoutingContextualBandit:
                 example['context'],
                 example['actions'],
                 example['chosen_action'],
-                example['reward']
+                example['reward'],
+                example.get('probability', 1)
             )
         
         logger.info("Batch training completed")
     
     def save_model(self, path):
-        """Save VW model"""
+        """Save VW model, with its training args alongside in `<path>.json`"""
         if self.vw_model is None:
             raise ValueError("No model to save")
         
         self.vw_model.save(path)
+        write_json_atomic(f"{path}.json", {'vw_args': self.vw_args, 'num_actions': self.num_actions})
         logger.info(f"Model saved to {path}")
     
-    def load_model(self, path):
+    def load_model(self, path, vw_args=None):
+        """Load a saved VW model with its training args
+
+        Args come from `vw_args`, then the `<path>.json` written by
+        `save_model`, then the historical defaults.
+        """
         if not os.path.exists(path):
             raise FileNotFoundError(f"{path} not found")
 
-        vw_args = (
-            f"--cb_explore_adf "
-            f"--epsilon 0.1 "         
-            f"-l 0.1 "               
-            f"--power_t 0 "
-            f"--cb_type mtr "
-            f"-i {path} "          
-            "--quiet"             
-        )
+        if vw_args is None and os.path.exists(f"{path}.json"):
+            with open(f"{path}.json") as f:
+                vw_args = json.load(f).get('vw_args')
+
+        if vw_args is None:
+            vw_args = (
+                f"--cb_explore_adf "
+                f"--epsilon 0.1 "         
+                f"-l 0.1 "               
+                f"--power_t 0 "
+                f"--cb_type mtr"
+            )
 
-        self.vw_model = pyvw.vw(vw_args)
+        self.vw_model = pyvw.vw(f"{vw_args} -i {path} --quiet")
+        self.vw_args = vw_args
+        self._attach_example_builder()
         logger.info(f"Loaded VW model from {path} with args: {vw_args}")
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 
 app = Flask(__name__)
-bandit_model = RoutingContextualBandit()
+bandit_model = RoutingContextualBandit(
+    prehashed_examples=os.environ.get('VW_PREHASHED_EXAMPLES', '1') == '1'
+)
+checkpointer = Checkpointer(
+    os.environ['VW_CHECKPOINT_DIR'],
+    interval=float(os.environ.get('VW_CHECKPOINT_INTERVAL', '60')),
+    every=int(os.environ['VW_CHECKPOINT_EVERY']) if os.environ.get('VW_CHECKPOINT_EVERY') else None,
+    keep=int(os.environ.get('VW_CHECKPOINT_KEEP', '5'))
+) if os.environ.get('VW_CHECKPOINT_DIR') else None
+
+# Under gunicorn (gunicorn.conf.py) request workers only serve predictions;
+# training examples, decisions, rewards and outcomes go over
+# `learner_messages` to the one learner process, which publishes snapshots
+# under `snapshot_dir` for the workers to load
+prefork = os.environ.get('ROUTING_PREFORK') == '1'
+snapshot_dir = os.environ.get('VW_SNAPSHOT_DIR', os.path.join(tempfile.gettempdir(), 'routing-bandit-snapshots'))
+learner_messages = message_queue(int(os.environ.get('VW_TRAIN_QUEUE_SIZE', '10000'))) if prefork else None
+profiler = SamplingProfiler() if os.environ.get('VW_PROFILER') == '1' else None
+
+def new_bandit_learner(publish_dir=None, publish_metadata=None):
+    return BanditLearner(
+        bandit_model,
+        snapshot_interval=float(os.environ.get('VW_SNAPSHOT_INTERVAL', '5')),
+        snapshot_every=int(os.environ['VW_SNAPSHOT_EVERY']) if os.environ.get('VW_SNAPSHOT_EVERY') else None,
+        max_queue=int(os.environ.get('VW_TRAIN_QUEUE_SIZE', '10000')),
+        checkpointer=checkpointer,
+        publish_dir=publish_dir,
+        publish_metadata=publish_metadata
+    )
+
+def new_decision_log():
+    return DecisionLog(
+        max_entries=int(os.environ.get('VW_DECISION_LOG_SIZE', '100000')),
+        ttl=float(os.environ.get('VW_REWARD_TTL', '3600')),
+        path=os.environ.get('VW_DECISION_LOG_PATH')
+    )
+
+if prefork:
+    bandit_learner = SnapshotFollower(
+        snapshot_dir,
+        learner_messages,
+        bandit_model,
+        interval=float(os.environ.get('VW_SNAPSHOT_POLL', '1')),
+        on_update=lambda meta: gateway_stats.use_features(meta['gateway_features'])
+    )
+    decision_log = ForwardedDecisionLog(learner_messages)
+else:
+    bandit_learner = new_bandit_learner()
+    decision_log = new_decision_log()
+
+decision_cache = DecisionCache(
+    max_entries=int(os.environ.get('VW_CACHE_SIZE', '10000')),
+    ttl=float(os.environ.get('VW_CACHE_TTL', '60')),
+    amount_step=float(os.environ.get('VW_CACHE_AMOUNT_STEP', '0.25')),
+    risk_step=float(os.environ.get('VW_CACHE_RISK_STEP', '0.05')),
+    action_decimals=int(os.environ.get('VW_CACHE_ACTION_DECIMALS', '2'))
+) if os.environ.get('VW_DECISION_CACHE') == '1' else None
+
+gateway_stats = GatewayStats(
+    window=int(os.environ.get('VW_GATEWAY_WINDOW', '1000')),
+    min_samples=int(os.environ.get('VW_GATEWAY_MIN_SAMPLES', '20')),
+    volume_seconds=float(os.environ.get('VW_GATEWAY_VOLUME_SECONDS', '60')),
+    refresh_interval=float(os.environ.get('VW_GATEWAY_REFRESH', '1'))
+)
+
+def new_shard_bandit(load_path=None):
+    """A bandit for one shard, fresh or reloaded from its saved model"""
+    bandit = RoutingContextualBandit(prehashed_examples=bandit_model.prehashed_examples)
+    if load_path is not None:
+        bandit.load_model(load_path)
+    else:
+        bandit.initialize_model(bits=int(os.environ['VW_SHARD_BITS']) if os.environ.get('VW_SHARD_BITS') else None)
+    return bandit
+
+if prefork and os.environ.get('VW_SHARD_KEY'):
+    logger.warning("VW_SHARD_KEY is set but shards are not served prefork; using the global model only")
+
+sharded_bandit = ShardedBandit(
+    os.environ['VW_SHARD_KEY'],
+    os.environ.get('VW_SHARD_DIR', './shards'),
+    new_shard_bandit,
+    max_loaded=int(os.environ.get('VW_SHARD_MAX_LOADED', '32')),
+    max_memory_mb=float(os.environ['VW_SHARD_MAX_MEMORY_MB']) if os.environ.get('VW_SHARD_MAX_MEMORY_MB') else None,
+    min_examples=int(os.environ.get('VW_SHARD_MIN_EXAMPLES', '100')),
+    workers=int(os.environ.get('VW_SHARD_WORKERS', '2')),
+    max_queue=int(os.environ.get('VW_TRAIN_QUEUE_SIZE', '10000'))
+) if os.environ.get('VW_SHARD_KEY') and not prefork else None
+
+def request_actions(data, context):
+    """Actions from the request, or built from the server's gateway stats when omitted
+
+    Actions sent as `{action_id, features}` are flattened to their features.
+    """
+    actions = data.get('actions')
+    if not actions:
+        return gateway_stats.actions(context)
+    return [action['features'] if isinstance(action.get('features'), dict) else action for action in actions]
+
+def outcome_fields(data, reward):
+    """(success, latency_ms) of a reported outcome; success defaults to the reward"""
+    success = data.get('success')
+    if success is None:
+        success = reward >= 0.5
+    return bool(success), data.get('latency_ms')
+
+def record_outcome(data, chosen_action, reward):
+    """Feed a reported outcome into the gateway stats
+
+    Only for actions chosen from the server's gateway table; a client's own
+    action set says nothing about which gateway an index stands for.
+    """
+    success, latency = outcome_fields(data, reward)
+    action = int(chosen_action)
+    if not gateway_stats.valid_action(action):
+        raise ValueError(f'chosen_action {chosen_action!r} is not a gateway index')
+    if prefork:
+        forward(('outcome', action, success, latency))
+    else:
+        gateway_stats.record(action, success, latency)
+
+def forward(message):
+    """Send a message to the learner process; False when its queue is full"""
+    try:
+        learner_messages.put_nowait(message)
+    except queue.Full:
+        return False
+    return True
+
+def predict_decisions(decisions):
+    """Score a micro-batch of (context, actions) decisions"""
+    if bandit_learner.running:
+        return bandit_learner.predict_batch(decisions)
+    return bandit_model.predict_batch(decisions)
+
+prediction_batcher = MicroBatcher(
+    predict_decisions,
+    max_batch=int(os.environ.get('ROUTING_BATCH_MAX', '32')),
+    max_wait_us=int(os.environ.get('ROUTING_BATCH_WAIT_US', '500'))
+)
 
 @app.route('/routing-vw-bandit-endpoint-local/ping', methods=['GET'])
 def ping():
@@ -187,54 +456,295 @@ def ping():
     return jsonify({'status': 'healthy'})
 
 @app.route('/ping', methods=['GET'])
-def ping():
+def root_ping():
     """Health check endpoint"""
     return jsonify({'status': 'healthy'})
 
 @app.route('/routing-vw-bandit-endpoint-local/invocations', methods=['POST'])
 def predict():
     """Prediction endpoint"""
+    metrics = stage_metrics
     try:
-        data = request.get_json()
-        
-        context = data.get('context_features', {})
-        actions = data.get('actions', [])
+        if metrics is None:
+            return jsonify(invoke(request.get_json()))
         
-        result = bandit_model.predict(context, actions)
-        
-        return jsonify(result)
+        start = perf_counter_ns()
+        data = request.get_json()
+        t = metrics.lap('parse', start)
+        body = invoke(data)
+        t = perf_counter_ns()
+        response = jsonify(body)
+        metrics.lap('serialize', t)
+        metrics.lap('request', start)
+        return response
         
     except Exception as e:
         logger.error(f"Prediction error: {str(e)}")
         return jsonify({'error': str(e)}), 400
 
+def invoke(data):
+    """Routing decision for one invocations request, logged under a new decision_id"""
+    context = data.get('context_features', {})
+    actions = request_actions(data, context)
+    
+    result = sharded_bandit.predict(context, actions) if sharded_bandit is not None else None
+    if result is None and decision_cache is not None:
+        serving_model = bandit_learner.snapshot if bandit_learner.running else bandit_model
+        result = decision_cache.predict(serving_model, context, actions, score)
+    elif result is None:
+        result = score(context, actions)
+    
+    metrics = stage_metrics
+    if metrics is not None:
+        t = perf_counter_ns()
+    result['decision_id'] = decision_log.record(
+        context, actions, result['chosen_action'], result['action_probability'],
+        gateway_actions=not data.get('actions')
+    )
+    if metrics is not None:
+        metrics.lap('decision_log', t)
+    return result
+
+def score(context, actions):
+    """Run one decision through the batcher, the current snapshot or the model itself"""
+    if prediction_batcher.running:
+        return prediction_batcher.submit((context, actions))
+    if bandit_learner.running:
+        return bandit_learner.predict(context, actions)
+    return bandit_model.predict(context, actions)
+
 @app.route('/routing-vw-bandit-endpoint-local/train', methods=['POST'])
 def train():
     """Training endpoint for online learning"""
     try:
-        data = request.get_json()
-        
-        context = data.get('context_features', {})
-        actions = data.get('actions', [])
-        chosen_action = data.get('chosen_action')
-        reward = data.get('reward')
-        
-        if chosen_action is None or reward is None:
-            return jsonify({'error': 'chosen_action and reward required for training'}), 400
-        
-        bandit_model.train_step(context, actions, chosen_action, reward)
-        
-        return jsonify({'status': 'training_completed'})
+        body, status = train_example(request.get_json())
+        return jsonify(body), status
         
     except Exception as e:
         logger.error(f"Training error: {str(e)}")
         return jsonify({'error': str(e)}), 400
 
-if __name__ == '__main__':
+def train_example(data):
+    """(body, status) for a /train request carrying its own chosen action and reward"""
+    context = data.get('context_features', {})
+    actions = request_actions(data, context)
+    chosen_action = data.get('chosen_action')
+    reward = data.get('reward')
+    
+    if chosen_action is None or reward is None:
+        return {'error': 'chosen_action and reward required for training'}, 400
+    
+    if not data.get('actions'):
+        record_outcome(data, chosen_action, reward)
+    return learn(context, actions, chosen_action, reward, data.get('probability', 1))
+
+@app.route('/routing-vw-bandit-endpoint-local/reward', methods=['POST'])
+def reward():
+    """Join a reward to its logged decision and learn from it"""
+    try:
+        body, status = join_reward(request.get_json())
+        return jsonify(body), status
+        
+    except Exception as e:
+        logger.error(f"Reward error: {str(e)}")
+        return jsonify({'error': str(e)}), 400
+
+def join_reward(data):
+    """(body, status) for a /reward request naming a logged decision"""
+    decision_id = data.get('decision_id')
+    reward = data.get('reward')
+    
+    if decision_id is None or reward is None:
+        return {'error': 'decision_id and reward required'}, 400
+    
+    if prefork:
+        # The decision was logged by the learner process, which joins it there
+        success, latency = outcome_fields(data, float(reward))
+        if not forward(('reward', decision_id, float(reward), success, latency)):
+            return {'error': 'training queue full'}, 503
+        return {'status': 'reward_queued'}, 202
+    
+    decision = decision_log.join(decision_id, float(reward))
+    if decision is None:
+        return {'error': f'unknown or expired decision {decision_id}'}, 404
+    
+    if decision.get('gateway_actions'):
+        record_outcome(data, decision['chosen_action'], float(reward))
+    return learn(
+        decision['context'], decision['actions'], decision['chosen_action'],
+        float(reward), decision['probability']
+    )
+
+def learn(context, actions, chosen_action, reward, probability):
+    """Queue the example for the learner thread, or train inline without one
+
+    With sharding on, the example also trains its context's shard. Returns
+    the response body and status.
+    """
+    if sharded_bandit is not None:
+        if sharded_bandit.running:
+            sharded_bandit.submit(context, actions, chosen_action, reward, probability)
+        else:
+            sharded_bandit.learn(sharded_bandit.shard_name(context), context, actions,
+                                 chosen_action, reward, probability)
+    
+    if bandit_learner.running:
+        if not bandit_learner.submit(context, actions, chosen_action, reward, probability):
+            return {'error': 'training queue full'}, 503
+        return {'status': 'training_queued'}, 202
+    
+    bandit_model.train_step(context, actions, chosen_action, reward, probability)
+    
+    return {'status': 'training_completed'}, 200
+
+@app.route('/routing-vw-bandit-endpoint-local/decisions', methods=['GET'])
+def decision_stats():
+    """Pending decisions and reward join counts"""
+    return jsonify(decision_log.stats())
+
+@app.route('/routing-vw-bandit-endpoint-local/learner', methods=['GET'])
+def learner_stats():
+    """Training queue depth, update lag and snapshot age"""
+    return jsonify(bandit_learner.stats())
+
+@app.route('/routing-vw-bandit-endpoint-local/batcher', methods=['GET'])
+def batcher_stats():
+    """Micro-batch sizes and queueing delay"""
+    return jsonify(prediction_batcher.stats())
+
+@app.route('/routing-vw-bandit-endpoint-local/checkpoints', methods=['GET'])
+def checkpoint_stats():
+    """Checkpoint age, WAL backlog and the last recovery"""
+    if checkpointer is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(checkpointer.stats(), enabled=True))
+
+@app.route('/routing-vw-bandit-endpoint-local/shards', methods=['GET'])
+def shard_stats():
+    """Loaded and on-disk shards, evictions and fallback predictions"""
+    if sharded_bandit is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(sharded_bandit.stats(), enabled=True))
+
+@app.route('/routing-vw-bandit-endpoint-local/gateways', methods=['GET'])
+def gateway_table():
+    """Rolling per-gateway success rate, latency percentiles and volume"""
+    return jsonify(gateway_stats.stats())
+
+@app.route('/routing-vw-bandit-endpoint-local/metrics', methods=['GET'])
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Per-stage latency histograms in the Prometheus text format"""
+    if stage_metrics is None:
+        return Response('# stage metrics are disabled; set VW_STAGE_METRICS=1\n', content_type=PROMETHEUS_CONTENT_TYPE)
+    return Response(stage_metrics.render(), content_type=PROMETHEUS_CONTENT_TYPE)
+
+@app.route('/routing-vw-bandit-endpoint-local/profile', methods=['POST'])
+def profile():
+    """Sample every thread's stack for `seconds` and return them collapsed for a flame graph"""
+    if profiler is None:
+        return jsonify({'error': 'profiling is disabled; set VW_PROFILER=1'}), 400
+    data = request.get_json(silent=True) or {}
+    try:
+        stacks, samples = profiler.profile(float(data.get('seconds', 10)), float(data.get('interval_ms', 5)) / 1e3)
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 409
+    return Response(profiler.collapsed(stacks), mimetype='text/plain', headers={'X-Profile-Samples': str(samples)})
+
+@app.route('/routing-vw-bandit-endpoint-local/cache', methods=['GET'])
+def cache_stats():
+    """Decision cache hit rate and latency saved"""
+    if decision_cache is None:
+        return jsonify({'enabled': False})
+    return jsonify(dict(decision_cache.stats(), enabled=True))
+
+def load_models():
+    """Load the serving model; under gunicorn this runs once in the master, before workers fork"""
     bandit_model.initialize_model()
     
     model_path = os.environ.get('ml_models/routing_bandit', './routing_model.vw')
     if os.path.exists(model_path):
         bandit_model.load_model(model_path)
+
+def start_worker():
+    """Start the threads each serving process needs for itself"""
+    if prefork:
+        bandit_learner.start()
+    
+    if os.environ.get('ROUTING_MICRO_BATCH') == '1':
+        prediction_batcher.start()
+
+def run_learner_process():
+    """The one process that learns when serving prefork
+
+    It owns the training workspace, the decision log, checkpoints and the
+    gateway outcomes, and publishes snapshots with the current gateway
+    features under VW_SNAPSHOT_DIR, which every worker follows.
+    """
+    learner = new_bandit_learner(
+        publish_dir=snapshot_dir,
+        publish_metadata=lambda: {'gateway_features': gateway_stats.features()}
+    )
+    log = new_decision_log()
+    
+    def handle(message):
+        kind = message[0]
+        if kind == 'train':
+            learner.submit(*message[1:])
+        elif kind == 'decision':
+            log.insert(message[1])
+        elif kind == 'outcome':
+            _, action, success, latency = message
+            if not gateway_stats.valid_action(action):
+                logger.warning(f"Outcome for unknown gateway action {action!r}")
+                return
+            gateway_stats.record(action, success, latency)
+        elif kind == 'reward':
+            _, decision_id, reward, success, latency = message
+            decision = log.join(decision_id, reward)
+            if decision is None:
+                logger.warning(f"Reward for unknown or expired decision {decision_id}")
+                return
+            if decision.get('gateway_actions'):
+                gateway_stats.record(decision['chosen_action'], success, latency)
+            learner.submit(decision['context'], decision['actions'], decision['chosen_action'],
+                           reward, decision['probability'])
+    
+    def loop(stopping):
+        if checkpointer is not None:
+            checkpointer.recover(bandit_model)
+        learner.start()
+        while not stopping.is_set():
+            try:
+                message = learner_messages.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                handle(message)
+            except Exception as e:
+                logger.error(f"Learner message error: {e}")
+        learner.stop()
+    
+    run_until_terminated(loop)
+
+def start_standalone():
+    """Start the learner thread, shards and batcher of a single-process server"""
+    if os.environ.get('VW_LEARNER_THREAD', '1') == '1':
+        if checkpointer is not None:
+            checkpointer.recover(bandit_model)
+        bandit_learner.start()
+    elif checkpointer is not None:
+        logger.warning("VW_CHECKPOINT_DIR is set but checkpoints need the learner thread; not checkpointing")
+    
+    if sharded_bandit is not None:
+        if os.environ.get('VW_LEARNER_THREAD', '1') == '1':
+            sharded_bandit.start()
+        atexit.register(sharded_bandit.flush)
+    
+    start_worker()
+
+if __name__ == '__main__':
+    load_models()
+    start_standalone()
     
     app.run(host='0.0.0.0', port=8080)
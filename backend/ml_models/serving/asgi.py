@@ -0,0 +1,141 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+import orjson
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+
+from schema import SchemaError
+from stage_metrics import perf_counter_ns
+
+
+class Overloaded(Exception):
+    """The executor already holds as many calls as it admits"""
+
+
+class BoundedExecutor:
+    """Thread pool for CPU-bound model calls that sheds load instead of queueing it
+
+    Up to `workers` calls run at once and at most `max_pending` are admitted
+    in total, running or waiting; `run` raises `Overloaded` beyond that so
+    the caller can answer 429 straight away rather than let latency grow
+    with an unbounded queue. The counters are only touched from the event
+    loop thread.
+    """
+
+    def __init__(self, workers=4, max_pending=64):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.pending = 0
+        self.peak_pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='model')
+
+    async def run(self, fn, *args):
+        if self.pending >= self.max_pending:
+            self.rejected += 1
+            raise Overloaded()
+        self.pending += 1
+        self.peak_pending = max(self.peak_pending, self.pending)
+        start = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.pending -= 1
+            self.completed += 1
+            self.busy_seconds += time.perf_counter() - start
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def stats(self):
+        return {
+            'workers': self.workers,
+            'max_pending': self.max_pending,
+            'pending': self.pending,
+            'peak_pending': self.peak_pending,
+            'completed': self.completed,
+            'rejected': self.rejected,
+            'mean_call_ms': self.busy_seconds / self.completed * 1e3 if self.completed else None,
+        }
+
+
+def json_response(body, status=200, headers=None):
+    return Response(orjson.dumps(body, option=orjson.OPT_SERIALIZE_NUMPY), status_code=status,
+                    headers=headers, media_type='application/json')
+
+
+def json_endpoint(handler, validate, executor, retry_after=1, metrics=None):
+    """ASGI endpoint decoding and validating a JSON body, then running `handler(data)` on `executor`
+
+    `handler` returns a response body, or a (body, status) pair. Malformed
+    JSON and schema violations are rejected before any model work with a
+    400 naming every field at fault; a full executor answers 429. With
+    `metrics`, successful requests are timed per stage; time on the
+    executor, queueing included, is the `executor` stage.
+    """
+    async def endpoint(request):
+        try:
+            if metrics is not None:
+                start = perf_counter_ns()
+                data = orjson.loads(await request.body())
+                t = metrics.lap('parse', start)
+                validate(data)
+                metrics.lap('validate', t)
+            else:
+                data = validate(orjson.loads(await request.body()))
+        except orjson.JSONDecodeError as e:
+            return json_response({'error': f'invalid JSON: {e}'}, 400)
+        except SchemaError as e:
+            return json_response({'error': str(e), 'errors': e.errors}, 400)
+        try:
+            if metrics is not None:
+                t = perf_counter_ns()
+            result = await executor.run(handler, data)
+        except Overloaded:
+            return json_response({'error': 'model executor is full, retry later'}, 429,
+                                 {'Retry-After': str(retry_after)})
+        except Exception as e:
+            return json_response({'error': str(e)}, 400)
+        if metrics is None:
+            return json_response(*result) if isinstance(result, tuple) else json_response(result)
+        t = metrics.lap('executor', t)
+        response = json_response(*result) if isinstance(result, tuple) else json_response(result)
+        metrics.lap('serialize', t)
+        metrics.lap('request', start)
+        return response
+
+    return endpoint
+
+
+def asgi_app(prefix, endpoints, executor, wsgi_app, metrics=None):
+    """Starlette app serving `endpoints` natively and every other URL through `wsgi_app`
+
+    `endpoints` maps a path under `prefix` to (handler, validator); each is
+    served by `json_endpoint` on POST. The executor's counters are exposed
+    at `<prefix>/executor`. Routes left to the WSGI app, such as stats and
+    admin calls, keep their exact behavior, so the URL contract is that of
+    the WSGI app. `metrics`, if given, times the stages of invocations.
+    """
+    async def executor_stats(request):
+        return json_response(executor.stats())
+
+    @asynccontextmanager
+    async def lifespan(app):
+        yield
+        executor.shutdown()
+
+    routes = [
+        Route(f'{prefix}/{path}', json_endpoint(handler, validate, executor, metrics=metrics if path == 'invocations' else None),
+              methods=['POST'])
+        for path, (handler, validate) in endpoints.items()
+    ]
+    routes.append(Route(f'{prefix}/executor', executor_stats, methods=['GET']))
+    routes.append(Mount('/', app=WSGIMiddleware(wsgi_app)))
+    return Starlette(routes=routes, lifespan=lifespan)
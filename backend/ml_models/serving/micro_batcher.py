@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+class _Pending:
+    __slots__ = ('item', 'enqueued_at', 'done', 'result', 'error')
+
+    def __init__(self, item):
+        self.item = item
+        self.enqueued_at = time.perf_counter()
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class MicroBatcher:
+    """Coalesces concurrent single-item calls into batched model calls
+
+    Request threads call `submit` and block. A dispatcher thread takes the
+    first waiting item, keeps collecting until `max_batch` items are queued
+    or `max_wait_us` microseconds have passed since that item arrived, and
+    scores the whole batch with one `batch_fn(items)` call, which must
+    return one result per item in order. While a batch is being scored new
+    requests keep queueing, so under load batches fill without waiting.
+
+    If a batch call raises, its items are retried one at a time so a single
+    bad request only fails itself.
+    """
+
+    def __init__(self, batch_fn, max_batch=32, max_wait_us=1000):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self.max_wait_us = max_wait_us
+        self.batches = 0
+        self.items = 0
+        self.errors = 0
+        self.queue_wait_seconds = 0.0
+        self.batch_seconds = 0.0
+        self.batch_sizes = np.zeros(max_batch + 1, dtype=np.int64)
+        self._queue = queue.Queue()
+        self._thread = None
+        self._stop = threading.Event()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    @property
+    def pending(self):
+        return self._queue.qsize()
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self._thread
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+    def submit(self, item, timeout=None):
+        """Score one item as part of the next batch and return its result"""
+        pending = _Pending(item)
+        self._queue.put(pending)
+        if not pending.done.wait(timeout):
+            raise TimeoutError(f"no result within {timeout}s")
+        if pending.error is not None:
+            raise pending.error
+        return pending.result
+
+    def _next_batch(self):
+        try:
+            first = self._queue.get(timeout=0.5)
+        except queue.Empty:
+            return None
+        batch = [first]
+        deadline = first.enqueued_at + self.max_wait_us / 1e6
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+                continue
+            except queue.Empty:
+                pass
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while not self._stop.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._score(batch)
+
+    def _score(self, batch):
+        start = time.perf_counter()
+        try:
+            results = self.batch_fn([p.item for p in batch])
+            if len(results) != len(batch):
+                raise ValueError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+            for p, result in zip(batch, results):
+                p.result = result
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0].error = e
+                self.errors += 1
+            else:
+                for p in batch:
+                    try:
+                        p.result = self.batch_fn([p.item])[0]
+                    except Exception as item_error:
+                        p.error = item_error
+                        self.errors += 1
+        end = time.perf_counter()
+
+        self.batches += 1
+        self.items += len(batch)
+        self.batch_sizes[len(batch)] += 1
+        self.batch_seconds += end - start
+        self.queue_wait_seconds += sum(start - p.enqueued_at for p in batch)
+        for p in batch:
+            p.done.set()
+
+    def stats(self):
+        sizes = {int(size): int(count) for size, count in enumerate(self.batch_sizes) if count}
+        return {
+            'running': self.running,
+            'max_batch': self.max_batch,
+            'max_wait_us': self.max_wait_us,
+            'queue_depth': self.pending,
+            'batches': self.batches,
+            'items': self.items,
+            'errors': self.errors,
+            'mean_batch_size': self.items / self.batches if self.batches else None,
+            'batch_size_counts': sizes,
+            'mean_queue_wait_us': self.queue_wait_seconds / self.items * 1e6 if self.items else None,
+            'mean_batch_us': self.batch_seconds / self.batches * 1e6 if self.batches else None,
+        }
@@ -0,0 +1,84 @@
+import multiprocessing
+import os
+import signal
+import threading
+import time
+import traceback
+
+# Queues have to be inherited across gunicorn's fork, never spawned
+FORK = multiprocessing.get_context('fork')
+
+
+def prefork_settings(prefix, default_threads=4):
+    """gunicorn settings for a model server configured by `<prefix>_*` variables
+
+    `<prefix>_WORKERS` request-serving processes (default: one per core),
+    each with `<prefix>_WORKER_THREADS` request threads, bound to
+    `<prefix>_BIND`. The app is imported once in the master and the
+    workers are forked from it, so a model loaded at import or in
+    `on_starting` is shared copy-on-write. With `<prefix>_ASGI=1` the
+    workers run the ASGI app under uvicorn instead, and the request threads
+    become the model executor's threads.
+    """
+    asgi = os.environ.get(f'{prefix}_ASGI') == '1'
+    return {
+        'asgi': asgi,
+        'bind': os.environ.get(f'{prefix}_BIND', '0.0.0.0:8080'),
+        'workers': int(os.environ.get(f'{prefix}_WORKERS', str(os.cpu_count() or 1))),
+        'threads': int(os.environ.get(f'{prefix}_WORKER_THREADS', str(default_threads))),
+        'worker_class': 'uvicorn.workers.UvicornWorker' if asgi else 'gthread',
+        'preload_app': True,
+        'timeout': int(os.environ.get(f'{prefix}_WORKER_TIMEOUT', '60')),
+    }
+
+
+def message_queue(maxsize=0):
+    """Queue from request workers to the learner process; create it before forking"""
+    return FORK.Queue(maxsize)
+
+
+def run_until_terminated(loop, stopping=None):
+    """Run `loop(stopping)` until SIGTERM or SIGINT sets `stopping`"""
+    stopping = stopping or threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stopping.set())
+    loop(stopping)
+
+
+def start_learner_process(target, name):
+    """Fork the single process that owns learning for a prefork server
+
+    A plain fork rather than `multiprocessing.Process`: request workers are
+    forked from the same master afterwards and would otherwise inherit the
+    process handle and try to join it on exit.
+    """
+    pid = os.fork()
+    if pid == 0:
+        code = 0
+        try:
+            target()
+        except BaseException:
+            traceback.print_exc()
+            code = 1
+        finally:
+            os._exit(code)
+    print(f"Started {name} process {pid}")
+    return pid
+
+
+def stop_learner_process(pid, timeout=30):
+    """Ask the learner process to finish its current work and exit"""
+    if pid is None:
+        return
+    try:
+        os.kill(pid, signal.SIGTERM)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if os.waitpid(pid, os.WNOHANG)[0] == pid:
+                return
+            time.sleep(0.1)
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+    except (ProcessLookupError, ChildProcessError):
+        # Already exited and reaped, possibly by gunicorn's SIGCHLD handler
+        pass
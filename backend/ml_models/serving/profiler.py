@@ -0,0 +1,55 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+
+class SamplingProfiler:
+    """On-demand sampling profiler for a running model server
+
+    `profile` wakes every `interval` seconds for `seconds` and records the
+    Python stack of every other thread, rooted at the thread name. Nothing
+    is hooked into the code being profiled, so the cost falls on the
+    sampling thread only while a profile runs. One profile runs at a time.
+
+    `collapsed` renders the counts as one `frame;frame;... count` line per
+    distinct stack, the input format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, max_seconds=60):
+        self.max_seconds = max_seconds
+        self.profiles = 0
+        self._running = threading.Lock()
+
+    def profile(self, seconds=10.0, interval=0.005):
+        if not self._running.acquire(blocking=False):
+            raise RuntimeError('a profile is already running')
+        try:
+            seconds = min(seconds, self.max_seconds)
+            me = threading.get_ident()
+            stacks = Counter()
+            samples = 0
+            deadline = time.monotonic() + seconds
+            while time.monotonic() < deadline:
+                names = {thread.ident: thread.name for thread in threading.enumerate()}
+                for ident, frame in sys._current_frames().items():
+                    if ident == me:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                        frame = frame.f_back
+                    stack.append(names.get(ident, str(ident)))
+                    stacks[';'.join(reversed(stack))] += 1
+                samples += 1
+                time.sleep(interval)
+            self.profiles += 1
+            return stacks, samples
+        finally:
+            self._running.release()
+
+    @staticmethod
+    def collapsed(stacks):
+        return ''.join(f'{stack} {count}\n' for stack, count in stacks.most_common())
@@ -0,0 +1,60 @@
+import os
+import threading
+import time
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def current_rss_bytes():
+    """Resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        if resource is None:
+            return 0
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RunStats:
+    """Wall-clock time and peak resident memory of a block of work
+
+    RSS is sampled from a background thread, so the peak reflects native
+    allocations (XGBoost, NumPy) as well as Python objects.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.wall_seconds = 0.0
+        self.start_rss_bytes = 0
+        self.peak_rss_bytes = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_rss_bytes = max(self.peak_rss_bytes, current_rss_bytes())
+
+    def __enter__(self):
+        self.start_rss_bytes = self.peak_rss_bytes = current_rss_bytes()
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_rss_bytes = max(self.peak_rss_bytes, current_rss_bytes())
+        self.wall_seconds = time.perf_counter() - self._start
+        return False
+
+    def as_dict(self):
+        return {
+            'wall_seconds': round(self.wall_seconds, 3),
+            'peak_rss_mb': round(self.peak_rss_bytes / 2**20, 1),
+            'rss_growth_mb': round((self.peak_rss_bytes - self.start_rss_bytes) / 2**20, 1),
+        }
@@ -0,0 +1,81 @@
+NUMBER = (int, float)
+
+
+class SchemaError(ValueError):
+    """A request body that does not match its schema; `errors` lists every field at fault"""
+
+    def __init__(self, errors):
+        super().__init__('; '.join(errors))
+        self.errors = errors
+
+
+class Field:
+    """One field of a request schema
+
+    `types` is a type or tuple of types; `bool` only matches when listed,
+    even though it is an `int`. `schema` validates a nested object and
+    `items` each element of a list.
+    """
+
+    def __init__(self, types, required=False, nullable=False, schema=None, items=None):
+        self.types = types if isinstance(types, tuple) else (types,)
+        self.required = required
+        self.nullable = nullable
+        self.schema = schema
+        self.items = items
+
+
+def _type_names(types):
+    names = {int: 'integer', float: 'number', str: 'string', bool: 'boolean', dict: 'object', list: 'array'}
+    if int in types and float in types:
+        types = tuple(t for t in types if t is not int)
+    return ' or '.join(names.get(t, t.__name__) for t in types)
+
+
+def compile_schema(fields):
+    """A validator checking a decoded JSON object against `fields` in one pass
+
+    Everything that can be worked out ahead of a request (required names,
+    type tuples, messages, nested validators) is resolved here, so
+    validating is a single walk over the declared fields. Undeclared
+    fields pass through untouched. The validator returns the object, or
+    raises `SchemaError` listing every problem found.
+    """
+    checks = []
+    for name, field in fields.items():
+        rejects_bool = bool not in field.types
+        message = f"'{name}' must be {_type_names(field.types)}"
+        checks.append((name, field.types, rejects_bool, field.required, field.nullable, message,
+                       field.schema, field.items))
+
+    def validate(obj, path=''):
+        if not isinstance(obj, dict):
+            raise SchemaError([f"'{path.rstrip('.')}' must be an object" if path else 'body must be an object'])
+        errors = []
+        for name, types, rejects_bool, required, nullable, message, schema, items in checks:
+            value = obj.get(name)
+            if value is None:
+                if required and name not in obj:
+                    errors.append(f"'{path}{name}' is required")
+                elif name in obj and not nullable:
+                    errors.append(f"'{path}{name}' must not be null")
+                continue
+            if not isinstance(value, types) or (rejects_bool and value.__class__ is bool):
+                errors.append(message if not path else f"'{path}{message[1:]}")
+                continue
+            if schema is not None:
+                try:
+                    schema(value, f'{path}{name}.')
+                except SchemaError as e:
+                    errors.extend(e.errors)
+            elif items is not None:
+                for i, item in enumerate(value):
+                    try:
+                        items(item, f'{path}{name}[{i}].')
+                    except SchemaError as e:
+                        errors.extend(e.errors)
+        if errors:
+            raise SchemaError(errors)
+        return obj
+
+    return validate
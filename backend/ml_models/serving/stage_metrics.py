@@ -0,0 +1,122 @@
+import threading
+import time
+from bisect import bisect_left
+
+perf_counter_ns = time.perf_counter_ns
+
+PROMETHEUS_CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Bucket upper bounds in seconds, 5us to 5s
+DEFAULT_BUCKETS = (
+    5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3, 1e-2, 2.5e-2, 5e-2, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+
+class StageMetrics:
+    """Fixed-bucket latency histograms per serving stage
+
+    Code being timed reads the clock at the start of a stage and calls
+    `lap(stage, start)` at its end, which records the elapsed time and
+    returns the clock reading to start the next stage from. Each thread
+    counts into arrays of its own, so recording takes no lock; `snapshot`
+    sums them when metrics are scraped, folding in threads that have
+    exited. Servers hold None instead of an instance when timing is off, so
+    a disabled hook costs one comparison.
+
+    `render` writes the histograms in the Prometheus text format as
+    `<name>_stage_seconds{stage=...}`. Each process keeps its own
+    histograms; under prefork a scrape sees the worker that answered it.
+    """
+
+    def __init__(self, name, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.buckets = buckets
+        self._bounds = [round(bound * 1e9) for bound in buckets]
+        self._local = threading.local()
+        self._threads = []
+        self._retired = {}
+        self._lock = threading.Lock()
+
+    def _counts(self, stage):
+        """This thread's counts for `stage`, created on first use"""
+        try:
+            stages = self._local.stages
+        except AttributeError:
+            stages = self._local.stages = {}
+            with self._lock:
+                self._threads.append((threading.current_thread(), stages))
+        # One slot per bucket, one for +Inf, then the sum in nanoseconds
+        return stages.setdefault(stage, [0] * (len(self._bounds) + 2))
+
+    def observe(self, stage, elapsed_ns):
+        try:
+            counts = self._local.stages[stage]
+        except (AttributeError, KeyError):
+            counts = self._counts(stage)
+        counts[bisect_left(self._bounds, elapsed_ns)] += 1
+        counts[-1] += elapsed_ns
+
+    def lap(self, stage, start_ns):
+        """Record the time since `start_ns` under `stage` and return the current clock"""
+        # `observe` inlined; this runs several times per request
+        now = perf_counter_ns()
+        elapsed_ns = now - start_ns
+        try:
+            counts = self._local.stages[stage]
+        except (AttributeError, KeyError):
+            counts = self._counts(stage)
+        counts[bisect_left(self._bounds, elapsed_ns)] += 1
+        counts[-1] += elapsed_ns
+        return now
+
+    def snapshot(self):
+        """Per-stage bucket counts, +Inf count and sum in ns, summed over threads"""
+        with self._lock:
+            live = []
+            for thread, stages in self._threads:
+                if thread.is_alive():
+                    live.append((thread, stages))
+                else:
+                    _merge(self._retired, stages)
+            self._threads = live
+            totals = _merge({}, self._retired)
+            for _, stages in live:
+                _merge(totals, stages)
+        return totals
+
+    def stats(self):
+        """Count and mean milliseconds per stage"""
+        return {
+            stage: {'count': sum(counts[:-1]), 'mean_ms': counts[-1] / max(1, sum(counts[:-1])) / 1e6}
+            for stage, counts in sorted(self.snapshot().items())
+        }
+
+    def render(self):
+        """The histograms in the Prometheus text exposition format"""
+        metric = f'{self.name}_stage_seconds'
+        lines = [
+            f'# HELP {metric} Time spent in each stage of serving a request.',
+            f'# TYPE {metric} histogram',
+        ]
+        for stage, counts in sorted(self.snapshot().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                lines.append(f'{metric}_bucket{{stage="{stage}",le="{bound:g}"}} {cumulative}')
+            cumulative += counts[len(self.buckets)]
+            lines.append(f'{metric}_bucket{{stage="{stage}",le="+Inf"}} {cumulative}')
+            lines.append(f'{metric}_sum{{stage="{stage}"}} {counts[-1] / 1e9:.9f}')
+            lines.append(f'{metric}_count{{stage="{stage}"}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+def _merge(into, stages):
+    for stage, counts in list(stages.items()):
+        total = into.get(stage)
+        if total is None:
+            into[stage] = list(counts)
+        else:
+            for i, count in enumerate(counts):
+                total[i] += count
+    return into
@@ -0,0 +1,58 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'fraud_detection'))
+
+from xgboost_model import FraudDetectionXGBoost
+
+MERCHANTS = ['online_retail', 'electronics', 'travel']
+
+
+def transactions(n, seed, start, labeled=True):
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'amount': np.round(rng.lognormal(mean=3.5, sigma=1.0, size=n), 2),
+        'timestamp': (pd.Timestamp(start) + pd.to_timedelta(np.sort(rng.integers(0, 86400, size=n)), unit='s'))
+        .strftime('%Y-%m-%dT%H:%M:%S'),
+        'userId': 'user_' + pd.Series(rng.integers(0, 50, size=n)).astype(str),
+        'merchantCategory': rng.choice(MERCHANTS, size=n),
+        'location': 'New York, NY',
+        'deviceInfo': 'Chrome/Mac',
+        'previousDeclines': 0,
+        'velocityLastHour': 0,
+    })
+    if labeled:
+        df['isFraud'] = (rng.random(n) < 0.1).astype(int)
+    return df
+
+
+def merchant_totals(frames):
+    df = pd.concat(frames, ignore_index=True)
+    return df.groupby('merchantCategory')['isFraud'].agg(['count', 'sum'])
+
+
+def test_update_counts_scored_and_unscored_transactions_once():
+    history = transactions(2000, seed=0, start='2024-01-01')
+    model = FraudDetectionXGBoost()
+    model.train(history, n_estimators=10)
+
+    scored = transactions(300, seed=1, start='2024-01-02', labeled=False)
+    for txn in scored.to_dict('records'):
+        model.predict_fast(txn)
+        model.feature_store.observe(txn)
+
+    scored['isFraud'] = (np.arange(len(scored)) % 4 == 0).astype(int)
+    unscored = transactions(100, seed=2, start='2024-01-03')
+    updated = model.update(pd.concat([scored, unscored], ignore_index=True), num_boost_round=2)
+
+    expected = merchant_totals([history, scored, unscored])
+    probe = pd.DataFrame({'amount': 10.0, 'userId': 'user_0', 'merchantCategory': expected.index})
+    totals = updated.feature_store.totals(probe)
+    assert totals['merchant_tx_count'].tolist() == expected['count'].tolist()
+    assert np.allclose(totals['merchant_fraud_rate'], np.round(expected['sum'] / expected['count'], 4))
+
+    # Each observed transaction takes its label once
+    assert updated.feature_store.apply_labels(scored) == 0
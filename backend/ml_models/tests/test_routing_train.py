@@ -0,0 +1,46 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'routing_bandit'))
+
+import vowpal_wabbit_model as server
+
+CONTEXT = {'amount_log': 2.0, 'risk_score': 0.1, 'region': 'US', 'merchant_type': 'retail'}
+
+
+def outcome_totals():
+    return [outcomes.total for outcomes in server.gateway_stats.outcomes]
+
+
+def test_train_with_client_actions_beyond_gateway_table():
+    server.bandit_model.initialize_model()
+    client = server.app.test_client()
+    actions = [{'success_rate': 95 + i, 'cost': 1.0 + i, 'latency': 100 * (i + 1)} for i in range(5)]
+    before = outcome_totals()
+
+    for chosen_action in (4, 0):
+        response = client.post('/routing-vw-bandit-endpoint-local/train', json={
+            'context_features': CONTEXT, 'actions': actions, 'chosen_action': chosen_action, 'reward': 1.0,
+        })
+        assert response.status_code == 200, response.get_json()
+
+    # A client's own action indices do not name server gateways
+    assert outcome_totals() == before
+
+
+def test_train_with_server_actions_records_outcome():
+    server.bandit_model.initialize_model()
+    client = server.app.test_client()
+    before = outcome_totals()
+
+    response = client.post('/routing-vw-bandit-endpoint-local/train', json={
+        'context_features': CONTEXT, 'chosen_action': 1, 'reward': 1.0,
+    })
+    assert response.status_code == 200, response.get_json()
+    assert outcome_totals() == [before[0], before[1] + 1, before[2]]
+
+    response = client.post('/routing-vw-bandit-endpoint-local/train', json={
+        'context_features': CONTEXT, 'chosen_action': len(server.gateway_stats.gateways), 'reward': 1.0,
+    })
+    assert response.status_code == 400
+    assert outcome_totals() == [before[0], before[1] + 1, before[2]]
@@ -1,52 +1,253 @@
-from flask import Flask, request, jsonify
+"""Stand-in for the SageMaker model endpoints, for running and load-testing the backend
+
+Serves the fraud and routing invocations with the response bodies of
+ml_models/fraud_detection/xgboost_model.py and
+ml_models/routing_bandit/vowpal_wabbit_model.py, and the routing /train
+and /reward calls, without loading any model. Requests wait on the event
+loop rather than a worker thread, so thousands can be in flight at once.
+
+Every draw, from latencies and injected faults to scores and sampled
+actions, comes from generators seeded with MOCK_SEED, one per model. A run
+with the same seed and the same request order gets the same answers.
+
+Each setting below is read as MOCK_FRAUD_<NAME> or MOCK_ROUTING_<NAME>,
+falling back to MOCK_<NAME>:
+
+    LATENCY          latency distribution in ms: constant:<ms>, uniform:<low>,<high>,
+                     exponential:<mean>, lognormal:<median>,<sigma> or pareto:<scale>,<alpha>
+                     (fraud defaults to uniform:100,300, routing to uniform:50,150)
+    TAIL_RATE        share of requests that also wait TAIL_LATENCY (default 0)
+    TAIL_LATENCY     distribution of that extra wait (default pareto:500,1.5)
+    TIMEOUT_RATE     share of requests that hang for TIMEOUT_MS, then answer 504 (default 0)
+    TIMEOUT_MS       how long a timed-out request hangs (default 60000, SageMaker's limit)
+    ERROR_RATE       share of requests answered with ERROR_STATUS after their latency (default 0)
+    ERROR_STATUS     status of injected errors (default 500)
+    THROTTLE_RATE    share of requests answered 429 straight away (default 0)
+    MAX_CONCURRENCY  requests in flight before the rest get 429, like an endpoint's
+                     concurrency quota (default 0, unlimited)
+    RETRY_AFTER      Retry-After seconds sent with a 429 (default 1)
+
+Counters for each model are served at /mock/stats. Run with
+`python mock_sagemaker_server.py`; MOCK_HOST and MOCK_PORT set the address.
+"""
+import asyncio
+import json
+import math
+import os
 import random
-import time
+from collections import OrderedDict
 from datetime import datetime
 
-app = Flask(__name__)
+import uvicorn
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route
+
+SEED = int(os.environ.get('MOCK_SEED', '0'))
+NUM_ACTIONS = 3
+EPSILON = 0.2
+# Decision IDs remembered for /reward, oldest forgotten first
+MAX_DECISIONS = 100000
+
+
+def setting(model, name, default):
+    return os.environ.get(f'MOCK_{model}_{name}', os.environ.get(f'MOCK_{name}', default))
+
+
+def latency_distribution(spec, rng):
+    """Sampler of latencies in seconds for a `kind:param,...` spec in milliseconds"""
+    kind, _, params = spec.partition(':')
+    args = [float(p) for p in params.split(',') if p]
+    if kind == 'constant':
+        return lambda: args[0] / 1e3
+    if kind == 'uniform':
+        return lambda: rng.uniform(args[0], args[1]) / 1e3
+    if kind == 'exponential':
+        return lambda: rng.expovariate(1 / args[0]) / 1e3
+    if kind == 'lognormal':
+        return lambda: rng.lognormvariate(math.log(args[0]), args[1]) / 1e3
+    if kind == 'pareto':
+        return lambda: args[0] * rng.paretovariate(args[1]) / 1e3
+    raise ValueError(f'unknown latency distribution {spec!r}')
+
+
+class ModelEndpoint:
+    """Latency, faults and a concurrency limit in front of one model's handlers
+
+    The event loop is the only thread touching the counters and the
+    generator, so neither needs a lock.
+    """
+
+    def __init__(self, model, default_latency):
+        self.rng = random.Random(f'{SEED}:{model}')
+        self.latency = latency_distribution(setting(model, 'LATENCY', default_latency), self.rng)
+        self.tail_rate = float(setting(model, 'TAIL_RATE', '0'))
+        self.tail_latency = latency_distribution(setting(model, 'TAIL_LATENCY', 'pareto:500,1.5'), self.rng)
+        self.timeout_rate = float(setting(model, 'TIMEOUT_RATE', '0'))
+        self.timeout = float(setting(model, 'TIMEOUT_MS', '60000')) / 1e3
+        self.error_rate = float(setting(model, 'ERROR_RATE', '0'))
+        self.error_status = int(setting(model, 'ERROR_STATUS', '500'))
+        self.throttle_rate = float(setting(model, 'THROTTLE_RATE', '0'))
+        self.max_concurrency = int(setting(model, 'MAX_CONCURRENCY', '0'))
+        self.retry_after = setting(model, 'RETRY_AFTER', '1')
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.counts = {'requests': 0, 'ok': 0, 'bad_request': 0, 'over_capacity': 0, 'throttled': 0,
+                       'timeouts': 0, 'errors': 0}
+
+    def throttled(self):
+        return JSONResponse({'error': 'model executor is full, retry later'}, 429,
+                            {'Retry-After': self.retry_after})
+
+    async def serve(self, request, handler):
+        """Answer `request` with `handler(data, rng)` once the latency and fault draws allow it"""
+        self.counts['requests'] += 1
+        if self.max_concurrency and self.in_flight >= self.max_concurrency:
+            self.counts['over_capacity'] += 1
+            return self.throttled()
+        # Counted before the first await, so requests arriving together cannot all pass the check
+        self.in_flight += 1
+        self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+        try:
+            try:
+                data = json.loads(await request.body())
+            except ValueError as e:
+                self.counts['bad_request'] += 1
+                return JSONResponse({'error': f'invalid JSON: {e}'}, 400)
+            if not isinstance(data, dict):
+                self.counts['bad_request'] += 1
+                return JSONResponse({'error': 'request body must be a JSON object'}, 400)
+
+            rng = self.rng
+            if rng.random() < self.throttle_rate:
+                self.counts['throttled'] += 1
+                return self.throttled()
+            if rng.random() < self.timeout_rate:
+                await asyncio.sleep(self.timeout)
+                self.counts['timeouts'] += 1
+                return JSONResponse({'error': 'model did not respond in time'}, 504)
+            delay = self.latency()
+            if rng.random() < self.tail_rate:
+                delay += self.tail_latency()
+            if rng.random() < self.error_rate:
+                await asyncio.sleep(delay)
+                self.counts['errors'] += 1
+                return JSONResponse({'error': 'injected model error'}, self.error_status)
+            # Drawn before waiting, so answers follow arrival order rather than completion order
+            body, status = handler(data, rng)
+            await asyncio.sleep(delay)
+            self.counts['ok' if status < 400 else 'bad_request'] += 1
+            return JSONResponse(body, status)
+        finally:
+            self.in_flight -= 1
+
+    def stats(self):
+        return dict(self.counts, in_flight=self.in_flight, peak_in_flight=self.peak_in_flight,
+                    max_concurrency=self.max_concurrency)
+
+
+fraud = ModelEndpoint('FRAUD', 'uniform:100,300')
+routing = ModelEndpoint('ROUTING', 'uniform:50,150')
+decisions = OrderedDict()
+
+
+def fraud_score(instance, rng):
+    amount = instance.get('amount') or 0
+    score = 0.05 + (0.3 if amount > 5000 else 0.15 if amount > 1000 else 0)
+    score += rng.uniform(-0.1, 0.1)
+    return min(max(score, 0.01), 0.95)
 
-@app.route('/health', methods=['GET'])
-def health():
-    return jsonify({
+
+def fraud_invocation(data, rng):
+    """Body of the fraud server's /invocations: `predictions` for `instances`, else one `score`"""
+    if 'instances' in data:
+        return {'predictions': [{'score': fraud_score(instance, rng)} for instance in data['instances']]}, 200
+    return {'score': fraud_score(data, rng)}, 200
+
+
+def routing_invocation(data, rng):
+    """Body of the bandit server's /invocations: an epsilon-greedy pick with its pmf and decision_id"""
+    context = data.get('context_features', {})
+    num_actions = len(data.get('actions') or []) or NUM_ACTIONS
+    if context.get('amount_log', 5) < 2:
+        best = min(2, num_actions - 1)
+    elif context.get('risk_score', 0) > 0.5:
+        best = 0
+    else:
+        best = rng.randrange(num_actions)
+    pmf = [EPSILON / num_actions] * num_actions
+    pmf[best] += 1 - EPSILON
+    chosen = rng.choices(range(num_actions), weights=pmf)[0]
+
+    decision_id = f'{rng.getrandbits(128):032x}'
+    decisions[decision_id] = chosen
+    if len(decisions) > MAX_DECISIONS:
+        decisions.popitem(last=False)
+    return {
+        'chosen_action': chosen,
+        'action_probability': pmf[chosen],
+        'exploration': pmf[chosen] < max(pmf),
+        'expected_reward': pmf[chosen],
+        'all_probabilities': pmf,
+        'decision_id': decision_id,
+    }, 200
+
+
+def routing_train(data, rng):
+    if data.get('chosen_action') is None or data.get('reward') is None:
+        return {'error': 'chosen_action and reward required for training'}, 400
+    return {'status': 'training_completed'}, 200
+
+
+def routing_reward(data, rng):
+    decision_id = data.get('decision_id')
+    if decision_id is None or data.get('reward') is None:
+        return {'error': 'decision_id and reward required'}, 400
+    if decisions.pop(decision_id, None) is None:
+        return {'error': f'unknown or expired decision {decision_id}'}, 404
+    return {'status': 'training_completed'}, 200
+
+
+def model_route(path, endpoint, handler):
+    async def route(request):
+        return await endpoint.serve(request, handler)
+    return Route(path, route, methods=['POST'])
+
+
+async def health(request):
+    return JSONResponse({
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat()
     })
 
-@app.route('/fraud-xgboost-endpoint-local/invocations', methods=['POST'])
-def fraud_xgboost():
-    data = request.get_json(force=True)
-    time.sleep(0.1 + random.random() * 0.2)
-    instances = data.get('instances', [data])
-    predictions = []
-    for inst in instances:
-        amount = inst.get('amount', 0)
-        score = 0.05 + (0.3 if amount > 5000 else 0.15 if amount > 1000 else 0)
-        score += random.uniform(-0.1, 0.1)
-        score = min(max(score, 0.01), 0.95)
-        predictions.append({'score': round(score, 4)})
-    return jsonify({'predictions': predictions})
-
-@app.route('/routing-vw-bandit-endpoint-local/invocations', methods=['POST'])
-def routing_vw():
-    data = request.get_json(force=True)
-    time.sleep(0.05 + random.random() * 0.1)
-    ctx = data.get('context_features', {})
-    amt_log = ctx.get('amount_log', 5)
-    risk = ctx.get('risk_score', 0)
-    if amt_log < 4:
-        action = 2 
-    elif risk > 0.5:
-        action = 0 
-    else:
-        action = random.choice([0,1,2])
-    prob = round(0.7 + random.uniform(0,0.2), 4)
-    return jsonify({
-        'action_id': action,
-        'probability': prob,
-        'exploration': prob < 0.8,
-        'expected_reward': round(0.8 + random.uniform(0,0.15), 4)
-    })
+
+async def fraud_ping(request):
+    return JSONResponse({'status': 'healthy', 'model_version': 'mock'})
+
+
+async def routing_ping(request):
+    return JSONResponse({'status': 'healthy'})
+
+
+async def mock_stats(request):
+    return JSONResponse({'seed': SEED, 'fraud': fraud.stats(), 'routing': routing.stats(),
+                         'decisions_held': len(decisions)})
+
+
+app = Starlette(routes=[
+    Route('/health', health),
+    Route('/ping', routing_ping),
+    Route('/fraud-xgboost-endpoint-local/ping', fraud_ping),
+    Route('/routing-vw-bandit-endpoint-local/ping', routing_ping),
+    Route('/mock/stats', mock_stats),
+    model_route('/fraud-xgboost-endpoint-local/invocations', fraud, fraud_invocation),
+    model_route('/routing-vw-bandit-endpoint-local/invocations', routing, routing_invocation),
+    model_route('/routing-vw-bandit-endpoint-local/train', routing, routing_train),
+    model_route('/routing-vw-bandit-endpoint-local/reward', routing, routing_reward),
+])
 
 if __name__ == '__main__':
-    print("🚀 Mock SageMaker Server running on port 8080")
-    app.run(host='0.0.0.0', port=8080)
+    port = int(os.environ.get('MOCK_PORT', '8080'))
+    print(f"Mock SageMaker server running on port {port}, seed {SEED}")
+    uvicorn.run(app, host=os.environ.get('MOCK_HOST', '0.0.0.0'), port=port, log_level='warning',
+                access_log=False, backlog=4096)
@@ -71,8 +71,10 @@ export class RoutingService {
       // Get real-time gateway performance metrics
       const gatewayMetrics = await this.getGatewayMetrics();
       
-      // Call Vowpal Wabbit contextual bandit model
-      const banditDecision = await this.callVowpalWabbitBandit(contextFeatures, gatewayMetrics);
+      // Call Vowpal Wabbit contextual bandit model; gateway stats are kept server-side.
+      // If the model is unavailable, fall back to epsilon-greedy selection on local metrics
+      const banditDecision = await this.callVowpalWabbitBandit(contextFeatures)
+        ?? this.epsilonGreedySelection(contextFeatures, gatewayMetrics);
       
       // Build response with gateway recommendation
       const response = this.buildRoutingResponse(banditDecision, gatewayMetrics, request);
@@ -98,21 +100,12 @@ export class RoutingService {
     }
   }
 
-  private static async callVowpalWabbitBandit(context: any, metrics: any[]): Promise<any> {
+  private static async callVowpalWabbitBandit(context: any): Promise<any | null> {
     try {
-      // Format for VW contextual bandit (--cb_explore_adf format)
+      // The bandit server builds each gateway's action features from its own
+      // rolling stats, so only the context is sent
       const vwPayload = {
-        context_features: context,
-        actions: this.GATEWAYS.map(gateway => ({
-          action_id: gateway.id,
-          features: {
-            success_rate: metrics[gateway.id]?.successRate || gateway.baseSuccessRate,
-            cost: metrics[gateway.id]?.cost || gateway.baseCost,
-            latency: metrics[gateway.id]?.latency || gateway.baseLatency,
-            supports_region: gateway.regions.includes(context.region) ? 1 : 0,
-            supports_amount: context.amount <= 50000 ? 1 : 0  // Some gateways have limits
-          }
-        }))
+        context_features: context
       };
 
       const command = new InvokeEndpointCommand({
@@ -125,17 +118,16 @@ export class RoutingService {
       const result = JSON.parse(Buffer.from(response.Body!).toString());
       
       return {
-        chosen_action: result.action_id || 0,
-        action_probability: result.probability || 0.5,
+        chosen_action: result.chosen_action ?? 0,
+        action_probability: result.action_probability ?? 0.5,
         exploration: result.exploration || false,
-        expected_reward: result.expected_reward || 0.8
+        expected_reward: result.expected_reward ?? 0.8,
+        decision_id: result.decision_id
       };
 
     } catch (error:any) {
       logger.warn('VW Bandit model call failed', { error: error.message });
-      
-      // Fallback to epsilon-greedy selection
-      return this.epsilonGreedySelection(context, metrics);
+      return null;
     }
   }
 